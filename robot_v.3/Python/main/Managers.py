@@ -1,6 +1,9 @@
 import configparser
+import heapq
+import itertools
 import json
 import time
+from multiprocessing import Lock, RawArray, RawValue
 
 import numpy as np
 
@@ -32,26 +35,324 @@ class ConfigManager:
 
 
 class Timer:
+    # Timers are stored as end times on the monotonic perf_counter clock, so getting one is a single dict lookup.
+    # Timers set with a callback are also pushed onto a heap and the callback runs once they expired.
     def __init__(self):
-        self.__timer_arr = np.array([["none", 1, 0, 0]])
+        self.__end_times = {}
+        self.__callbacks = []  # Heap of (end_time, order, name, callback)
+        self.__order = itertools.count()
 
     def remove_timer(self, name):
-        self.__timer_arr = self.__timer_arr[np.where(self.__timer_arr[:, 0] != name)]
+        self.__end_times.pop(name, None)
 
-    def set_timer(self, name, set_time):
-        self.remove_timer(name)
-        self.__timer_arr = np.append(self.__timer_arr, [[name, time.perf_counter(), set_time, False]], axis=0)
+    def set_timer(self, name, set_time, callback=None):
+        end_time = time.perf_counter() + set_time
+        self.__end_times[name] = end_time
 
-    def __update_timer(self):
-        for i, timer in enumerate(self.__timer_arr):
-            if not timer[0] == "none":
-                self.__timer_arr[i, 3] = (time.perf_counter() - float(timer[1])) > float(timer[2])
+        if callback is not None:
+            heapq.heappush(self.__callbacks, (end_time, next(self.__order), name, callback))
+
+    def run_callbacks(self):
+        now = time.perf_counter()
+        while self.__callbacks and self.__callbacks[0][0] < now:
+            end_time, _, name, callback = heapq.heappop(self.__callbacks)
+
+            # Skip callbacks of timers that were removed or set again in the meantime
+            if self.__end_times.get(name) == end_time:
+                callback()
 
     def get_timer(self, name):
-        self.__update_timer()
-        time_val = self.__timer_arr[np.where(self.__timer_arr[:, 0] == name), 3]
+        if self.__callbacks:
+            self.run_callbacks()
 
-        if time_val.size > 0:
-            return time_val[0][0] == "True"
-        else:
+        end_time = self.__end_times.get(name)
+        if end_time is None:
             return False
+        return time.perf_counter() > end_time
+
+
+class StageTimer:
+    # Durations of the named stages of a frame: "with stage_timer("name"):" around each stage, stages can be nested.
+    # Disabled it only costs the with statement, enabled the benchmark collects the times in seconds per stage.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.times = {}
+        self.__names = []
+        self.__start_times = []
+
+    def __call__(self, name):
+        self.__names.append(name)
+        return self
+
+    def __enter__(self):
+        if self.enabled:
+            self.__start_times.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exception):
+        name = self.__names.pop()
+        if self.enabled:
+            self.times.setdefault(name, []).append(time.perf_counter() - self.__start_times.pop())
+        return False
+
+    def clear(self):
+        self.times = {}
+
+
+class TimeSeries:
+    # Preallocated ring buffer of (time, value) samples, appending never reallocates.
+    # Samples are appended in time order, so both halves of the ring stay sorted by time and a time window
+    # can be found with a binary search instead of masking the whole buffer.
+    def __init__(self, length=240):
+        self.__times = np.zeros(length)
+        self.__values = np.zeros(length)
+        self.__length = length
+        self.__index = 0  # Position of the oldest sample, the next one is written here
+
+    def clear(self):
+        self.__times[:] = 0
+        self.__values[:] = 0
+        self.__index = 0
+
+    def fill(self, value, fill_time=0):
+        self.__times[:fill_time] = 0
+        self.__times[fill_time:] = time.perf_counter()
+        self.__values[:] = value
+        self.__index = 0
+
+    def append(self, value):
+        self.__times[self.__index] = time.perf_counter()
+        self.__values[self.__index] = value
+        self.__index = (self.__index + 1) % self.__length
+
+    def __window(self, time_range):
+        # Returns the newest samples inside the time range as up to two slices of the value array
+        cutoff = time.perf_counter() - time_range
+        index = self.__index
+
+        newest = index - np.searchsorted(self.__times[:index], cutoff, side='right')
+        if newest < index:
+            return self.__values[index - newest:index], self.__values[:0]
+
+        oldest = self.__length - index - np.searchsorted(self.__times[index:], cutoff, side='right')
+        return self.__values[:index], self.__values[self.__length - oldest:]
+
+    def average(self, time_range):
+        newest, oldest = self.__window(time_range)
+        count = newest.size + oldest.size
+        if count > 0:
+            return (np.sum(newest) + np.sum(oldest)) / count
+        else:
+            return -1
+
+    def max(self, time_range):
+        newest, oldest = self.__window(time_range)
+        if newest.size + oldest.size > 0:
+            return max(np.max(newest, initial=-np.inf), np.max(oldest, initial=-np.inf))
+        else:
+            return -1
+
+
+class SensorHistory:
+    # One preallocated ring for many channels: a shared time column and one value column per channel.
+    # A row is appended for all channels at once, a mask marks which channels actually got a sample in that row.
+    def __init__(self, channels, length=2400):
+        self.__columns = {name: i for i, name in enumerate(channels)}
+        self.__times = np.zeros(length)
+        self.__values = np.zeros((length, len(channels)))
+        self.__valid = np.zeros((length, len(channels)), dtype=bool)
+        self.__length = length
+        self.__index = 0  # Position of the oldest row, the next one is written here
+
+        # Filled channels act like count samples of value taken at fill time, pushed out by newer samples
+        self.__fill_times = np.full(len(channels), -np.inf)
+        self.__fill_values = np.zeros(len(channels))
+        self.__fill_counts = np.zeros(len(channels))
+
+    def __get_columns(self, names):
+        if names is None:
+            return np.arange(len(self.__columns))
+        return np.array([self.__columns[name] for name in names])
+
+    def append(self, values, mask=None):
+        index = self.__index
+        self.__times[index] = time.perf_counter()
+        if mask is None:
+            self.__values[index] = values
+            self.__valid[index] = True
+        else:
+            self.__values[index] = np.where(mask, values, 0)
+            self.__valid[index] = mask
+        self.__index = (index + 1) % self.__length
+
+    def append_channels(self, **values):
+        row = np.zeros(len(self.__columns))
+        mask = np.zeros(len(self.__columns), dtype=bool)
+        columns = self.__get_columns(values.keys())
+        row[columns] = list(values.values())
+        mask[columns] = True
+        self.append(row, mask)
+
+    def clear(self, names=None):
+        columns = self.__get_columns(names)
+        self.__values[:, columns] = 0
+        self.__valid[:, columns] = False
+        self.__fill_times[columns] = -np.inf
+
+    def fill(self, names, value, count=240):
+        columns = self.__get_columns(names)
+        self.clear(names)
+        self.__fill_times[columns] = time.perf_counter()
+        self.__fill_values[columns] = value
+        self.__fill_counts[columns] = count
+
+    def __window(self, cutoff):
+        # Rows are written in time order, so both halves of the ring are sorted by time
+        index = self.__index
+
+        newest = index - np.searchsorted(self.__times[:index], cutoff, side='right')
+        if newest < index:
+            return (slice(index - newest, index),)
+
+        oldest = self.__length - index - np.searchsorted(self.__times[index:], cutoff, side='right')
+        return slice(0, index), slice(self.__length - oldest, self.__length)
+
+    def average(self, names, time_range):
+        single = isinstance(names, str)
+        columns = self.__get_columns([names] if single else names)
+        cutoff = time.perf_counter() - time_range
+
+        sums = np.zeros(len(columns))
+        counts = np.zeros(len(columns))
+        for rows in self.__window(cutoff):
+            sums += np.sum(self.__values[rows][:, columns], axis=0)
+            counts += np.count_nonzero(self.__valid[rows][:, columns], axis=0)
+
+        # Fill samples that were not pushed out by newer samples yet
+        fill_counts = np.where(self.__fill_times[columns] > cutoff, np.maximum(self.__fill_counts[columns] - counts, 0), 0)
+        sums += fill_counts * self.__fill_values[columns]
+        counts += fill_counts
+
+        averages = np.divide(sums, counts, out=np.full(len(columns), -1.), where=counts > 0)
+        return averages[0] if single else averages
+
+
+class SharedValue:
+    def __init__(self, state, name, index, kind, names=None, unknown=None):
+        self.__state = state
+        self.__data = state.data
+        self.__name = name
+        self.__index = index
+        self.__kind = kind
+        self.__names = names
+        self.__codes = {n: float(i) for i, n in enumerate(names)} if names is not None else None
+        self.__unknown = self.__codes[unknown] if unknown is not None else None  # Code stored for values not in names
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def value(self):
+        if self.__kind is str and self.__names is None:
+            return self.__state.snapshot(self.__name)[self.__name]
+        return self.load()
+
+    @value.setter
+    def value(self, value):
+        if self.__kind is str and self.__names is None:
+            self.__state.publish(**{self.__name: value})
+        else:
+            # A single aligned 8 byte store, readers never see half of it
+            self.store(value)
+
+    def load(self):
+        if self.__names is not None:
+            return self.__names[int(self.__data[self.__index])]
+        elif self.__kind is str:
+            return self.__state.load_text(self.__index)
+        return self.__kind(self.__data[self.__index])
+
+    def store(self, value):
+        if self.__names is not None:
+            try:
+                self.__data[self.__index] = self.__codes[value]
+            except KeyError:
+                if self.__unknown is not None:
+                    self.__data[self.__index] = self.__unknown
+                    return
+                raise ValueError(f"{value!r} is not a valid value for {self.__name}, expected one of {self.__names}")
+        elif self.__kind is str:
+            self.__state.store_text(self.__index, value)
+        else:
+            self.__data[self.__index] = value
+
+
+class SharedState:
+    # Fixed layout block of shared memory, allocated before the processes are forked.
+    # Numeric fields (bool, int, float) live in one float64 array, string states are stored as interned enum codes.
+    # Single field reads and writes are lock-free. Multi-field writes go through a seqlock, so snapshot() never
+    # returns values from two different writes.
+    def __init__(self, size=128, text_size=512):
+        self.data = RawArray('d', size)
+        self.__text = RawArray('c', text_size)
+        self.__sequence = RawValue('Q', 0)  # Odd while a write is in progress
+        self.__write_lock = Lock()
+        self.__values = {}
+        self.__text_slots = []
+
+    def add(self, name, default, kind=None, names=None, unknown=None, text_length=128):
+        if name in self.__values:
+            raise ValueError(f"{name} is already part of the shared state")
+
+        kind = type(default) if kind is None else kind
+
+        if kind is str and names is None:
+            start = self.__text_slots[-1][1] if self.__text_slots else 0
+            if start + text_length > len(self.__text):
+                raise ValueError(f"Not enough text memory left for {name}")
+            index = len(self.__text_slots)
+            self.__text_slots.append((start, start + text_length))
+        else:
+            index = len(self.__values) - len(self.__text_slots)
+            if index >= len(self.data):
+                raise ValueError(f"Shared state is full ({len(self.data)} fields)")
+
+        shared_value = SharedValue(self, name, index, kind, names, unknown)
+        self.__values[name] = shared_value
+        shared_value.value = default
+        return shared_value
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_SharedState__values"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def publish(self, **values):
+        with self.__write_lock:
+            self.__sequence.value += 1
+            try:
+                for name, value in values.items():
+                    self.__values[name].store(value)
+            finally:
+                # Even after an invalid value, readers must not wait for the write forever
+                self.__sequence.value += 1
+
+    def snapshot(self, *names):
+        shared_values = [self.__values[name] for name in names] if names else list(self.__values.values())
+        while True:
+            sequence = self.__sequence.value
+            if sequence % 2 == 0:
+                values = {shared_value.name: shared_value.load() for shared_value in shared_values}
+                if self.__sequence.value == sequence:
+                    return values
+
+    def store_text(self, index, text):
+        start, end = self.__text_slots[index]
+        encoded = str(text).encode()[:end - start - 1] + b"\0"
+        self.__text[start:start + len(encoded)] = encoded
+
+    def load_text(self, index):
+        start, end = self.__text_slots[index]
+        return self.__text[start:end].split(b"\0", 1)[0].decode(errors="ignore")
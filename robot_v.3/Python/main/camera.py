@@ -0,0 +1,371 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameCapture:
+    # Captures and converts frames in a background thread into a preallocated triple buffer.
+    # The writer always uses a buffer that is neither the latest frame nor the one being processed, so read()
+    # returns views into the buffer without copying and processing always starts on the freshest frame.
+    def __init__(self, capture, convert, raw_shape, image_shape, buffers=3, close=None):
+        self.__capture = capture  # Returns a new frame from the camera
+        self.__convert = convert  # Writes the converted frame into (raw, image)
+        self.__close = close  # Releases the camera after the capture thread stopped
+
+        self.__raw = np.zeros((buffers, *raw_shape), dtype=np.uint8) if raw_shape is not None else None
+        self.__images = np.zeros((buffers, *image_shape), dtype=np.uint8)
+        self.__frame_ids = np.full(buffers, -1, dtype=np.int64)
+        self.__frame_times = np.zeros(buffers)
+
+        self.__latest = -1
+        self.__reading = -1
+        self.__last_read_id = -1
+
+        self.__new_frame = threading.Condition()
+        self.__thread = None
+        self.__running = False
+        self.__error = None
+
+        # Latency counters in seconds, averaged over the last frames
+        self.__stats = {"capture": 0., "convert": 0., "wait": 0., "age": 0., "fps": 0., "captured": 0, "dropped": 0}
+
+    def start(self):
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__capture_loop, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        with self.__new_frame:
+            self.__new_frame.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
+        if self.__close is not None:
+            self.__close()
+
+    @property
+    def stats(self):
+        return dict(self.__stats)
+
+    def __average(self, name, value, weight=.1):
+        self.__stats[name] += (value - self.__stats[name]) * weight
+
+    def __capture_loop(self):
+        frame_id = 0
+        last_frame_time = time.perf_counter()
+
+        try:
+            while self.__running:
+                start_time = time.perf_counter()
+                frame = self.__capture()
+                capture_time = time.perf_counter()
+
+                with self.__new_frame:
+                    slot = next(i for i in range(len(self.__frame_ids)) if i != self.__latest and i != self.__reading)
+
+                self.__convert(frame, self.__raw[slot] if self.__raw is not None else None, self.__images[slot])
+                convert_time = time.perf_counter()
+
+                with self.__new_frame:
+                    if self.__latest != -1 and self.__frame_ids[self.__latest] > self.__last_read_id:
+                        self.__stats["dropped"] += 1
+
+                    self.__frame_ids[slot] = frame_id
+                    self.__frame_times[slot] = capture_time
+                    self.__latest = slot
+
+                    self.__average("capture", capture_time - start_time)
+                    self.__average("convert", convert_time - capture_time)
+                    self.__average("fps", 1 / max(capture_time - last_frame_time, 1e-6))
+                    self.__stats["captured"] += 1
+
+                    self.__new_frame.notify_all()
+
+                last_frame_time = capture_time
+                frame_id += 1
+        except Exception as e:
+            self.__error = e
+            self.__running = False
+            with self.__new_frame:
+                self.__new_frame.notify_all()
+
+    def read(self, timeout=1.):
+        # Returns (raw, image, frame_id, capture_time) of a frame that was not read before, raw is None without a raw buffer.
+        # The arrays stay valid until the next call of read().
+        start_time = time.perf_counter()
+
+        with self.__new_frame:
+            if not self.__new_frame.wait_for(lambda: not self.__running or (self.__latest != -1 and self.__frame_ids[self.__latest] > self.__last_read_id), timeout):
+                raise TimeoutError(f"No new frame within {timeout} s")
+            if self.__error is not None:
+                raise self.__error
+            if not self.__running:
+                raise RuntimeError("Frame capture is not running")
+
+            self.__reading = self.__latest
+            self.__last_read_id = int(self.__frame_ids[self.__reading])
+            capture_time = self.__frame_times[self.__reading]
+
+            read_time = time.perf_counter()
+            self.__average("wait", read_time - start_time)
+            self.__average("age", read_time - capture_time)
+
+        raw = self.__raw[self.__reading] if self.__raw is not None else None
+        return raw, self.__images[self.__reading], self.__last_read_id, capture_time
+
+
+def configure_native_stream(camera, create_configuration, size, stream="main", **kwargs):
+    # Asks the ISP for BGR (main, "RGB888") or YUV420 (lores) frames at the processing resolution.
+    # Returns False if the camera can't deliver them, the caller then configures the full size stream instead.
+    stream_format = "RGB888" if stream == "main" else "YUV420"
+
+    try:
+        camera.configure(create_configuration(**{stream: {"size": size, "format": stream_format}}, **kwargs))
+        configured = camera.camera_configuration()[stream]
+    except Exception as e:
+        print(f"Native {stream} stream not available: {e}")
+        return False
+
+    if tuple(configured["size"]) != tuple(size) or configured["format"] != stream_format:
+        print(f"Native {stream} stream not available: got {configured['format']} {configured['size']}")
+        return False
+
+    return True
+
+
+def convert_native(frame, stream="main", image=None):
+    # Frames of the native main stream already are BGR at the processing resolution
+    if stream == "main":
+        if image is None:
+            return frame
+        np.copyto(image, frame)
+        return image
+    return cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420, dst=image)
+
+
+########################################################################################################################
+# Frame Sources
+########################################################################################################################
+
+# Frame sources only deliver frames, FrameCapture runs them in its thread: capture() returns the next frame and
+# convert(frame, raw, image) writes it into the buffers, image is BGR in image_shape, cropped by crop_top rows.
+
+
+class PicameraSource:
+    # Camera of the Raspberry Pi through Picamera2, picamera2 and libcamera are only imported when it is opened
+    def __init__(self, size, index=0, native_stream=True, stream="main", configuration="video", sensor_mode=None, buffer_count=None,
+                 controls=None, crop_top=0, keep_raw=False):
+        self.size = size  # Processing resolution (width, height)
+        self.index = index
+        self.stream = stream
+        self.configuration = configuration  # "video" or "preview"
+        self.sensor_mode = sensor_mode  # Index into the sensor modes, None lets libcamera choose
+        self.buffer_count = buffer_count
+        self.controls = controls or {}  # Enum values can be given by name, e.g. {"AfMode": "Manual"}
+        self.crop_top = crop_top
+        self.keep_raw = keep_raw  # Keep the resized RGBA frame in raw when the frame is converted on the CPU
+
+        self.native_stream = native_stream
+        self.raw_shape = None
+        self.image_shape = (size[1] - crop_top, size[0], 3)
+
+        self.__camera = None
+
+    def open(self):
+        os.environ["LIBCAMERA_LOG_LEVELS"] = "4"
+        from libcamera import controls
+        from picamera2 import Picamera2
+
+        # Disable libcamera and Picamera2 logging
+        Picamera2.set_logging(Picamera2.ERROR)
+
+        self.__camera = Picamera2(self.index)
+        create_configuration = self.__camera.create_video_configuration if self.configuration == "video" else self.__camera.create_preview_configuration
+
+        kwargs = {}
+        if self.sensor_mode is not None:
+            mode = self.__camera.sensor_modes[self.sensor_mode]
+            kwargs["sensor"] = {'output_size': mode['size'], 'bit_depth': mode['bit_depth']}
+        if self.buffer_count is not None:
+            kwargs["buffer_count"] = self.buffer_count
+
+        # Get the frames in the processing resolution from the ISP if possible, otherwise resize them on the CPU
+        self.native_stream = self.native_stream and configure_native_stream(self.__camera, create_configuration, self.size, self.stream, **kwargs)
+        if not self.native_stream:
+            self.__camera.configure(create_configuration(**kwargs))
+            self.stream = "main"
+            if self.keep_raw:
+                self.raw_shape = (self.size[1], self.size[0], 4)
+
+        self.__camera.start()
+        if self.controls:
+            self.__camera.set_controls({name: getattr(getattr(controls, f"{name}Enum"), value) if isinstance(value, str) else value for name, value in self.controls.items()})
+            time.sleep(0.1)
+
+    def close(self):
+        if self.__camera is not None:
+            self.__camera.stop()
+            self.__camera.close()
+            self.__camera = None
+
+    def capture(self):
+        return self.__camera.capture_array(self.stream)
+
+    def convert(self, frame, raw, image):
+        if self.native_stream:
+            if self.crop_top == 0:
+                convert_native(frame, self.stream, image)
+            else:
+                np.copyto(image, convert_native(frame, self.stream)[self.crop_top:])
+            return
+
+        if raw is not None:
+            cv2.resize(frame, self.size, dst=raw)
+            frame = raw
+        elif frame.shape[:2] != (self.size[1], self.size[0]):
+            frame = cv2.resize(frame, self.size)
+        cv2.cvtColor(frame[self.crop_top:], cv2.COLOR_RGBA2BGR, dst=image)
+
+
+class VideoCaptureSource:
+    # USB or other V4L2 camera through OpenCV, device is an index or a path like /dev/video0
+    def __init__(self, size, device=0, fourcc=None, fps=None, buffer_count=None, crop_top=0):
+        self.size = size
+        self.device = device
+        self.fourcc = fourcc  # e.g. "MJPG", most USB cameras only reach their full frame rate with it
+        self.fps = fps
+        self.buffer_count = buffer_count
+        self.crop_top = crop_top
+
+        self.raw_shape = None
+        self.image_shape = (size[1] - crop_top, size[0], 3)
+
+        self.__capture = None
+
+    def open(self):
+        self.__capture = cv2.VideoCapture(self.device, cv2.CAP_V4L2)
+        if not self.__capture.isOpened():
+            self.__capture = cv2.VideoCapture(self.device)
+        if not self.__capture.isOpened():
+            raise IOError(f"Camera {self.device} could not be opened")
+
+        if self.fourcc:
+            self.__capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        self.__capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.size[0])
+        self.__capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.size[1])
+        if self.fps:
+            self.__capture.set(cv2.CAP_PROP_FPS, self.fps)
+        if self.buffer_count is not None:
+            self.__capture.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_count)
+
+    def close(self):
+        if self.__capture is not None:
+            self.__capture.release()
+            self.__capture = None
+
+    def capture(self):
+        ok, frame = self.__capture.read()
+        if not ok:
+            raise IOError(f"No frame from camera {self.device}")
+        return frame
+
+    def convert(self, frame, raw, image):
+        if frame.shape[:2] != (self.size[1], self.size[0]):
+            frame = cv2.resize(frame, self.size)
+        np.copyto(image, frame[self.crop_top:])
+
+
+class SyntheticSource:
+    # Generated frames of a black line with a green marker on a white floor, for running the loops without a camera.
+    # The frames only depend on the frame number, so every run sees the same sequence.
+    def __init__(self, size, fps=50, crop_top=0, seed=0):
+        self.size = size
+        self.fps = fps  # 0 delivers the frames as fast as they are read
+        self.crop_top = crop_top
+        self.seed = seed
+
+        self.raw_shape = None
+        self.image_shape = (size[1] - crop_top, size[0], 3)
+
+        self.__frame_number = 0
+        self.__next_time = 0.
+
+    def open(self):
+        self.__frame_number = 0
+        self.__next_time = time.perf_counter()
+
+    def close(self):
+        pass
+
+    def capture(self):
+        if self.fps:
+            self.__next_time += 1 / self.fps
+            time.sleep(max(self.__next_time - time.perf_counter(), 0))
+
+        frame = synthetic_frame(self.size, self.__frame_number, self.seed)
+        self.__frame_number += 1
+        return frame
+
+    def convert(self, frame, raw, image):
+        np.copyto(image, frame[self.crop_top:])
+
+
+def synthetic_frame(size, frame_number, seed=0):
+    width, height = size
+    rng = np.random.default_rng((seed, frame_number))
+
+    frame = np.full((height, width, 3), 200, dtype=np.uint8)
+    frame += rng.integers(0, 25, frame.shape, dtype=np.uint8)  # Sensor noise
+
+    # Line that curves slowly from frame to frame, scrolling down like the floor under a driving robot
+    phase = frame_number * .05
+    y = np.arange(0, height + 10, 10)
+    x = width / 2 + width * .2 * np.sin(phase + y / height * 2.5) + width * .1 * np.sin(phase * .3)
+    cv2.polylines(frame, [np.column_stack((x, y)).astype(np.int32)], False, (20, 20, 20), max(width // 16, 1))
+
+    # Green marker next to the line in every other stretch of 50 frames
+    if frame_number // 50 % 2:
+        marker_y = int(height * .6)
+        marker_x = int(x[marker_y // 10])
+        side = 1 if frame_number // 100 % 2 else -1
+        marker = width // 8
+        x0 = marker_x + side * (width // 32 + marker) - marker // 2
+        cv2.rectangle(frame, (x0, marker_y), (x0 + marker, marker_y + marker), (40, 160, 40), -1)
+
+    return frame
+
+
+def open_frame_source(config_manager, name, size, crop_top=0, keep_raw=False, controls=None, configuration="video"):
+    # Frames for the camera section camera_<name> of the config, source picks picamera (default), v4l2, synthetic or replay.
+    # Returns a started object with read() -> (raw, image, frame_id, capture_time) and stop().
+    section = f"camera_{name}"
+
+    def read(key, default=None):
+        value = config_manager.read_variable(section, key)
+        return default if value is None or value == "" else value
+
+    source_type = read('source', "picamera")
+    if source_type == "replay":
+        from recording import FrameReplay
+        capture = FrameReplay(config_manager.read_variable('replay', f"{name}_path"), realtime=bool(config_manager.read_variable('replay', 'realtime')))
+        capture.start()
+        return capture
+
+    if source_type == "picamera":
+        source = PicameraSource(size, index=read('index', 0), native_stream=bool(read('native_stream', True)), stream=read('stream', "main"),
+                                configuration=read('configuration', configuration), sensor_mode=read('sensor_mode'), buffer_count=read('buffer_count'),
+                                controls=controls, crop_top=crop_top, keep_raw=keep_raw)
+    elif source_type == "v4l2":
+        source = VideoCaptureSource(size, device=read('device', 0), fourcc=read('fourcc'), fps=read('fps'), buffer_count=read('buffer_count'), crop_top=crop_top)
+    elif source_type == "synthetic":
+        source = SyntheticSource(size, fps=read('fps', 50), crop_top=crop_top)
+    else:
+        raise ValueError(f"Unknown frame source {source_type} in [{section}]")
+
+    source.open()
+    capture = FrameCapture(source.capture, source.convert, source.raw_shape, source.image_shape, close=source.close)
+    capture.start()
+    return capture
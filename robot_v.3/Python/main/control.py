@@ -3,8 +3,9 @@ from math import isclose, pow
 
 from gpiozero import Button, LED, PWMLED
 
-from Managers import Timer
+from Managers import SensorHistory, Timer
 from line_cam import camera_x, camera_y
+from motion import StuckDetector
 from mp_manager import *
 
 print_obstacle = False
@@ -29,25 +30,26 @@ turn_around_45 = False
 # average time variables
 time_last_angles = empty_time_arr()
 
-time_last_gyro_y = empty_time_arr()
-time_last_gyro_x = empty_time_arr()
-time_last_gyro_z = empty_time_arr()
+# Shared values recorded every tick, the victim type is derived from ball_type and recorded last
+sensor_history_sources = ["sensor_one", "sensor_two", "sensor_three", "sensor_four", "sensor_five", "sensor_six", "sensor_seven", "sensor_x", "sensor_y", "sensor_z", "silver_value", "silver_angle", "exit_angle", "line_similarity", "zone_similarity"]
+sensor_history = SensorHistory(["sensor_one", "sensor_two", "sensor_three", "sensor_four", "sensor_five", "sensor_six", "sensor_seven", "gyro_x", "gyro_y", "gyro_z", "silver_detected", "silver_angle", "exit_angle", "line_similarity", "zone_similarity", "victim_type"])
+sensor_history.fill(["line_similarity"], 0, 1200)
+sensor_history.fill(["zone_similarity"], 0.7, 1200)
 
-time_sensor_one = empty_time_arr()
-time_sensor_two = empty_time_arr()
-time_sensor_three = empty_time_arr()
-time_sensor_four = empty_time_arr()
-time_sensor_five = empty_time_arr()
-time_sensor_six = empty_time_arr()
-time_sensor_seven = empty_time_arr()
+# Stuck thresholds of the similarity metrics selected in the config
+line_stuck_similarity = config_manager.read_variable('similarity', 'line_threshold') or .88
+zone_stuck_similarity = config_manager.read_variable('similarity', 'zone_threshold') or .95
 
-time_silver_detected = empty_time_arr()
-time_silver_angle = empty_time_arr()
-time_exit_angle = empty_time_arr()
-time_line_similarity = fill_array(0, 1200)
-time_zone_similarity = fill_array(0.7, 1200)
+# Line stuck detection: "similarity" uses the average line similarity of the last 15 seconds, "motion" compares the
+# image motion of the line camera with the commanded speed (its thresholds still need calibrating on recorded runs)
+line_stuck_method = config_manager.read_variable('stuck_detection', 'line_method') or "similarity"
+stuck_detector = StuckDetector(min_speed=config_manager.read_variable('stuck_detection', 'min_speed') or .3,
+                               max_motion=config_manager.read_variable('stuck_detection', 'max_motion') or 20.,
+                               min_response=config_manager.read_variable('stuck_detection', 'min_response') or .3,
+                               stuck_time=config_manager.read_variable('stuck_detection', 'stuck_time') or .35)
 
-time_victim_type = empty_time_arr(1200)
+# Front distance sensors only record values above 25 mm while following the line
+sensor_history_min_values = np.array([25, 25, -np.inf, -np.inf, 25] + [-np.inf] * 11)
 
 timer = Timer()
 
@@ -193,37 +195,19 @@ def program_continue():
 
 
 def update_sensor_average():
-    global time_sensor_one, time_sensor_two, time_sensor_three, time_sensor_four, time_sensor_five, time_sensor_six, time_sensor_seven, time_last_gyro_y, time_last_gyro_x, time_last_gyro_z, time_silver_detected, time_silver_angle, time_victim_type, time_line_similarity, time_zone_similarity, last_update_time, time_exit_angle
+    global last_update_time
 
     if time.perf_counter() - last_update_time > 1 / 90:
-        if sensor_one.value > 25 or objective.value == "zone":
-            time_sensor_one = add_time_value(time_sensor_one, sensor_one.value)
-        if sensor_two.value > 25 or objective.value == "zone":
-            time_sensor_two = add_time_value(time_sensor_two, sensor_two.value)
-        time_sensor_three = add_time_value(time_sensor_three, sensor_three.value)
-        time_sensor_four = add_time_value(time_sensor_four, sensor_four.value)
-        if sensor_five.value > 25 or objective.value == "zone":
-            time_sensor_five = add_time_value(time_sensor_five, sensor_five.value)
-        time_sensor_six = add_time_value(time_sensor_six, sensor_six.value)
-        time_sensor_seven = add_time_value(time_sensor_seven, sensor_seven.value)
-
-        time_last_gyro_y = add_time_value(time_last_gyro_y, sensor_y.value)
-        time_last_gyro_x = add_time_value(time_last_gyro_x, sensor_x.value)
-        time_last_gyro_z = add_time_value(time_last_gyro_z, sensor_z.value)
-
-        time_silver_detected = add_time_value(time_silver_detected, silver_value.value)
-
-        time_silver_angle = add_time_value(time_silver_angle, silver_angle.value)
-        time_exit_angle = add_time_value(time_exit_angle, exit_angle.value)
-
-        if ball_type.value == 'silver ball':
-            time_victim_type = add_time_value(time_victim_type, 1)
-        elif ball_type.value == 'black ball':
-            time_victim_type = add_time_value(time_victim_type, 0)
-
-        time_line_similarity = add_time_value(time_line_similarity, line_similarity.value)
-        time_zone_similarity = add_time_value(time_zone_similarity, zone_similarity.value)
-        zone_similarity_average.value = round(get_time_average(time_zone_similarity, 15), 2)
+        values = state.snapshot(*sensor_history_sources, "ball_type", "objective")
+        victim = values.pop("ball_type")
+        in_zone = values.pop("objective") == "zone"
+
+        row = np.array([*values.values(), victim == "silver ball"], dtype=np.float64)
+        mask = in_zone | (row > sensor_history_min_values)
+        mask[-1] = victim != "none"
+
+        sensor_history.append(row, mask)
+        zone_similarity_average.value = round(sensor_history.average("zone_similarity", 15), 2)
 
         last_update_time = time.perf_counter()
 
@@ -240,18 +224,18 @@ def round_angle(angle, direction=0, rounding_value=90, final_addition=0, round_4
 
 def get_rotation():
     if rotation_y.value == "ramp_up":
-        if get_time_average(time_last_gyro_y, .7) > 10:
+        if sensor_history.average("gyro_y", .7) > 10:
             timer.set_timer("was_ramp_up", .7)
             return "ramp_up"
-        elif get_time_average(time_last_gyro_y, .5) < -5.5:
+        elif sensor_history.average("gyro_y", .5) < -5.5:
             return "ramp_down"
         else:
             return "none"
     else:
-        if get_time_average(time_last_gyro_y, .5) > 15:
+        if sensor_history.average("gyro_y", .5) > 15:
             timer.set_timer("was_ramp_up", .7)
             return "ramp_up"
-        elif get_time_average(time_last_gyro_y, .5) < -11:
+        elif sensor_history.average("gyro_y", .5) < -11:
             return "ramp_down"
         else:
             return "none"
@@ -306,8 +290,6 @@ def sub_angle(angle, subtraction):
 
 
 def turn_to_angle(angle, tolerance=1.5, stop_on_black=False, stop_on_victim=False, direction="n", speed=0, correct_overturn=True, stop_on_corner=False):
-    global time_last_gyro_x
-
     start_angle = sensor_x.value
     last_angle = 400
     timer.set_timer("detect_stuck", 1.5)
@@ -342,7 +324,7 @@ def turn_to_angle(angle, tolerance=1.5, stop_on_black=False, stop_on_victim=Fals
         last_angle = abs(angle_to_turn)
 
         # if stuck
-        if isclose(get_time_average(time_last_gyro_x, .5), sensor_x.value, abs_tol=.5) and not get_time_average(time_last_gyro_x, 1) == -1 and abs((angle - sensor_x.value + 540) % 360 - 180) > 20 and timer.get_timer("detect_stuck"):
+        if isclose(sensor_history.average("gyro_x", .5), sensor_x.value, abs_tol=.5) and not sensor_history.average("gyro_x", 1) == -1 and abs((angle - sensor_x.value + 540) % 360 - 180) > 20 and timer.get_timer("detect_stuck"):
             steer(-turn_direction, .9)
             time.sleep(.5)
             steer(turn_direction, .9)
@@ -401,8 +383,6 @@ def turn_360(speed=0.6, stop_when_victim=False, stop_when_corner=False):
 
 
 def drive_until_wall(time_to_drive, speed=0.65, stop_when_wall=True, stop_when_near_wall=False, stop_when_near_corner=False, stop_when_corner=False, stop_when_black=False, stop_when_silver=False, stop_when_victim=False, stop_when_exit=False, exit_cooldown_time=0, return_driven_time=False, drift=0):
-    global time_sensor_four
-
     corner_distance.value = -181
     timer.set_timer("drive_until_wall", time_to_drive)
     timer.set_timer("exit_cooldown", exit_cooldown_time)
@@ -420,7 +400,7 @@ def drive_until_wall(time_to_drive, speed=0.65, stop_when_wall=True, stop_when_n
         if stop_when_near_wall and near_wall_detected():
             reason = "near_wall"
 
-        if stop_when_near_corner and get_time_average(time_sensor_five, 0.25) < 350:
+        if stop_when_near_corner and sensor_history.average("sensor_five", 0.25) < 350:
             reason = "near_corner"
 
         if stop_when_corner and (zone_found_green.value or zone_found_red.value):
@@ -436,10 +416,10 @@ def drive_until_wall(time_to_drive, speed=0.65, stop_when_wall=True, stop_when_n
             reason = "ball"
 
         if timer.get_timer("exit_cooldown"):
-            if stop_when_exit and get_time_average(time_sensor_four, 0.25) > 180:
+            if stop_when_exit and sensor_history.average("sensor_four", 0.25) > 180:
                 reason = "exit"
         else:
-            time_sensor_four = empty_time_arr()
+            sensor_history.clear(["sensor_four"])
 
         if not program_continue() or not reason == "none":
             break
@@ -677,7 +657,7 @@ def orientate_gap():
 
 
 def turn_around():
-    average_sensor_z = get_time_average(time_last_gyro_z, 1)
+    average_sensor_z = sensor_history.average("gyro_z", 1)
     if (-135 > average_sensor_z > -165 or 130 < average_sensor_z < 160) and turn_around_ramp_side and rotation_y.value == "none":
         steer(0, .7)
         time.sleep(.15)
@@ -730,39 +710,41 @@ def turn_around():
 
 
 def obstacle_detected():
-    if ((20 < get_time_average(time_sensor_one, 0.25) < 75 or 20 < get_time_average(time_sensor_two, 0.25) < 55 or 20 < get_time_average(time_sensor_five, 0.25) < 55) and (rotation_y.value == "none" or obstacle_on_ramp)) and timer.get_timer("obstacle_detect_cooldown") and print_obstacle:
-        print("Obstacle: ", get_time_average(time_sensor_one, 0.25), get_time_average(time_sensor_two, 0.25), get_time_average(time_sensor_five, 0.15))
-    return ((20 < get_time_average(time_sensor_one, 0.25) < 75 or 20 < get_time_average(time_sensor_two, 0.25) < 55 or 20 < get_time_average(time_sensor_five, 0.25) < 55) and (rotation_y.value == "none" or obstacle_on_ramp)) and timer.get_timer("obstacle_detect_cooldown")
+    front_left, front_right, front_center = sensor_history.average(["sensor_one", "sensor_two", "sensor_five"], 0.25)
+    if ((20 < front_left < 75 or 20 < front_right < 55 or 20 < front_center < 55) and (rotation_y.value == "none" or obstacle_on_ramp)) and timer.get_timer("obstacle_detect_cooldown") and print_obstacle:
+        print("Obstacle: ", front_left, front_right, sensor_history.average("sensor_five", 0.15))
+    return ((20 < front_left < 75 or 20 < front_right < 55 or 20 < front_center < 55) and (rotation_y.value == "none" or obstacle_on_ramp)) and timer.get_timer("obstacle_detect_cooldown")
 
 
 def obstacle_detected_again():
-    return ((20 < get_time_average(time_sensor_one, 0.25) < 75 or 20 < get_time_average(time_sensor_two, 0.25) < 55 or 20 < get_time_average(time_sensor_five, 0.25) < 95) and (rotation_y.value == "none" or obstacle_on_ramp)) and timer.get_timer("obstacle_detect_cooldown")
+    front_left, front_right, front_center = sensor_history.average(["sensor_one", "sensor_two", "sensor_five"], 0.25)
+    return ((20 < front_left < 75 or 20 < front_right < 55 or 20 < front_center < 95) and (rotation_y.value == "none" or obstacle_on_ramp)) and timer.get_timer("obstacle_detect_cooldown")
 
 
 def wall_detected():
-    if ((0 < get_time_average(time_sensor_one, 0.25) < 75 or 0 < get_time_average(time_sensor_two, 0.25) < 55 or 0 < get_time_average(time_sensor_five, 0.25) < 95)) and print_obstacle:
-        print("Wall: ", get_time_average(time_sensor_one, 0.25), get_time_average(time_sensor_two, 0.25), get_time_average(time_sensor_five, 0.15))
-    return ((0 < get_time_average(time_sensor_one, 0.25) < 75 or 0 < get_time_average(time_sensor_two, 0.25) < 55 or 0 < get_time_average(time_sensor_five, 0.25) < 95))
+    front_left, front_right, front_center = sensor_history.average(["sensor_one", "sensor_two", "sensor_five"], 0.25)
+    if ((0 < front_left < 75 or 0 < front_right < 55 or 0 < front_center < 95)) and print_obstacle:
+        print("Wall: ", front_left, front_right, sensor_history.average("sensor_five", 0.15))
+    return ((0 < front_left < 75 or 0 < front_right < 55 or 0 < front_center < 95))
 
 
 def near_wall_detected():
-    return ((0 < get_time_average(time_sensor_one, 0.25) < 135 or 0 < get_time_average(time_sensor_two, 0.25) < 135 or 0 < get_time_average(time_sensor_five, 0.25) < 150))
+    front_left, front_right, front_center = sensor_history.average(["sensor_one", "sensor_two", "sensor_five"], 0.25)
+    return ((0 < front_left < 135 or 0 < front_right < 135 or 0 < front_center < 150))
 
 
 def distance_left():
-    return (get_time_average(time_sensor_three, 0.25))
+    return (sensor_history.average("sensor_three", 0.25))
 
 
 def distance_right():
-    return (get_time_average(time_sensor_four, 0.25))
+    return (sensor_history.average("sensor_four", 0.25))
 
 
 def turn_for_obstacle():
-    global time_sensor_one, time_sensor_two, time_sensor_five
 
     if rotation_y.value == "none":
-        sensor_one_avg = get_time_average(time_sensor_one, 0.15)
-        sensor_two_avg = get_time_average(time_sensor_two, 0.15)
+        sensor_one_avg, sensor_two_avg = sensor_history.average(["sensor_one", "sensor_two"], 0.15)
 
         steer(200, .7)
         time.sleep(.15)
@@ -770,13 +752,13 @@ def turn_for_obstacle():
 
         # centering in front of obstacle
         update_sensor_average()
-        if get_time_average(time_sensor_five, 0.15) > 130:
+        if sensor_history.average("sensor_five", 0.15) > 130:
             status.value = f'Centering in front of obstacle'
 
             turn_direction = 180 if sensor_one_avg < sensor_two_avg else -180
 
             timer.set_timer("obstacle", 5)
-            while get_time_average(time_sensor_five, 0.15) > 130:
+            while sensor_history.average("sensor_five", 0.15) > 130:
                 update_sensor_average()
 
                 steer(turn_direction, .55)
@@ -795,16 +777,16 @@ def turn_for_obstacle():
 
         # correcting distance to obstacle
         update_sensor_average()
-        if 0 < get_time_average(time_sensor_five, 0.15) < 180:
+        if 0 < sensor_history.average("sensor_five", 0.15) < 180:
             status.value = f'Correcting distance to obstacle'
 
             timer.set_timer("obstacle", 3)
-            while not 75 < get_time_average(time_sensor_five, 0.15) < 90:
+            while not 75 < sensor_history.average("sensor_five", 0.15) < 90:
                 update_sensor_average()
 
-                if get_time_average(time_sensor_five, 0.15) > 90:
+                if sensor_history.average("sensor_five", 0.15) > 90:
                     steer(0, .55)
-                elif get_time_average(time_sensor_five, 0.15) < 75:
+                elif sensor_history.average("sensor_five", 0.15) < 75:
                     steer(200, .55)
 
                 if timer.get_timer("obstacle"):
@@ -819,8 +801,8 @@ def turn_for_obstacle():
 
         # turning to avoid obstacle
         timer.set_timer("obstacle", 5)
-        if 70 < get_time_average(time_sensor_five, 0.15) < 95:
-            while 0 < get_time_average(time_sensor_five, 0.15) < 280:
+        if 70 < sensor_history.average("sensor_five", 0.15) < 95:
+            while 0 < sensor_history.average("sensor_five", 0.15) < 280:
                 status.value = f'Turning to avoid obstacle'
 
                 update_sensor_average()
@@ -948,7 +930,7 @@ def orientate_after_obstacle(direction):
 
 
 def seesaw_detected():
-    return get_time_average(time_last_gyro_y, .6) > 6.5 and sensor_y.value < -10
+    return sensor_history.average("gyro_y", .6) > 6.5 and sensor_y.value < -10
 
 
 def avoid_seesaw():
@@ -973,8 +955,20 @@ def ramp_down_detected():
     return is_ramp_down
 
 
+def commanded_speed():
+    return (speed_left.value + speed_right.value) / 2
+
+
+def line_stuck_detected():
+    if line_stuck_method == "motion":
+        stuck = stuck_detector.stuck
+    else:
+        stuck = sensor_history.average("line_similarity", 15) > line_stuck_similarity
+    return stuck and timer.get_timer("stuck_cooldown")
+
+
 def zone_stuck_detected():
-    return get_time_average(time_zone_similarity, 15) >= .95 and timer.get_timer("zone_stuck_cooldown")
+    return sensor_history.average("zone_similarity", 15) >= zone_stuck_similarity and timer.get_timer("zone_stuck_cooldown")
 
 
 def avoid_stuck():
@@ -1006,6 +1000,7 @@ def avoid_stuck():
         time.sleep(.5)
 
     timer.set_timer("stuck_detected", 1.2 if rotation_y.value == "ramp_up" else .85)
+    stuck_detector.reset()
 
 
 def avoid_stuck_zone():
@@ -1058,7 +1053,7 @@ def wait_time(time_to_wait, message, rotation="n"):
 
 
 def silver_detected():
-    return get_time_average(time_silver_detected, .15 if rotation_y.value == "ramp_down" else .25) > .7 and not zone_done and timer.get_timer("silver_cooldown")
+    return sensor_history.average("silver_detected", .15 if rotation_y.value == "ramp_down" else .25) > .7 and not zone_done and timer.get_timer("silver_cooldown")
 
 
 def validate_silver():
@@ -1147,7 +1142,7 @@ def position_for_entry():
         while not time.perf_counter() - start_time > .7:
             update_sensor_average()
 
-        angle_silver = get_time_average(time_silver_angle, .25)
+        angle_silver = sensor_history.average("silver_angle", .25)
         line_status.value = "position_entry"
 
         if angle_silver > 20:
@@ -1377,7 +1372,7 @@ def pick_up_victim(alive):
     time.sleep(.6 if speed_zone else 1.5)
 
     timer.set_timer("pickup", .5 if speed_zone else 1.15)
-    while (get_time_average(time_sensor_seven, .2) > 75 or get_time_average(time_sensor_seven, .2) == -1) and not timer.get_timer("pickup"):
+    while (sensor_history.average("sensor_seven", .2) > 75 or sensor_history.average("sensor_seven", .2) == -1) and not timer.get_timer("pickup"):
         update_sensor_average()
 
         steer(0, .65 if speed_zone else .5)
@@ -1399,7 +1394,7 @@ def pick_up_victim(alive):
         if not program_continue():
             return False
 
-    return get_time_average(time_sensor_seven, .2) < 50
+    return sensor_history.average("sensor_seven", .2) < 50
 
 
 def dump_victims(alive, dumped_victims=False):
@@ -1681,7 +1676,7 @@ def position_exit():
     while not time.perf_counter() - start_time > .7:
         update_sensor_average()
 
-    angle_exit = get_time_average(time_exit_angle, .25)
+    angle_exit = sensor_history.average("exit_angle", .25)
 
     if angle_exit > 15:
         direction = -35
@@ -1730,7 +1725,7 @@ def calibrate_turn_time():
 
 def control_loop():
     global forward_right, backward_right, forward_left, backward_left, speed_right, speed_left, light, servo_control, servo_1, servo_2, servo_3, button
-    global run, zone_done, dumped_alive_victims, dumped_dead_victims, last_turn_dir, obstacle_count, time_last_gyro_y, time_last_gyro_x, time_last_gyro_z, time_last_angles, time_sensor_one, time_sensor_two, time_sensor_three, time_sensor_four, time_sensor_five, time_sensor_six, time_sensor_seven, time_silver_detected, time_line_similarity, time_zone_similarity, time_victim_type
+    global run, zone_done, dumped_alive_victims, dumped_dead_victims, last_turn_dir, obstacle_count, time_last_angles
 
     # gpio setup
     forward_right = LED(in_1)
@@ -1845,20 +1840,11 @@ def control_loop():
                 # reset all average time arrays
                 time_last_angles = empty_time_arr()
 
-                time_last_gyro_y = empty_time_arr()
-                time_last_gyro_x = empty_time_arr()
-                time_last_gyro_z = empty_time_arr()
+                sensor_history.clear(["gyro_y", "gyro_x", "gyro_z", "sensor_one", "sensor_two", "sensor_three", "sensor_four", "sensor_five", "sensor_six", "sensor_seven"])
 
-                time_sensor_one = empty_time_arr()
-                time_sensor_two = empty_time_arr()
-                time_sensor_three = empty_time_arr()
-                time_sensor_four = empty_time_arr()
-                time_sensor_five = empty_time_arr()
-                time_sensor_six = empty_time_arr()
-                time_sensor_seven = empty_time_arr()
-
-                time_line_similarity = fill_array(0, 1200)
-                time_zone_similarity = fill_array(0.7, 1200)
+                sensor_history.fill(["line_similarity"], 0, 1200)
+                stuck_detector.reset()
+                sensor_history.fill(["zone_similarity"], 0.7, 1200)
                 timer.set_timer("stuck_cooldown", 5)
 
                 time.sleep(.25)
@@ -1867,15 +1853,17 @@ def control_loop():
 
             if run:
                 if objective.value == "follow_line":
+                    # One consistent record of the latest line camera frame
+                    line_frame = get_line_frame()
+
+                    # The commanded speed is still the one of the last tick, which moved the robot during the frame
+                    stuck_detector.update(line_frame["line_motion"], line_frame["line_motion_response"], commanded_speed(), line_frame["line_frame_time"])
 
                     if seesaw_detected():
                         status.value = f'Avoiding seesaw'
 
                         avoid_seesaw()
-                        time_last_gyro_y = fill_array(0)
-                        time_sensor_one = fill_array(0)
-                        time_sensor_two = fill_array(0)
-                        time_sensor_five = fill_array(0)
+                        sensor_history.fill(["gyro_y", "sensor_one", "sensor_two", "sensor_five"], 0)
 
                         timer.set_timer("obstacle_detect_cooldown", 1.5)
                         timer.set_timer("stuck_cooldown", 4)
@@ -1884,10 +1872,10 @@ def control_loop():
                     # detected line on last frame
                     if line_status.value == "line_detected":
 
-                        if not line_detected.value and rotation_y.value == "none" and not ramp_ahead.value:
+                        if not line_frame["line_detected"] and rotation_y.value == "none" and not line_frame["ramp_ahead"]:
                             line_status.value = "gap_detected"
 
-                        if red_detected.value:
+                        if line_frame["red_detected"]:
                             line_status.value = "stop"
 
                         if obstacle_detected() or (obstacle_detected_again() and rotation_y.value == "ramp_up"):
@@ -1911,7 +1899,7 @@ def control_loop():
 
                     # still line detected
                     if line_status.value == "line_detected":
-                        if turn_dir.value == "turn_around":
+                        if line_frame["turn_dir"] == "turn_around":
                             status.value = f'Turning around {"right" if last_turn_dir == "r" else "left"}'
 
                             last_turn_dir = turn_around()
@@ -1919,12 +1907,12 @@ def control_loop():
 
                         status.value = f'Following Line'
 
-                        steer(line_angle.value, get_speed(line_angle.value))
+                        steer(line_frame["line_angle"], get_speed(line_frame["line_angle"]))
 
-                        time_silver_detected = add_time_value(time_silver_detected, silver_value.value)
-                        time_last_angles = add_time_value(time_last_angles, line_angle.value)
+                        sensor_history.append_channels(silver_detected=line_frame["silver_value"])
+                        time_last_angles = add_time_value(time_last_angles, line_frame["line_angle"])
 
-                        if get_time_average(time_line_similarity, 15) > .88 and timer.get_timer("stuck_cooldown"):
+                        if line_stuck_detected():
                             avoid_stuck()
                             timer.set_timer("stuck_cooldown", 4 if rotation_y.value == "none" else 8)
 
@@ -1952,7 +1940,7 @@ def control_loop():
                     elif line_status.value == "gap_avoid":
                         status.value = f'Avoiding gap'
 
-                        if line_detected.value or silver_detected() or obstacle_detected():
+                        if line_frame["line_detected"] or silver_detected() or obstacle_detected():
                             min_line_size.value = 3000
                             line_status.value = "line_detected"
                             timer.set_timer("stuck_cooldown", 4)
@@ -1991,7 +1979,8 @@ def control_loop():
 
                             obstacle_direction.value = obstacle_dir[obstacle_count % len(obstacle_dir)]
 
-                            time_line_similarity = fill_array(0, 1200)
+                            sensor_history.fill(["line_similarity"], 0, 1200)
+                            stuck_detector.reset()
                             min_line_size.value = 6500
                             time.sleep(.1)
                         else:
@@ -2041,14 +2030,15 @@ def control_loop():
                             elif rotation_y.value == "ramp_down":
                                 timer.set_timer("obstacle_avoid", .75)
 
-                        if get_time_average(time_line_similarity, 15) > .88 and timer.get_timer("stuck_cooldown"):
+                        if line_stuck_detected():
                             steer(180 if obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" else -180, .7)
                             time.sleep(.4)
                             steer()
                             time.sleep(.2)
                             timer.set_timer("stuck_cooldown", 10)
+                            stuck_detector.reset()
 
-                        if line_detected.value and timer.get_timer("obstacke_cooldown"):
+                        if line_frame["line_detected"] and timer.get_timer("obstacke_cooldown"):
                             min_line_size.value = 3000
                             line_status.value = "obstacle_orientate"
 
@@ -2065,9 +2055,7 @@ def control_loop():
                                 steer(180 if obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" else -180, .7)
                                 time.sleep(.3)
 
-                            time_sensor_one = fill_array(300)
-                            time_sensor_two = fill_array(300)
-                            time_sensor_five = fill_array(300)
+                            sensor_history.fill(["sensor_one", "sensor_two", "sensor_five"], 300)
 
                             obstacle_count += 1
                             line_status.value = "line_detected"
@@ -2134,7 +2122,7 @@ def control_loop():
                             drive_until_wall(2 if rotation_y.value == "ramp_up" else 1, speed=1)
 
                         timer.set_timer("max_search_time", 240)
-                        time_zone_similarity = fill_array(0.7, 1200)
+                        sensor_history.fill(["zone_similarity"], 0.7, 1200)
 
                         if dumped_dead_victims:
                             zone_status.value = "deposit_red"
@@ -2157,11 +2145,11 @@ def control_loop():
 
 
                     elif zone_status.value == "pickup_ball":
-                        time_victim_type = empty_time_arr(1200)
+                        sensor_history.clear(["victim_type"])
 
                         if turn_to_victim():
                             if drive_to_victim(speed=1 if speed_zone else .6):
-                                victim_type = "silver ball" if get_time_average(time_victim_type, 10) > 0.5 else "black ball"
+                                victim_type = "silver ball" if sensor_history.average("victim_type", 10) > 0.5 else "black ball"
                                 status.value = f"Picking up {'alive' if victim_type == 'silver ball' else 'dead'} victim"
 
                                 alive = victim_type == "silver ball"
@@ -2208,7 +2196,7 @@ def control_loop():
                                             if wait_time(6, "confirmation of successful dump", rotation="n"):
                                                 dumped_alive_victims = True
 
-                                        time_zone_similarity = fill_array(0.7, 1200)
+                                        sensor_history.fill(["zone_similarity"], 0.7, 1200)
                                         zone_status.value = "deposit_red"
                         else:
                             servo_pos(6)
@@ -2229,7 +2217,7 @@ def control_loop():
                                         else:
                                             if wait_time(6, "confirmation of successful dump", rotation="n"):
                                                 dumped_dead_victims = True
-                                    time_zone_similarity = fill_array(0.7, 1200)
+                                    sensor_history.fill(["zone_similarity"], 0.7, 1200)
                                     zone_status.value = "exit"
 
 
@@ -2265,7 +2253,8 @@ def control_loop():
                             zone_status.value = "begin"
 
                             zone_done = True
-                            time_line_similarity = fill_array(0, 1200)
+                            sensor_history.fill(["line_similarity"], 0, 1200)
+                            stuck_detector.reset()
 
                             if speed_zone:
                                 steer(0, .6)
@@ -0,0 +1,283 @@
+import ast
+import os
+import threading
+import time
+import zipfile
+
+import cv2
+import numpy as np
+
+
+class InferenceWorker:
+    # Runs a model in a background thread on the latest submitted frame.
+    # A frame submitted while the model is busy replaces the one that is still waiting, so stale frames are dropped
+    # and a result is never more than one inference behind.
+    def __init__(self, predict, publish):
+        self.__predict = predict  # Returns the result for a frame
+        self.__publish = publish  # Gets (result, frame_id, capture_time)
+
+        self.__waiting = None
+        self.__working = None
+        self.__waiting_frame = (-1, -1.)  # (frame_id, capture_time) of the waiting frame
+        self.__pending = False
+
+        self.__new_frame = threading.Condition()
+        self.__thread = None
+        self.__running = False
+        self.__error = None
+
+        # Times in seconds, averaged over the last inferences
+        self.__stats = {"inference": 0., "latency": 0., "submitted": 0, "finished": 0, "dropped": 0}
+
+    def start(self):
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__worker_loop, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        with self.__new_frame:
+            self.__running = False
+            self.__new_frame.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    @property
+    def stats(self):
+        return dict(self.__stats)
+
+    def __average(self, name, value, weight=.1):
+        self.__stats[name] += (value - self.__stats[name]) * weight
+
+    def submit(self, frame, frame_id, capture_time):
+        # The frame is copied, the caller can reuse its buffer right away
+        with self.__new_frame:
+            if self.__error is not None:
+                raise self.__error
+            if not self.__running:
+                raise RuntimeError("Inference worker is not running")
+
+            if self.__pending:
+                self.__stats["dropped"] += 1
+
+            if self.__waiting is None or self.__waiting.shape != frame.shape or self.__waiting.dtype != frame.dtype:
+                self.__waiting = np.empty_like(frame)
+            np.copyto(self.__waiting, frame)
+
+            self.__waiting_frame = (frame_id, capture_time)
+            self.__pending = True
+            self.__stats["submitted"] += 1
+
+            self.__new_frame.notify_all()
+
+    def __worker_loop(self):
+        try:
+            while True:
+                with self.__new_frame:
+                    self.__new_frame.wait_for(lambda: self.__pending or not self.__running)
+                    if not self.__running:
+                        return
+
+                    self.__waiting, self.__working = self.__working, self.__waiting
+                    frame_id, capture_time = self.__waiting_frame
+                    self.__pending = False
+
+                start_time = time.perf_counter()
+                result = self.__predict(self.__working)
+                end_time = time.perf_counter()
+
+                self.__publish(result, frame_id, capture_time)
+
+                with self.__new_frame:
+                    self.__average("inference", end_time - start_time)
+                    self.__average("latency", end_time - capture_time)
+                    self.__stats["finished"] += 1
+        except Exception as e:
+            with self.__new_frame:
+                self.__error = e
+                self.__running = False
+
+
+########################################################################################################################
+# Inference Engine
+########################################################################################################################
+
+
+class OnnxModel:
+    # Runs an ONNX model with onnxruntime on the CPU
+    def __init__(self, path):
+        import onnxruntime
+
+        self.__session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.__input = self.__session.get_inputs()[0]
+
+        self.input_shape = tuple(self.__input.shape)  # NCHW
+        self.channels_last = False
+
+        metadata = self.__session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+
+    def run(self, tensor):
+        return self.__session.run(None, {self.__input.name: tensor})[0]
+
+
+class TfliteModel:
+    # Runs a TFLite model with tflite_runtime (or TensorFlow), on the Edge TPU if it is compiled for it
+    def __init__(self, path):
+        try:
+            from tflite_runtime.interpreter import Interpreter, load_delegate
+        except ImportError:
+            import tensorflow as tf
+            Interpreter, load_delegate = tf.lite.Interpreter, tf.lite.experimental.load_delegate
+
+        if "edgetpu" in os.path.basename(path):
+            self.__interpreter = Interpreter(model_path=path, experimental_delegates=[load_delegate("libedgetpu.so.1")])
+        else:
+            self.__interpreter = Interpreter(model_path=path)
+        self.__interpreter.allocate_tensors()
+
+        self.__input = self.__interpreter.get_input_details()[0]
+        self.__output = self.__interpreter.get_output_details()[0]
+
+        self.input_shape = tuple(self.__input["shape"])  # NHWC
+        self.channels_last = True
+
+        # Ultralytics stores its metadata as a zip file appended to the model
+        self.names = {}
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as model_file:
+                metadata = ast.literal_eval(model_file.read(model_file.namelist()[0]).decode("utf-8"))
+                names = metadata.get("names") or {}
+                self.names = dict(enumerate(names)) if isinstance(names, list) else {int(k): v for k, v in names.items()}
+
+    def run(self, tensor):
+        # Quantized models take and return integers
+        if self.__input["dtype"] in (np.int8, np.uint8):
+            scale, zero_point = self.__input["quantization"]
+            tensor = (tensor / scale + zero_point).astype(self.__input["dtype"])
+
+        self.__interpreter.set_tensor(self.__input["index"], tensor)
+        self.__interpreter.invoke()
+        output = self.__interpreter.get_tensor(self.__output["index"])
+
+        if self.__output["dtype"] in (np.int8, np.uint8):
+            scale, zero_point = self.__output["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def class_name(names, class_id):
+    # Name of a class, the class id if the model metadata has no name for it
+    try:
+        return str(names[int(class_id)])
+    except (KeyError, IndexError, TypeError):
+        return str(int(class_id))
+
+
+def load_model(path):
+    return TfliteModel(path) if path.endswith(".tflite") else OnnxModel(path)
+
+
+class Classifier:
+    # YOLO classification model without ultralytics: resize the short side, center crop, class probabilities as array
+    def __init__(self, path):
+        self.__model = load_model(path)
+        self.names = self.__model.names
+
+        if self.__model.channels_last:
+            _, self.__height, self.__width, _ = self.__model.input_shape
+        else:
+            _, _, self.__height, self.__width = self.__model.input_shape
+        self.__tensor = np.zeros(self.__model.input_shape, dtype=np.float32)
+
+    def __call__(self, image):
+        # image in the channel order the model was trained on, like the frames passed to ultralytics before
+        height, width = image.shape[:2]
+        scale = max(self.__height / height, self.__width / width)
+        resized = cv2.resize(image[:, :, :3], (max(round(width * scale), self.__width), max(round(height * scale), self.__height)), interpolation=cv2.INTER_AREA)
+
+        top = (resized.shape[0] - self.__height) // 2
+        left = (resized.shape[1] - self.__width) // 2
+        crop = resized[top:top + self.__height, left:left + self.__width, ::-1]  # ultralytics converts BGR to RGB
+
+        if self.__model.channels_last:
+            np.multiply(crop, 1 / 255, out=self.__tensor[0], casting="unsafe")
+        else:
+            np.multiply(crop.transpose(2, 0, 1), 1 / 255, out=self.__tensor[0], casting="unsafe")
+
+        return self.__model.run(self.__tensor)[0]
+
+    def label(self, class_id):
+        return class_name(self.names, class_id)
+
+
+class Detector:
+    # YOLO detection model without ultralytics: letterbox, NMS and boxes mapped back to the image as plain arrays
+    def __init__(self, path, conf=.25, iou=.45):
+        self.__model = load_model(path)
+        self.names = self.__model.names
+        self.conf = conf
+        self.iou = iou
+
+        if self.__model.channels_last:
+            _, self.__height, self.__width, _ = self.__model.input_shape
+        else:
+            _, _, self.__height, self.__width = self.__model.input_shape
+        self.__tensor = np.zeros(self.__model.input_shape, dtype=np.float32)
+        self.__canvas = np.full((self.__height, self.__width, 3), 114, dtype=np.uint8)
+        self.__image_shape = None
+
+    def label(self, class_id):
+        return class_name(self.names, class_id)
+
+    def __letterbox(self, image):
+        height, width = image.shape[:2]
+        if self.__image_shape != (height, width):
+            self.__image_shape = (height, width)
+            self.__scale = min(self.__height / height, self.__width / width)
+            self.__size = (round(width * self.__scale), round(height * self.__scale))
+            self.__left = (self.__width - self.__size[0]) // 2
+            self.__top = (self.__height - self.__size[1]) // 2
+            self.__canvas[:] = 114
+
+        self.__canvas[self.__top:self.__top + self.__size[1], self.__left:self.__left + self.__size[0]] = cv2.resize(image[:, :, :3], self.__size, interpolation=cv2.INTER_LINEAR)
+
+        rgb = self.__canvas[:, :, ::-1]
+        if self.__model.channels_last:
+            np.multiply(rgb, 1 / 255, out=self.__tensor[0], casting="unsafe")
+        else:
+            np.multiply(rgb.transpose(2, 0, 1), 1 / 255, out=self.__tensor[0], casting="unsafe")
+
+    def __call__(self, image):
+        # Returns (boxes [n, 4] as int x1, y1, x2, y2 in the image, confidences [n], class ids [n]), class agnostic NMS
+        self.__letterbox(image)
+        output = self.__model.run(self.__tensor)[0]  # [4 + classes, anchors]
+
+        scores = output[4:]
+        class_ids = np.argmax(scores, axis=0)
+        confidences = scores[class_ids, np.arange(scores.shape[1])]
+
+        keep = confidences > self.conf
+        xywh = output[:4, keep].T.astype(np.float32)
+        confidences = confidences[keep]
+        class_ids = class_ids[keep]
+
+        # TFLite models return coordinates relative to the input size
+        if self.__model.channels_last:
+            xywh *= np.array([self.__width, self.__height, self.__width, self.__height], dtype=np.float32)
+
+        if len(confidences) == 0:
+            return np.zeros((0, 4), dtype=np.int32), confidences, class_ids
+
+        xywh[:, :2] -= xywh[:, 2:] / 2  # Top left corner for NMSBoxes
+        indices = np.asarray(cv2.dnn.NMSBoxes(xywh, confidences, self.conf, self.iou), dtype=np.int64).reshape(-1)
+
+        boxes = xywh[indices]
+        boxes[:, 2:] += boxes[:, :2]
+        boxes -= np.array([self.__left, self.__top, self.__left, self.__top], dtype=np.float32)
+        boxes /= self.__scale
+
+        height, width = image.shape[:2]
+        boxes[:, 0::2] = np.clip(boxes[:, 0::2], 0, width)
+        boxes[:, 1::2] = np.clip(boxes[:, 1::2], 0, height)
+
+        return boxes.astype(np.int32), confidences[indices], class_ids[indices]
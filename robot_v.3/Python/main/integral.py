@@ -0,0 +1,41 @@
+import cv2
+
+
+class IntegralImage:
+    # Summed area table of an image, built on the first lookup and shared by every region sum or mean of that image.
+    # Regions are (x0, y0, x1, y1) with x1, y1 exclusive like the other windows, a sum costs four lookups.
+    def __init__(self, image=None):
+        self.__image = None
+        self.__table = None
+        if image is not None:
+            self.update(image)
+
+    def update(self, image):
+        # New frame or changed mask, the table is rebuilt on the next lookup
+        self.__image = image
+        self.__table = None
+
+    @property
+    def table(self):
+        # int32 [h + 1, w + 1] or [h + 1, w + 1, channels]
+        if self.__table is None:
+            self.__table = cv2.integral(self.__image)
+        return self.__table
+
+    def __window(self, window):
+        if window is None:
+            return 0, 0, self.__image.shape[1], self.__image.shape[0]
+        return window
+
+    def sum(self, window=None):
+        x0, y0, x1, y1 = self.__window(window)
+        table = self.table
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    def mean(self, window=None):
+        x0, y0, x1, y1 = self.__window(window)
+        return self.sum((x0, y0, x1, y1)) / ((x1 - x0) * (y1 - y0))
+
+    def count(self, window=None):
+        # Set pixels of a 0 / 255 mask
+        return self.sum(window) // 255
@@ -2,21 +2,21 @@ import os
 from multiprocessing import shared_memory
 
 import cv2
-from libcamera import controls
 from numba import njit
-from picamera2 import Picamera2
-from skimage.metrics import structural_similarity
-from ultralytics import YOLO
 
-from Managers import Timer
+from Managers import StageTimer, Timer
+from camera import open_frame_source
+from inference import Classifier, InferenceWorker
+from integral import IntegralImage
+from line_geometry import component_area, component_bottom, component_runs, component_x_mean, component_y_mean, line_components, run_edges
+from motion import MotionEstimator
+from recording import FrameRecorder, FrameReplay, recorded_fields
 from mp_manager import *
+from segmentation import ColorTable, apply_morphology, green_bit, green_zone_bit, morphology, morphology_reach, pad_window, red_bit, red_zone_bit, segment_image
+from similarity import metrics
 
 debug_mode = False
 
-# Disable libcamera and Picamera2 logging
-Picamera2.set_logging(Picamera2.ERROR)
-os.environ["LIBCAMERA_LOG_LEVELS"] = "4"
-
 camera_x = 448
 camera_y = 252
 
@@ -53,8 +53,18 @@ red_max_1_zone = np.array([10, 255, 255])
 red_min_2_zone = np.array([170, 100, 100])
 red_max_2_zone = np.array([180, 255, 255])
 
+line_color_tables = ColorTable()
+line_color_table = None
+
+# Noise reduction, iterations of a 3x3 kernel
+noise_reduction_line = morphology(("erode", 5), ("dilate", 17), ("erode", 9))  # Previous values: 12 | 16, 4 | 8
+noise_reduction_marker = morphology(("erode", 1), ("dilate", 11), ("erode", 9))
+noise_reduction_gap = morphology(("erode", 5), ("dilate", 8))
+
 multiple_bottom_side = camera_x / 2
 
+turn_directions = ("straight", "left", "right", "turn_around")
+
 timer = Timer()
 
 
@@ -65,8 +75,19 @@ def save_image(image):
     cv2.imwrite(f"../../Ai/datasets/images_to_annotate/{num:04d}.png", image)
 
 
+def predict_silver(model, frame):
+    if frame.shape[2] == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)  # The model was trained on the RGBA frames
+
+    return model(frame)[1]  # 0 = Line, 1 = Silver
+
+
+def publish_silver(value, frame_id, capture_time):
+    state.publish(silver_value=value, silver_frame_id=frame_id, silver_frame_time=capture_time)
+
+
 def update_color_values():
-    global black_max_normal_top, black_max_normal_bottom, black_max_silver_validate_top_off, black_max_silver_validate_bottom_off, black_max_silver_validate_top_on, black_max_silver_validate_bottom_on, black_max_ramp_down_top, black_max_zone, green_min, green_max, green_min_zone, green_max_zone, red_min_1, red_max_1, red_min_2, red_max_2, red_min_1_zone, red_max_1_zone, red_min_2_zone, red_max_2_zone
+    global black_max_normal_top, black_max_normal_bottom, black_max_silver_validate_top_off, black_max_silver_validate_bottom_off, black_max_silver_validate_top_on, black_max_silver_validate_bottom_on, black_max_ramp_down_top, black_max_zone, green_min, green_max, green_min_zone, green_max_zone, red_min_1, red_max_1, red_min_2, red_max_2, red_min_1_zone, red_max_1_zone, red_min_2_zone, red_max_2_zone, line_color_table
 
     black_max_normal_top = np.array(config_manager.read_variable('color_values_line', 'black_max_normal_top'))
     black_max_normal_bottom = np.array(config_manager.read_variable('color_values_line', 'black_max_normal_bottom'))
@@ -92,6 +113,34 @@ def update_color_values():
     red_min_2_zone = np.array(config_manager.read_variable('color_values_line', 'red_min_2_zone'))
     red_max_2_zone = np.array(config_manager.read_variable('color_values_line', 'red_max_2_zone'))
 
+    line_color_table = line_color_tables.update([(green_min, green_max)], [(red_min_1, red_max_1), (red_min_2, red_max_2)],
+                                                [(green_min_zone, green_max_zone)], [(red_min_1_zone, red_max_1_zone), (red_min_2_zone, red_max_2_zone)])
+
+
+def line_window(status, rotation, direction, black_mean, bottom_y):
+    # Part (x0, y0, x1, y1) of the black image that is used for the line in the current state, the rest is cut out
+    x0, y0, x1, y1 = 0, 0, camera_x, camera_y
+
+    if status == "obstacle_avoid" or status == "obstacle_detected":
+        if rotation == "none":
+            y0 = max(y0, int(camera_y * .35) + 1)
+        if direction == "l":
+            x0 = max(x0, int(camera_x * .75) + 1)
+        elif direction == "r":
+            x1 = min(x1, int(camera_x * .25))
+    elif status == "obstacle_orientate":
+        y0 = max(y0, int(camera_y * .45) + 1)
+
+    if status == "gap_avoid":
+        x0 = max(x0, int(camera_x * .35) + 1)
+        x1 = min(x1, int(camera_x * .65))
+
+    if bottom_y < camera_y * .95 and black_mean < 21 and status == "line_detected":
+        x0 = max(x0, int(camera_x * .25) + 1)
+        x1 = min(x1, int(camera_x * .75))
+
+    return x0, y0, max(x1, x0), max(y1, y0)
+
 
 def check_contour_size(contours, contour_color="red", size=15000):
     if contour_color == "red":
@@ -112,34 +161,37 @@ def check_contour_size(contours, contour_color="red", size=15000):
     return False
 
 
-def check_green(contours_grn, black_image):
-    black_around_sign = np.zeros((len(contours_grn), 5), dtype=np.int16)  # [[b,t,l,r,lp], [b,t,l,r,lp]]
+def check_green(contours_grn, black_sums):
+    # Boxes of the markers large enough, all evaluated in one compiled call on the integral image of the black mask
+    green_boxes = np.array([cv2.boxPoints(cv2.minAreaRect(contour)) for contour in contours_grn if cv2.contourArea(contour) > 2500], dtype=np.float32).reshape(-1, 4, 2)
+    cv2.drawContours(cv2_img, list(np.intp(green_boxes)), -1, (0, 0, 255), 2)
 
-    for i, contour in enumerate(contours_grn):
-        area = cv2.contourArea(contour)
-        if area <= 2500:
-            continue
+    return turn_directions[evaluate_markers(green_boxes, black_sums.table)]
 
-        green_box = cv2.boxPoints(cv2.minAreaRect(contour))
-        draw_box = np.intp(green_box)
-        cv2.drawContours(cv2_img, [draw_box], -1, (0, 0, 255), 2)
 
-        black_around_sign = check_black(black_around_sign, i, green_box, black_image.copy())
+@njit(cache=True)
+def slice_bounds(start, stop, size):
+    # Bounds of [start:stop] on an axis of size with the numpy slice rules
+    if start < 0:
+        start += size
+    if stop < 0:
+        stop += size
+    return min(max(start, 0), size), min(max(stop, 0), size)
 
-    turn_left, turn_right, left_bottom, right_bottom = determine_turn_direction(black_around_sign)
 
-    if turn_left and not turn_right and not left_bottom:
-        return "left"
-    elif turn_right and not turn_left and not right_bottom:
-        return "right"
-    elif turn_left and turn_right and not (left_bottom and right_bottom):
-        return "turn_around"
-    else:
-        return "straight"
+@njit(cache=True)
+def roi_mean(integral, y0, y1, x0, x1):
+    # Mean of image[y0:y1, x0:x1] from the integral image of the image, -1 if the slice is empty
+    y0, y1 = slice_bounds(y0, y1, integral.shape[0] - 1)
+    x0, x1 = slice_bounds(x0, x1, integral.shape[1] - 1)
+    if y1 <= y0 or x1 <= x0:
+        return -1.
+
+    return (integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]) / ((y1 - y0) * (x1 - x0))
 
 
 @njit(cache=True)
-def check_black(black_around_sign, i, green_box, black_image):
+def check_black(black_around_sign, i, green_box, black_integral):
     green_box = green_box[green_box[:, 1].argsort()]
 
     marker_height = green_box[-1][1] - green_box[0][1]
@@ -147,34 +199,27 @@ def check_black(black_around_sign, i, green_box, black_image):
     black_around_sign[i, 4] = int(green_box[2][1])
 
     # Bottom
-    roi_b = black_image[int(green_box[2][1]):np.minimum(int(green_box[2][1] + (marker_height * 0.8)), camera_y), np.minimum(int(green_box[2][0]), int(green_box[3][0])):np.maximum(int(green_box[2][0]), int(green_box[3][0]))]
-    if roi_b.size > 0:
-        if np.mean(roi_b[:]) > 125:
-            black_around_sign[i, 0] = 1
+    if roi_mean(black_integral, int(green_box[2][1]), np.minimum(int(green_box[2][1] + (marker_height * 0.8)), camera_y), np.minimum(int(green_box[2][0]), int(green_box[3][0])), np.maximum(int(green_box[2][0]), int(green_box[3][0]))) > 125:
+        black_around_sign[i, 0] = 1
 
     # Top
-    roi_t = black_image[np.maximum(int(green_box[1][1] - (marker_height * 0.8)), 0):int(green_box[1][1]), np.minimum(np.maximum(int(green_box[0][0]), 0), np.maximum(int(green_box[1][0]), 0)):np.maximum(np.maximum(int(green_box[0][0]), 0), np.maximum(int(green_box[1][0]), 0))]
-    if roi_t.size > 0:
-        if np.mean(roi_t[:]) > 125:
-            black_around_sign[i, 1] = 1
+    if roi_mean(black_integral, np.maximum(int(green_box[1][1] - (marker_height * 0.8)), 0), int(green_box[1][1]), np.minimum(np.maximum(int(green_box[0][0]), 0), np.maximum(int(green_box[1][0]), 0)), np.maximum(np.maximum(int(green_box[0][0]), 0), np.maximum(int(green_box[1][0]), 0))) > 125:
+        black_around_sign[i, 1] = 1
 
     green_box = green_box[green_box[:, 0].argsort()]
 
     # Left
-    roi_l = black_image[np.minimum(int(green_box[0][1]), int(green_box[1][1])):np.maximum(int(green_box[0][1]), int(green_box[1][1])), np.maximum(int(green_box[1][0] - (marker_height * 0.8)), 0):int(green_box[1][0])]
-    if roi_l.size > 0:
-        if np.mean(roi_l[:]) > 125:
-            black_around_sign[i, 2] = 1
+    if roi_mean(black_integral, np.minimum(int(green_box[0][1]), int(green_box[1][1])), np.maximum(int(green_box[0][1]), int(green_box[1][1])), np.maximum(int(green_box[1][0] - (marker_height * 0.8)), 0), int(green_box[1][0])) > 125:
+        black_around_sign[i, 2] = 1
 
     # Right
-    roi_r = black_image[np.minimum(int(green_box[2][1]), int(green_box[3][1])):np.maximum(int(green_box[2][1]), int(green_box[3][1])), int(green_box[2][0]):np.minimum(int(green_box[2][0] + (marker_height * 0.8)), camera_x)]
-    if roi_r.size > 0:
-        if np.mean(roi_r[:]) > 125:
-            black_around_sign[i, 3] = 1
+    if roi_mean(black_integral, np.minimum(int(green_box[2][1]), int(green_box[3][1])), np.maximum(int(green_box[2][1]), int(green_box[3][1])), int(green_box[2][0]), np.minimum(int(green_box[2][0] + (marker_height * 0.8)), camera_x)) > 125:
+        black_around_sign[i, 3] = 1
 
     return black_around_sign
 
 
+@njit(cache=True)
 def determine_turn_direction(black_around_sign):
     turn_left = False
     turn_right = False
@@ -195,155 +240,207 @@ def determine_turn_direction(black_around_sign):
     return turn_left, turn_right, left_bottom, right_bottom
 
 
-def determine_correct_line(contours_blk):
-    global x_last, y_last
-    candidates = np.zeros((len(contours_blk), 5), dtype=np.int32)
-    off_bottom = 0
+@njit(cache=True)
+def evaluate_markers(green_boxes, black_integral):
+    # Index in turn_directions for the markers [n, 4, 2] around the line
+    black_around_sign = np.zeros((len(green_boxes), 5), dtype=np.int16)  # [[b,t,l,r,lp], [b,t,l,r,lp]]
+    for i in range(len(green_boxes)):
+        check_black(black_around_sign, i, green_boxes[i], black_integral)
 
-    for i, contour in enumerate(contours_blk):
-        box = cv2.boxPoints(cv2.minAreaRect(contour))
-        box = box[box[:, 1].argsort()[::-1]]  # Sort them by their y values and reverse
-        bottom_y = box[0][1]
-        y_mean = (np.clip(box[0][1], 0, camera_y) + np.clip(box[3][1], 0, camera_y)) / 2
+    turn_left, turn_right, left_bottom, right_bottom = determine_turn_direction(black_around_sign)
 
-        if box[0][1] >= (camera_y * 0.75):
-            off_bottom += 1
+    if turn_left and not turn_right and not left_bottom:
+        return 1
+    elif turn_right and not turn_left and not right_bottom:
+        return 2
+    elif turn_left and turn_right and not (left_bottom and right_bottom):
+        return 3
+    else:
+        return 0
 
-        box = box[box[:, 0].argsort()]
-        x_mean = (np.clip(box[0][0], 0, camera_x) + np.clip(box[3][0], 0, camera_x)) / 2
-        x_y_distance = abs(x_last - x_mean) + abs(y_last - y_mean)  # Distance between the last x/y and current x/y
 
-        candidates[i] = i, bottom_y, x_y_distance, x_mean, y_mean
+def determine_correct_line(components, runs, line_turn_dir, crop):
+    global x_last, y_last
+    bottom_y = components[:, component_bottom]
+    x_mean = components[:, component_x_mean]
+    y_mean = components[:, component_y_mean]
 
-    if off_bottom < 2:
-        candidates = candidates[candidates[:, 1].argsort()[::-1]]  # Sort candidates by their bottom_y
+    off_bottom = bottom_y >= camera_y * 0.75
+
+    if np.count_nonzero(off_bottom) < 2:
+        index = np.argmax(bottom_y)  # Lowest line
     else:
-        off_bottom_candidates = candidates[np.where(candidates[:, 1] >= (camera_y * 0.75))]
-        candidates = off_bottom_candidates[off_bottom_candidates[:, 2].argsort()]
+        x_y_distance = np.abs(x_last - x_mean) + np.abs(y_last - y_mean)  # Distance between the last x/y and current x/y
+        index = np.argmin(np.where(off_bottom, x_y_distance, np.iinfo(np.int32).max))  # Nearest line of those leaving the image at the bottom
 
-    if turn_dir.value == "left":
-        x_last = np.clip(candidates[0][3] - 150, 0, camera_x)
-    elif turn_dir.value == "right":
-        x_last = np.clip(candidates[0][3] + 150, 0, camera_x)
+    if line_turn_dir == "left":
+        x_last = np.clip(x_mean[index] - 150, 0, camera_x)
+    elif line_turn_dir == "right":
+        x_last = np.clip(x_mean[index] + 150, 0, camera_x)
     else:
-        x_last = candidates[0][3]
+        x_last = x_mean[index]
 
-    y_last = candidates[0][4]
-    blackline = contours_blk[candidates[0][0]]
-    blackline_crop = blackline[np.where(blackline[:, 0, 1] > camera_y * line_crop.value)]
+    y_last = y_mean[index]
+    line_runs = component_runs(runs, components[index])
 
-    cv2.drawContours(cv2_img, blackline, -1, (255, 0, 0), 2)
-    cv2.drawContours(cv2_img, blackline_crop, -1, (255, 255, 0), 2)
+    # Outline of the line, the part below the crop in a second color
+    run_y, run_start, run_end = line_runs
+    crop_runs = run_y > camera_y * crop
+    cv2_img[run_y, run_start] = (255, 0, 0)
+    cv2_img[run_y, run_end - 1] = (255, 0, 0)
+    cv2_img[run_y[crop_runs], run_start[crop_runs]] = (255, 255, 0)
+    cv2_img[run_y[crop_runs], run_end[crop_runs] - 1] = (255, 255, 0)
 
     cv2.circle(cv2_img, (int(x_last), int(y_last)), 3, (0, 0, 255), -1)
 
-    return blackline, blackline_crop
+    return line_runs, components[index, component_area]
 
 
 @njit(cache=True)
-def calculate_angle_numba(blackline, blackline_crop, last_bottom_point, average_line_point):
-    max_gap = 1
-    max_line_width = camera_x * .19
+def add_to_row(row, start, end, previous_end, max_gap):
+    # row: [pixels, twice the sum of x, gaps, pixels left of the first gap, twice the sum of x left of the first gap]
+    if previous_end >= 0 and start - previous_end > max_gap:
+        row[2] += 1
+        if row[2] == 1:
+            row[3] = row[0]
+            row[4] = row[1]
 
-    poi_no_crop = np.zeros((4, 2), dtype=np.int32)  # [t, l, r, b]
+    row[0] += end - start
+    row[1] += (start + end - 1) * (end - start)
 
-    # Top without crop
-    blackline_y_min = np.amin(blackline[:, :, 1])
-    blackline_top = blackline[np.where(blackline[:, 0, 1] == blackline_y_min)][:, :, 0]
 
-    blackline_top = blackline_top[blackline_top[:, 0].argsort()]
-    blackline_top_gap_fill = (blackline_top + max_gap + 1)[:-1]
-
-    blackline_gap_mask = blackline_top_gap_fill < blackline_top[1:]
-
-    top_mean = (int(np.mean(blackline_top)), blackline_y_min)
-
-    if np.sum(blackline_gap_mask) == 1:
-        gap_index = np.where(blackline_gap_mask)[0][0]
-
-        if blackline_top[:gap_index].size > 0 and blackline_top[gap_index:].size > 0:
-            top_mean_l = int(np.mean(blackline_top[:gap_index]))
-            top_mean_r = int(np.mean(blackline_top[gap_index:]))
-
-            top_mean = (top_mean_l, blackline_y_min) if np.abs(top_mean_l - average_line_point) < np.abs(top_mean_r - average_line_point) else (top_mean_r, blackline_y_min)
-
-    poi_no_crop[0] = [top_mean[0], top_mean[1]]
-
-    # Bottom without crop
-    blackline_y_max = np.amax(blackline[:, :, 1])
-    blackline_bottom = blackline[np.where(blackline[:, 0, 1] == blackline_y_max)][:, :, 0]
-    blackline_bottom = blackline_bottom[blackline_bottom[:, 0].argsort()]
-    blackline_bottom_gap_fill = (blackline_bottom + max_gap + 1)[:-1]
-
-    blackline_gap_mask = blackline_bottom_gap_fill < blackline_bottom[1:]
+@njit(cache=True)
+def add_to_column(column, x, y, outer):
+    # column: [x, count, sum of y], a run further out starts a new column
+    if outer:
+        column[0] = x
+        column[1] = 0
+        column[2] = 0
+    if x == column[0]:
+        column[1] += 1
+        column[2] += y
 
-    bottom_point_mean = (int(np.mean(blackline_bottom)), blackline_y_max)
 
-    if np.sum(blackline_gap_mask) == 1:
-        gap_index = np.where(blackline_gap_mask)[0][0]
+@njit(cache=True)
+def outline_row_mean(run_y, run_start, run_end, y):
+    # Mean x of the outline pixels of row y, the pixels of the row without those whose 4 neighbours are all in the line.
+    # Inside the line only these are contour points.
+    row = np.searchsorted(run_y, y), np.searchsorted(run_y, y, side="right")
+    above = np.searchsorted(run_y, y - 1), row[0]
+    below = row[1], np.searchsorted(run_y, y + 1, side="right")
+
+    pixels = 0
+    sum_x = 0
+    for i in range(row[0], row[1]):
+        pixels += run_end[i] - run_start[i]
+        sum_x += (run_start[i] + run_end[i] - 1) * (run_end[i] - run_start[i])
+
+        # Inner pixels of the run that are covered above and below
+        for j in range(above[0], above[1]):
+            start = max(run_start[i] + 1, run_start[j])
+            end = min(run_end[i] - 1, run_end[j])
+            for k in range(below[0], below[1]):
+                inner_start = max(start, run_start[k])
+                inner_end = min(end, run_end[k])
+                if inner_end > inner_start:
+                    pixels -= inner_end - inner_start
+                    sum_x -= (inner_start + inner_end - 1) * (inner_end - inner_start)
+
+    return int(sum_x / (2 * pixels))
 
-        if blackline_bottom[:gap_index].size > 0 and blackline_bottom[gap_index:].size > 0:
-            bottom_mean_l = int(np.mean(blackline_bottom[:gap_index]))
-            bottom_mean_r = int(np.mean(blackline_bottom[gap_index:]))
 
-            if np.abs(bottom_mean_l - bottom_mean_r) > 80:
-                if np.abs(bottom_mean_l - last_bottom_point) < np.abs(bottom_mean_r - last_bottom_point):
-                    bottom_point_mean = (bottom_mean_l, blackline_y_max)
-                    bottom_mean = (bottom_mean_r, blackline_y_max)
-                else:
-                    bottom_point_mean = (bottom_mean_r, blackline_y_max)
-                    bottom_mean = (bottom_mean_l, blackline_y_max)
+@njit(cache=True)
+def calculate_angle_numba(run_y, run_start, run_end, crop_y, last_bottom_point, average_line_point):
+    # Points of interest from the runs of the line (ordered by y and x) in one walk over them.
+    # The first and last runs are the top and bottom rows, the extreme columns are collected with their y sums.
+    max_gap = 1
+    max_line_width = camera_x * .19
 
-                poi_no_crop[3] = [bottom_mean[0], bottom_mean[1]]
+    top_y = run_y[0]
+    bottom_y = run_y[-1]
+    top_row = np.zeros(5, dtype=np.int64)
+    bottom_row = np.zeros(5, dtype=np.int64)
+
+    # [x, count, sum of y] of the leftmost and rightmost column, without and with crop
+    left = np.array([camera_x, 0, 0], dtype=np.int64)
+    right = np.array([-1, 0, 0], dtype=np.int64)
+    crop_left = np.array([camera_x, 0, 0], dtype=np.int64)
+    crop_right = np.array([-1, 0, 0], dtype=np.int64)
+
+    crop_top_y = -1
+    crop_top_start = 0
+    crop_top_end = 0
+
+    for i in range(len(run_y)):
+        y = run_y[i]
+        start = run_start[i]
+        end = run_end[i]
+        previous_end = run_end[i - 1] if i > 0 and run_y[i - 1] == y else -1
+
+        if y == top_y:
+            add_to_row(top_row, start, end, previous_end, max_gap)
+        if y == bottom_y:
+            add_to_row(bottom_row, start, end, previous_end, max_gap)
+
+        add_to_column(left, start, y, start < left[0])
+        add_to_column(right, end - 1, y, end - 1 > right[0])
+
+        if y > crop_y:
+            if crop_top_y < 0:
+                crop_top_y = y
+                crop_top_start = start
+            if y == crop_top_y:
+                crop_top_end = end
+
+            add_to_column(crop_left, start, y, start < crop_left[0])
+            add_to_column(crop_right, end - 1, y, end - 1 > crop_right[0])
 
-    bottom_point = [bottom_point_mean[0], bottom_point_mean[1]]
+    poi_no_crop = np.zeros((4, 2), dtype=np.int32)  # [t, l, r, b]
 
-    # Left without crop
-    blackline_x_min = np.amin(blackline[:, :, 0])
-    blackline_left = blackline[np.where(blackline[:, 0, 0] == blackline_x_min)]
-    left_mean = (blackline_x_min, int(np.mean(blackline_left[:, :, 1])))
-    poi_no_crop[1] = [left_mean[0], left_mean[1]]
+    # Top without crop, the part nearer to the average line point if the row has one gap
+    poi_no_crop[0] = [int(top_row[1] / (2 * top_row[0])), top_y]
+    if top_row[2] == 1:
+        top_mean_l = int(top_row[4] / (2 * top_row[3]))
+        top_mean_r = int((top_row[1] - top_row[4]) / (2 * (top_row[0] - top_row[3])))
+        poi_no_crop[0, 0] = top_mean_l if np.abs(top_mean_l - average_line_point) < np.abs(top_mean_r - average_line_point) else top_mean_r
+
+    # Bottom without crop, two parts far apart are the line (nearer to the last bottom point) and a second bottom point
+    bottom_point = [int(bottom_row[1] / (2 * bottom_row[0])), bottom_y]
+    if bottom_row[2] == 1:
+        bottom_mean_l = int(bottom_row[4] / (2 * bottom_row[3]))
+        bottom_mean_r = int((bottom_row[1] - bottom_row[4]) / (2 * (bottom_row[0] - bottom_row[3])))
+
+        if np.abs(bottom_mean_l - bottom_mean_r) > 80:
+            if np.abs(bottom_mean_l - last_bottom_point) < np.abs(bottom_mean_r - last_bottom_point):
+                bottom_point = [bottom_mean_l, bottom_y]
+                poi_no_crop[3] = [bottom_mean_r, bottom_y]
+            else:
+                bottom_point = [bottom_mean_r, bottom_y]
+                poi_no_crop[3] = [bottom_mean_l, bottom_y]
 
-    # Right without crop
-    blackline_x_max = np.amax(blackline[:, :, 0])
-    blackline_right = blackline[np.where(blackline[:, 0, 0] == blackline_x_max)]
-    right_mean = (blackline_x_max, int(np.mean(blackline_right[:, :, 1])))
-    poi_no_crop[2] = [right_mean[0], right_mean[1]]
+    # Left and right without crop
+    poi_no_crop[1] = [left[0], int(left[2] / left[1])]
+    poi_no_crop[2] = [right[0], int(right[2] / right[1])]
 
     poi = np.zeros((3, 2), dtype=np.int32)  # [t, l, r]
-    is_crop = blackline_crop.size > 0
+    is_crop = crop_top_y >= 0
 
     max_black_top = False
 
     if is_crop:
-        # Top
-        blackline_y_min = np.amin(blackline_crop[:, :, 1])
-        blackline_top = blackline_crop[np.where(blackline_crop[:, 0, 1] == blackline_y_min)][:, :, 0]
-        top_mean = (int(np.mean(blackline_top)), blackline_y_min)
-        poi[0] = [top_mean[0], top_mean[1]]
-
-        blackline_top = blackline_top[blackline_top[:, 0].argsort()]
-        max_black_top = bool(np.abs(blackline_top[0] - blackline_top[-1]) > max_line_width)
-
-        # Left
-        blackline_x_min = np.amin(blackline_crop[:, :, 0])
-        blackline_left = blackline_crop[np.where(blackline_crop[:, 0, 0] == blackline_x_min)]
-        left_mean = (blackline_x_min, int(np.mean(blackline_left[:, :, 1])))
-        poi[1] = [left_mean[0], left_mean[1]]
-
-        # Right
-        blackline_x_max = np.amax(blackline_crop[:, :, 0])
-        blackline_right = blackline_crop[np.where(blackline_crop[:, 0, 0] == blackline_x_max)]
-        right_mean = (blackline_x_max, int(np.mean(blackline_right[:, :, 1])))
-        poi[2] = [right_mean[0], right_mean[1]]
+        poi[0] = [outline_row_mean(run_y, run_start, run_end, crop_top_y), crop_top_y]
+        max_black_top = bool(crop_top_end - 1 - crop_top_start > max_line_width)
+
+        poi[1] = [crop_left[0], int(crop_left[2] / crop_left[1])]
+        poi[2] = [crop_right[0], int(crop_right[2] / crop_right[1])]
 
     return poi, poi_no_crop, is_crop, max_black_top, bottom_point
 
 
-def calculate_angle(blackline, blackline_crop, average_line_angle, turn_direction, last_bottom_point, average_line_point, entry):
+def calculate_angle(line_runs, average_line_angle, turn_direction, last_bottom_point, average_line_point, crop, entry):
     global multiple_bottom_side
 
-    poi, poi_no_crop, is_crop, max_black_top, bottom_point = calculate_angle_numba(blackline, blackline_crop, last_bottom_point, average_line_point)
+    poi, poi_no_crop, is_crop, max_black_top, bottom_point = calculate_angle_numba(*line_runs, camera_y * crop, last_bottom_point, average_line_point)
 
     black_top = poi_no_crop[0][1] < camera_y * .1
 
@@ -366,7 +463,7 @@ def calculate_angle(blackline, blackline_crop, average_line_angle, turn_directio
         if black_top:
             final_poi = poi[0] if is_crop and not max_black_top else poi_no_crop[0]
 
-            if (poi_no_crop[1][0] < camera_x * 0.02 and poi_no_crop[1][1] > camera_y * (line_crop.value * .75)) or (poi_no_crop[2][0] > camera_x * 0.98 and poi_no_crop[2][1] > camera_y * (line_crop.value * .75)):
+            if (poi_no_crop[1][0] < camera_x * 0.02 and poi_no_crop[1][1] > camera_y * (crop * .75)) or (poi_no_crop[2][0] > camera_x * 0.98 and poi_no_crop[2][1] > camera_y * (crop * .75)):
                 final_poi = poi_no_crop[0]
 
                 if black_l_high or black_r_high:
@@ -520,300 +617,336 @@ def calc_silver_angle(silver_image):
 
 
 ########################################################################################################################
-# Line Cam Loop
+# Line Following
 ########################################################################################################################
 
 
-def line_cam_loop():
-    global cv2_img, x_last, y_last, time_line_angle
-
-    model = YOLO('../../Ai/models/silver_zone_entry/silver_classify_s.onnx', task='classify')
-
-    x_last = camera_x / 2
-    y_last = camera_y / 2
-
-    bottom_y = camera_y
-
-    time_line_angle = empty_time_arr()
-    time_turn_direction = empty_time_arr()
-
-    time_last_bottom_point_x = empty_time_arr()
-    time_last_average_line_point = empty_time_arr()
-
-    camera = Picamera2()
-
-    mode = camera.sensor_modes[0]
-    camera.configure(camera.create_video_configuration(sensor={'output_size': mode['size'], 'bit_depth': mode['bit_depth']}))
-
-    camera.start()
-    camera.set_controls({"AfMode": controls.AfModeEnum.Manual, "LensPosition": 6.5, "FrameDurationLimits": (1000000 // 50, 1000000 // 50)})  # {"AfMode": controls.AfModeEnum.Manual, "LensPosition": 0.4} {"AfMode": controls.AfModeEnum.Continuous, "AfSpeed": controls.AfSpeedEnum.Fast}
-    time.sleep(0.1)
-
-    if not debug_mode:
-        shm_cam1 = shared_memory.SharedMemory(name="shm_cam_1", create=True, size=338688)
-
-    calibration_saved = True
-    update_color_values()
-
-    # Kernal for noise reduction
-    kernal = np.ones((3, 3), np.uint8)
-
-    # FPS counter
-    fps_time = time.perf_counter()
-    counter = 0
-    fps = 0
-
-    # FPS limiter 
-    max_frames_zone = 20
-    max_frames_line = 90
-    fps_limit_time = time.perf_counter()
-
-    last_image = np.zeros((camera_y, camera_x), dtype=np.uint8)
+class LineProcessor:
+    # Line following part of the line camera loop, one frame per process() call with the state carried between frames.
+    # The stages run inside stage_timer, so the benchmark times the same code the loop runs.
+    def __init__(self, silver_worker=None, stage_timer=None):
+        global x_last, y_last
+
+        self.__silver_worker = silver_worker  # Without a worker the silver classifier doesn't run
+        self.stage_timer = stage_timer or StageTimer()
+
+        self.__image_similarity = metrics[config_manager.read_variable('similarity', 'line_metric') or "ssim"]
+        self.similarity_every = 30  # Frames from one similarity check to the next
+        self.__similarity_counter = 0
+        self.__last_image = np.zeros((camera_y, camera_x), dtype=np.uint8)
+
+        self.__do_inference_counter = 10
+        self.__motion_estimator = MotionEstimator()
+        self.__black_sums = IntegralImage()
+        self.__silver_black_image = None
+
+        x_last = camera_x / 2
+        y_last = camera_y / 2
+        self.__bottom_y = camera_y
+
+        self.__time_line_angle = empty_time_arr()
+        self.__time_turn_direction = empty_time_arr()
+        self.__time_last_bottom_point_x = empty_time_arr()
+        self.__time_last_average_line_point = empty_time_arr()
+
+        timer.set_timer("image_similarity", .5)
+        timer.set_timer("multiple_bottom", .05)
+        timer.set_timer("multiple_side_l", .05)
+        timer.set_timer("multiple_side_r", .05)
+        timer.set_timer("right_marker", .05)
+        timer.set_timer("left_marker", .05)
+        timer.set_timer("right_marker_up", .05)
+        timer.set_timer("left_marker_up", .05)
+
+    def reset_motion(self):
+        # While the line isn't followed, the image motion starts again with the next frame
+        self.__motion_estimator.reset()
+
+    def process(self, image, raw_capture, frame_id, capture_time):
+        # Returns the line results of the frame for state.publish and draws the detections into the image
+        global cv2_img
+        cv2_img = image
+        line_result = {}
+
+        # Image motion for the stuck detection, on the frame before anything is drawn on it
+        with self.stage_timer("motion"):
+            line_result["line_motion"], line_result["line_motion_response"] = self.__motion_estimator.update(cv2_img, capture_time)
+
+        # Silver AI prediction, a frame submitted while the last one is still running replaces the waiting one
+        do_inference_limit = 4 if rotation_y.value in ["ramp_down", "ramp_up"] else 7
+        if self.__do_inference_counter >= do_inference_limit and self.__silver_worker is not None:
+            self.__silver_worker.submit(raw_capture if raw_capture is not None else cv2_img, frame_id, capture_time)
+            self.__do_inference_counter = 0
+
+        self.__do_inference_counter += 1
+        if silver_value.value > .5:
+            cv2.circle(cv2_img, (10, camera_y - 10), 5, (100, 100, 100), -1, cv2.LINE_AA)
+
+        with self.stage_timer("segmentation"):
+            black_image = np.empty((camera_y, camera_x), dtype=np.uint8)
+            green_image = np.empty((camera_y, camera_x), dtype=np.uint8)
+            red_image = np.empty((camera_y, camera_x), dtype=np.uint8)
+
+            # Adjust black calibration for zone entry
+            if line_status.value in ["check_silver", "position_entry", "position_entry_1"]:
+                segment_image(cv2_img, line_color_table, int(camera_y * .7), black_max_silver_validate_top_off, black_max_silver_validate_bottom_off, green_bit, red_bit, green_bit, black_image, green_image, red_image)
+
+            elif line_status.value == "position_entry_2":
+                segment_image(cv2_img, line_color_table, int(camera_y * .4), black_max_silver_validate_top_on, black_max_silver_validate_bottom_on, green_bit, red_bit, green_bit, black_image, green_image, red_image)
 
-    timer.set_timer("image_similarity", .5)
-    timer.set_timer("multiple_bottom", .05)
-    timer.set_timer("multiple_side_l", .05)
-    timer.set_timer("multiple_side_r", .05)
-    timer.set_timer("right_marker", .05)
-    timer.set_timer("left_marker", .05)
-    timer.set_timer("right_marker_up", .05)
-    timer.set_timer("left_marker_up", .05)
-
-    do_inference_counter = 10
-    check_similarity_counter = 0
-    check_similarity_limit = 30
-
-    while not terminate.value:
-        raw_capture = camera.capture_array()
-        raw_capture = cv2.resize(raw_capture, (camera_x, camera_y))
-        cv2_img = cv2.cvtColor(raw_capture, cv2.COLOR_RGBA2BGR)
-
-        frame_limit = max_frames_zone if objective.value == "zone" and (zone_status.value == "begin" or zone_status.value == "find_balls" or zone_status.value == "pickup_ball") else max_frames_line
-        if objective.value == "follow_line" and not rotation_y.value in ["ramp_down", "ramp_up"]:
-            do_inference_limit = 7
-        elif objective.value == "follow_line" and rotation_y.value in ["ramp_down", "ramp_up"]:
-            do_inference_limit = 4
+            else:
+                segment_image(cv2_img, line_color_table, int(camera_y * .4), black_max_normal_top, black_max_normal_bottom, green_bit, red_bit, green_bit, black_image, green_image, red_image)
+
+        # Change black_max to black_max_ramp_down_top if the top section of the image is too dark
+        with self.stage_timer("ramp_check"):
+            dark_ahead = False
+            self.__black_sums.update(black_image)
+            black_mean = round(self.__black_sums.mean((0, 0, camera_x, int(camera_y * .25))), 2)
+            if black_mean > 90 and not line_status.value == "check_silver":
+                black_image_2 = cv2.inRange(cv2_img, black_min, black_max_ramp_down_top)
+                black_image_2 -= green_image
+                black_image_2[black_image_2 < 2] = 0
+
+                black_mean_2 = round(np.mean(black_image_2[0:int(camera_y * .25), 0:camera_x]), 2)
+
+                if black_mean_2 + 30 < black_mean:  # 20
+                    cv2.circle(cv2_img, (10, 10), 5, (0, 0, 0), -1, cv2.LINE_AA)
+                    black_image[0:int(camera_y * .4), 0:camera_x] = black_image_2[0:int(camera_y * .4), 0:camera_x]
+                    self.__black_sums.update(black_image)
+                    dark_ahead = True
+
+            line_result["ramp_ahead"] = dark_ahead
+
+            line_result["black_average"] = self.__black_sums.mean()
+
+        # Check für image similarity
+        if self.__similarity_counter >= self.similarity_every:
+            with self.stage_timer("similarity"):
+                line_result["line_similarity"] = self.__image_similarity(black_image, self.__last_image)
+            self.__last_image = black_image.copy()
+            self.__similarity_counter = 0
+        self.__similarity_counter += 1
+
+        # Cut out certain parts of the image
+        with self.stage_timer("window"):
+            x0, y0, x1, y1 = line_window(line_status.value, rotation_y.value, obstacle_direction.value, line_result["black_average"], self.__bottom_y)
+            if (x0, y0, x1, y1) != (0, 0, camera_x, camera_y):
+                window_image = np.zeros_like(black_image)
+                window_image[y0:y1, x0:x1] = black_image[y0:y1, x0:x1]
+                black_image = window_image
+
+        # Noise reduction
+        with self.stage_timer("morphology"):
+            if line_status.value == "position_entry_2":
+                noise_reduction = noise_reduction_marker
+            elif line_status.value == "gap_avoid":
+                noise_reduction = noise_reduction_gap
+            else:
+                noise_reduction = noise_reduction_line
+
+            # Only the window and as far as the morphology reaches into the cut out part needs to be processed
+            x0, y0, x1, y1 = pad_window((x0, y0, x1, y1), morphology_reach(noise_reduction), black_image.shape)
+            black_image[y0:y1, x0:x1] = apply_morphology(black_image[y0:y1, x0:x1], noise_reduction)
+
+            green_image = apply_morphology(green_image, noise_reduction_marker)
+            red_image = apply_morphology(red_image, noise_reduction_marker)
+
+        # Calculate the angle of the silver line
+        if line_status.value == "position_entry_1":
+            self.__silver_black_image = black_image.copy()
+
+        if line_status.value == "position_entry_2":
+            silver_image = black_image.copy() - self.__silver_black_image.copy()
+            silver_image[silver_image < 2] = 0
+            calc_silver_angle(silver_image)
+
+        # Find contours in the image
+        with self.stage_timer("find_contours"):
+            contours_grn, _ = cv2.findContours(green_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+            contours_red, _ = cv2.findContours(red_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        with self.stage_timer("line_components"):
+            black_components, black_runs = line_components(black_image, (x0, y0, x1, y1), min_line_size.value)
+
+        # Check for red line
+        line_result["red_detected"] = check_contour_size(contours_red)
+
+        # Check for green turn signs
+        if len(contours_grn) > 0:
+            with self.stage_timer("green_check"):
+                self.__black_sums.update(black_image)
+                turn_direction = check_green(contours_grn, self.__black_sums)
         else:
-            do_inference_limit = 10
+            turn_direction = "straight"
+
+        self.__time_turn_direction = add_time_value(self.__time_turn_direction, average_direction(turn_direction))
+        avg_turn_dir = get_time_average(self.__time_turn_direction, .2)
+
+        if avg_turn_dir > .1 and not rotation_y.value == "ramp_up":
+            timer.set_timer("right_marker", .5)
+        elif avg_turn_dir > .1 and rotation_y.value == "ramp_up":
+            timer.set_timer("right_marker_up", .8)
+        elif avg_turn_dir < -.1 and not rotation_y.value == "ramp_up":
+            timer.set_timer("left_marker", .5)
+        elif avg_turn_dir < -.1 and rotation_y.value == "ramp_up":
+            timer.set_timer("left_marker_up", .8)
+
+        if (not timer.get_timer("right_marker") or not timer.get_timer("right_marker_up")) and not turn_direction == "turn_around" and avg_turn_dir >= 0 and rotation_y.value != "ramp_up":
+            line_turn_dir = "right"
+            crop = .45
+        elif (not timer.get_timer("right_marker") or not timer.get_timer("right_marker_up")) and not turn_direction == "turn_around" and avg_turn_dir >= 0 and rotation_y.value == "ramp_up":
+            line_turn_dir = "right"
+            crop = .75
+        elif (not timer.get_timer("left_marker") or not timer.get_timer("left_marker_up")) and not turn_direction == "turn_around" and avg_turn_dir <= 0 and rotation_y.value != "ramp_up":
+            line_turn_dir = "left"
+            crop = .45
+        elif (not timer.get_timer("left_marker") or not timer.get_timer("left_marker_up")) and not turn_direction == "turn_around" and avg_turn_dir <= 0 and rotation_y.value == "ramp_up":
+            line_turn_dir = "left"
+            crop = .75
+        else:
+            line_turn_dir = turn_direction
+            crop = .75 if rotation_y.value == "ramp_up" or not timer.get_timer("was_ramp_up") else .48
 
-        if time.perf_counter() - fps_limit_time > 1 / frame_limit:
-            fps_limit_time = time.perf_counter()
+        line_result["turn_dir"] = line_turn_dir
+        line_result["line_crop"] = crop
 
-            if calibrate_color_status.value == "none":
+        # Determine the correct line
+        if len(black_components) > 0:
+            with self.stage_timer("angle"):
+                line_result["line_detected"] = True
+                line_runs, line_result["line_size"] = determine_correct_line(black_components, black_runs, line_turn_dir, crop)
 
-                # Silver AI prediction
-                if objective.value == "follow_line":
-                    if do_inference_counter >= do_inference_limit:
-                        results = model.predict(raw_capture, imgsz=128, conf=0.4, workers=4, verbose=False)
-                        result = results[0].numpy()
+                # Calculate the gap angle 
+                if line_status.value == "gap_detected":
+                    p1, p2, angle = get_gap_angle(cv2.boxPoints(cv2.minAreaRect(run_edges(line_runs))))
+                    if p1[1] < camera_y * 0.95 and p2[1] < camera_y * 0.95:
+                        line_result["gap_angle"] = angle
 
-                        confidences = result.probs.top5conf
-                        silver_value.value = confidences[0] if result.probs.top1 == 1 else confidences[1]  # 0 = Line, 1 = Silver
-                        do_inference_counter = 0
+                        center_gap_ponit = (p1 - p2) / 2 + p2
 
-                    do_inference_counter += 1
-                    if silver_value.value > .5:
-                        cv2.circle(cv2_img, (10, camera_y - 10), 5, (100, 100, 100), -1, cv2.LINE_AA)
+                        line_result["gap_center_x"] = int((center_gap_ponit[0] - camera_x / 2) / (camera_x / 2) * 180)
+                        line_result["gap_center_y"] = center_gap_ponit[1]
 
-                if objective.value == "follow_line":
-                    hsv_image = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)
-                    green_image = cv2.inRange(hsv_image, green_min, green_max)
-                    red_image = cv2.inRange(hsv_image, red_min_1, red_max_1) + cv2.inRange(hsv_image, red_min_2, red_max_2)
+                        cv2.line(cv2_img, (int(p1[0]), int(p1[1])), (int(p2[0]), int(p2[1])), (0, 255, 0), 2)
+                        cv2.circle(cv2_img, (int(center_gap_ponit[0]), int(center_gap_ponit[1])), 5, (0, 255, 0), 1, cv2.LINE_AA)
 
-                    # Adjust black calibration for zone entry
-                    if line_status.value in ["check_silver", "position_entry", "position_entry_1"]:
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_silver_validate_bottom_off)
-                        black_image[0:int(camera_y * .7), 0:camera_x] = cv2.inRange(cv2_img, black_min, black_max_silver_validate_top_off)[0:int(camera_y * .7), 0:camera_x]
+                else:
+                    line_result["gap_angle"] = -181
+                    line_result["gap_center_x"] = -181
+                    line_result["gap_center_y"] = -1
 
-                    elif line_status.value == "position_entry_2":
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_silver_validate_bottom_on)
-                        black_image[0:int(camera_y * .4), 0:camera_x] = cv2.inRange(cv2_img, black_min, black_max_silver_validate_top_on)[0:int(camera_y * .4), 0:camera_x]
+                # Calculate the angle to turn
+                last_bottom_point_x = get_time_average(self.__time_last_bottom_point_x, .15)
+                last_average_line_point = get_time_average(self.__time_last_average_line_point, .15)
 
-                    else:
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_normal_bottom)
-                        black_image[0:int(camera_y * .4), 0:camera_x] = cv2.inRange(cv2_img, black_min, black_max_normal_top)[0:int(camera_y * .4), 0:camera_x]
+                angle, poi, bottom_point = calculate_angle(line_runs, get_time_average(self.__time_line_angle, .3), line_turn_dir, last_bottom_point_x, last_average_line_point, crop, entry=line_status.value == "position_entry")
+                line_result["line_angle"] = angle
+                line_result["line_angle_y"] = poi[1]
 
-                    black_image -= green_image
-                    black_image[black_image < 2] = 0
+                self.__time_line_angle = add_time_value(self.__time_line_angle, angle)
+                self.__time_last_bottom_point_x = add_time_value(self.__time_last_bottom_point_x, bottom_point[0])
 
-                    # Change black_max to black_max_ramp_down_top if the top section of the image is too dark
-                    dark_ahead = False
-                    black_mean = round(np.mean(black_image[0:int(camera_y * .25), 0:camera_x]), 2)
-                    if black_mean > 90 and not line_status.value == "check_silver":
-                        black_image_2 = cv2.inRange(cv2_img, black_min, black_max_ramp_down_top)
-                        black_image_2 -= green_image
-                        black_image_2[black_image_2 < 2] = 0
+                if bottom_point[0] != poi[0] and bottom_point[1] != poi[1]:
+                    slope = (bottom_point[1] - poi[1]) / (bottom_point[0] - poi[0])
+                    x = min(max(poi[0] + (0 - poi[1]) / slope, 0), camera_x)
+                else:
+                    x = poi[0]
 
-                        black_mean_2 = round(np.mean(black_image_2[0:int(camera_y * .25), 0:camera_x]), 2)
+                self.__time_last_average_line_point = add_time_value(self.__time_last_average_line_point, x)
 
-                        if black_mean_2 + 30 < black_mean:  # 20
-                            cv2.circle(cv2_img, (10, 10), 5, (0, 0, 0), -1, cv2.LINE_AA)
-                            black_image[0:int(camera_y * .4), 0:camera_x] = black_image_2[0:int(camera_y * .4), 0:camera_x]
-                            dark_ahead = True
+                self.__bottom_y = bottom_point[1]
 
-                    ramp_ahead.value = dark_ahead
+                cv2.circle(cv2_img, (int(last_average_line_point), 0), 5, (0, 255, 255), 1, cv2.LINE_AA)
+                cv2.circle(cv2_img, poi, 5, (0, 0, 255), 1, cv2.LINE_AA)
+                cv2.circle(cv2_img, bottom_point, 5, (255, 255, 0), 1, cv2.LINE_AA)
 
-                    black_average.value = np.mean(black_image[:])
+        else:
+            line_result["line_detected"] = False
+            line_result["line_angle"] = 0
+            line_result["line_size"] = 0
+            line_result["line_angle_y"] = -1
+            line_result["gap_angle"] = -181
+            line_result["gap_center_x"] = -181
+            line_result["gap_center_y"] = -1
 
-                    # Check für image similarity
-                    if check_similarity_counter >= check_similarity_limit:
-                        line_similarity.value = structural_similarity(black_image, last_image)
-                        last_image = black_image.copy()
-                        check_similarity_counter = 0
-                    check_similarity_counter += 1
-
-                    # Cut out certain parts of the image
-                    if line_status.value == "obstacle_avoid" or line_status.value == "obstacle_detected":
-                        if rotation_y.value == "none":
-                            cv2.rectangle(black_image, (0, 0), (camera_x, int(camera_y * .35)), 0, -1)
-                        if obstacle_direction.value == "l":
-                            cv2.rectangle(black_image, (0, 0), (int(camera_x * .75), camera_y), 0, -1)
-                        elif obstacle_direction.value == "r":
-                            cv2.rectangle(black_image, (int(camera_x * .25), 0), (camera_x, camera_y), 0, -1)
-                    elif line_status.value == "obstacle_orientate":
-                        cv2.rectangle(black_image, (0, 0), (camera_x, int(camera_y * .45)), 0, -1)
-
-                    if line_status.value == "gap_avoid":
-                        cv2.rectangle(black_image, (0, 0), (int(camera_x * .35), camera_y), 0, -1)
-                        cv2.rectangle(black_image, (int(camera_x * .65), 0), (camera_x, camera_y), 0, -1)
-
-                    if bottom_y < camera_y * .95 and black_average.value < 21 and line_status.value == "line_detected":
-                        cv2.rectangle(black_image, (0, 0), (int(camera_x * .25), camera_y), 0, -1)
-                        cv2.rectangle(black_image, (int(camera_x * .75), 0), (camera_x, camera_y), 0, -1)
+        return line_result
 
-                    # Noise reduction
-                    if line_status.value == "position_entry_2":
-                        black_image = cv2.erode(black_image, kernal, iterations=1)
-                        black_image = cv2.dilate(black_image, kernal, iterations=11)
-                        black_image = cv2.erode(black_image, kernal, iterations=9)
-                    elif line_status.value == "gap_avoid":
-                        black_image = cv2.erode(black_image, kernal, iterations=5)
-                        black_image = cv2.dilate(black_image, kernal, iterations=8)
-                    else:
-                        black_image = cv2.erode(black_image, kernal, iterations=5)
-                        black_image = cv2.dilate(black_image, kernal, iterations=17) # Previous values: 12 | 16
-                        black_image = cv2.erode(black_image, kernal, iterations=9)  # Previous values: 4 | 8
 
-                    green_image = cv2.erode(green_image, kernal, iterations=1)
-                    green_image = cv2.dilate(green_image, kernal, iterations=11)
-                    green_image = cv2.erode(green_image, kernal, iterations=9)
 
-                    red_image = cv2.erode(red_image, kernal, iterations=1)
-                    red_image = cv2.dilate(red_image, kernal, iterations=11)
-                    red_image = cv2.erode(red_image, kernal, iterations=9)
+########################################################################################################################
+# Line Cam Loop
+########################################################################################################################
 
-                    # Calculate the angle of the silver line
-                    if line_status.value == "position_entry_1":
-                        silver_black_image = black_image.copy()
 
-                    if line_status.value == "position_entry_2":
-                        silver_image = black_image.copy() - silver_black_image.copy()
-                        silver_image[silver_image < 2] = 0
-                        calc_silver_angle(silver_image)
+def line_cam_loop():
+    global cv2_img
 
-                    # Find contours in the image
-                    contours_grn, _ = cv2.findContours(green_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-                    contours_red, _ = cv2.findContours(red_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-                    contours_blk, _ = cv2.findContours(black_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+    model = Classifier('../../Ai/models/silver_zone_entry/silver_classify_s.onnx')
 
-                    blk_contour_area = np.array([cv2.contourArea(i) for i in contours_blk])
-                    blk_mask = blk_contour_area > min_line_size.value
-                    contours_blk = [c for c, m in zip(contours_blk, blk_mask) if m]
+    # Frames from the camera, a recording or a synthetic source as set in [camera_line], the resized RGBA frame is kept for the silver classifier
+    capture = open_frame_source(config_manager, "line", (camera_x, camera_y), keep_raw=True,
+                                controls={"AfMode": "Manual", "LensPosition": 6.5, "FrameDurationLimits": (1000000 // 50, 1000000 // 50)})  # {"AfMode": "Manual", "LensPosition": 0.4} {"AfMode": "Continuous", "AfSpeed": "Fast"}
+    replaying = isinstance(capture, FrameReplay)
 
-                    # Check for red line
-                    red_detected.value = check_contour_size(contours_red)
+    recorder = None
+    record_path = config_manager.read_variable('recording', 'line_path')
+    if record_path and not replaying:
+        recorder = FrameRecorder(record_path, "line", chunk_size=config_manager.read_variable('recording', 'chunk_size') or 100, every=config_manager.read_variable('recording', 'every') or 1)
+        recorder.start()
 
-                    # Check for green turn signs
-                    if len(contours_grn) > 0:
-                        turn_direction = check_green(contours_grn, black_image)
-                    else:
-                        turn_direction = "straight"
-
-                    time_turn_direction = add_time_value(time_turn_direction, average_direction(turn_direction))
-                    avg_turn_dir = get_time_average(time_turn_direction, .2)
-
-                    if avg_turn_dir > .1 and not rotation_y.value == "ramp_up":
-                        timer.set_timer("right_marker", .5)
-                    elif avg_turn_dir > .1 and rotation_y.value == "ramp_up":
-                        timer.set_timer("right_marker_up", .8)
-                    elif avg_turn_dir < -.1 and not rotation_y.value == "ramp_up":
-                        timer.set_timer("left_marker", .5)
-                    elif avg_turn_dir < -.1 and rotation_y.value == "ramp_up":
-                        timer.set_timer("left_marker_up", .8)
-
-                    if (not timer.get_timer("right_marker") or not timer.get_timer("right_marker_up")) and not turn_direction == "turn_around" and avg_turn_dir >= 0 and rotation_y.value != "ramp_up":
-                        turn_dir.value = "right"
-                        line_crop.value = .45
-                    elif (not timer.get_timer("right_marker") or not timer.get_timer("right_marker_up")) and not turn_direction == "turn_around" and avg_turn_dir >= 0 and rotation_y.value == "ramp_up":
-                        turn_dir.value = "right"
-                        line_crop.value = .75
-                    elif (not timer.get_timer("left_marker") or not timer.get_timer("left_marker_up")) and not turn_direction == "turn_around" and avg_turn_dir <= 0 and rotation_y.value != "ramp_up":
-                        turn_dir.value = "left"
-                        line_crop.value = .45
-                    elif (not timer.get_timer("left_marker") or not timer.get_timer("left_marker_up")) and not turn_direction == "turn_around" and avg_turn_dir <= 0 and rotation_y.value == "ramp_up":
-                        turn_dir.value = "left"
-                        line_crop.value = .75
-                    else:
-                        turn_dir.value = turn_direction
-                        line_crop.value = .75 if rotation_y.value == "ramp_up" or not timer.get_timer("was_ramp_up") else .48
-
-                    # Determine the correct line
-                    if len(contours_blk) > 0:
-                        line_detected.value = True
-                        blackline, black_line_crop = determine_correct_line(contours_blk)
-                        line_size.value = cv2.contourArea(blackline)
-
-                        # Calculate the gap angle 
-                        if line_status.value == "gap_detected":
-                            p1, p2, angle = get_gap_angle(cv2.boxPoints(cv2.minAreaRect(blackline)))
-                            if p1[1] < camera_y * 0.95 and p2[1] < camera_y * 0.95:
-                                gap_angle.value = angle
+    # The silver classifier runs in its own thread, so line following doesn't wait for it
+    silver_worker = InferenceWorker(lambda frame: predict_silver(model, frame), publish_silver)
+    silver_worker.start()
 
-                                center_gap_ponit = (p1 - p2) / 2 + p2
+    line_processor = LineProcessor(silver_worker)
 
-                                gap_center_x.value = int((center_gap_ponit[0] - camera_x / 2) / (camera_x / 2) * 180)
-                                gap_center_y.value = center_gap_ponit[1]
+    if not debug_mode:
+        shm_cam1 = shared_memory.SharedMemory(name="shm_cam_1", create=True, size=338688)
 
-                                cv2.line(cv2_img, (int(p1[0]), int(p1[1])), (int(p2[0]), int(p2[1])), (0, 255, 0), 2)
-                                cv2.circle(cv2_img, (int(center_gap_ponit[0]), int(center_gap_ponit[1])), 5, (0, 255, 0), 1, cv2.LINE_AA)
+    calibration_saved = True
+    update_color_values()
 
-                        else:
-                            gap_angle.value = -181
-                            gap_center_x.value = -181
-                            gap_center_y.value = -1
+    # Kernal for noise reduction
+    kernal = np.ones((3, 3), np.uint8)
 
-                        # Calculate the angle to turn
-                        last_bottom_point_x = get_time_average(time_last_bottom_point_x, .15)
-                        last_average_line_point = get_time_average(time_last_average_line_point, .15)
+    # FPS counter
+    fps_time = time.perf_counter()
+    counter = 0
+    fps = 0
 
-                        line_angle.value, poi, bottom_point = calculate_angle(blackline, black_line_crop, get_time_average(time_line_angle, .3), turn_dir.value, last_bottom_point_x, last_average_line_point, entry=line_status.value == "position_entry")
-                        line_angle_y.value = poi[1]
+    # FPS limiter 
+    max_frames_zone = 20
+    max_frames_line = 90
+    fps_limit_time = time.perf_counter()
 
-                        time_line_angle = add_time_value(time_line_angle, line_angle.value)
-                        time_last_bottom_point_x = add_time_value(time_last_bottom_point_x, bottom_point[0])
+    while not terminate.value:
+        try:
+            raw_capture, cv2_img, frame_id, capture_time = capture.read()
+        except EOFError:  # End of the replay
+            break
+        except TimeoutError:  # Camera stalled, e.g. while libcamera restarts, wait for the next frame
+            continue
 
-                        if bottom_point[0] != poi[0] and bottom_point[1] != poi[1]:
-                            slope = (bottom_point[1] - poi[1]) / (bottom_point[0] - poi[0])
-                            x = min(max(poi[0] + (0 - poi[1]) / slope, 0), camera_x)
-                        else:
-                            x = poi[0]
+        # Record the frame before anything is drawn into it, or restore the recorded state of a replayed frame
+        if recorder is not None:
+            recorder.record(cv2_img, frame_id, capture_time, state.snapshot(*recorded_fields))
+        if replaying:
+            state.publish(**capture.state)
 
-                        time_last_average_line_point = add_time_value(time_last_average_line_point, x)
+        frame_limit = max_frames_zone if objective.value == "zone" and (zone_status.value == "begin" or zone_status.value == "find_balls" or zone_status.value == "pickup_ball") else max_frames_line
 
-                        bottom_y = bottom_point[1]
+        # A replay processes every frame, so the results don't depend on how fast the host runs
+        if replaying or time.perf_counter() - fps_limit_time > 1 / frame_limit:
+            fps_limit_time = time.perf_counter()
 
-                        cv2.circle(cv2_img, (int(last_average_line_point), 0), 5, (0, 255, 255), 1, cv2.LINE_AA)
-                        cv2.circle(cv2_img, poi, 5, (0, 0, 255), 1, cv2.LINE_AA)
-                        cv2.circle(cv2_img, bottom_point, 5, (255, 255, 0), 1, cv2.LINE_AA)
+            if calibrate_color_status.value == "none":
+                # While the line isn't followed, the image motion starts again with the next frame
+                if objective.value != "follow_line":
+                    line_processor.reset_motion()
 
-                    else:
-                        line_detected.value = False
-                        line_angle.value = 0
-                        line_size.value = 0
-                        line_angle_y.value = -1
-                        gap_angle.value = -181
-                        gap_center_x.value = -181
-                        gap_center_y.value = -1
+                if objective.value == "follow_line":
+                    # Publish the whole frame at once, so control never mixes values of different frames
+                    line_result = line_processor.process(cv2_img, raw_capture, frame_id, capture_time)
+                    state.publish(line_frame_id=frame_id, line_frame_time=capture_time, **line_result)
 
 
                 ########################################################################################################################
@@ -821,33 +954,21 @@ def line_cam_loop():
                 ########################################################################################################################
 
                 elif objective.value == "zone":
-                    hsv_image = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)
-                    green_image = cv2.inRange(hsv_image, green_min_zone, green_max_zone)
-                    red_image = cv2.inRange(hsv_image, red_min_1_zone, red_max_1_zone) + cv2.inRange(hsv_image, red_min_2_zone, red_max_2_zone)
+                    black_image = np.empty((camera_y, camera_x), dtype=np.uint8)
+                    green_image = np.empty((camera_y, camera_x), dtype=np.uint8)
+                    red_image = np.empty((camera_y, camera_x), dtype=np.uint8)
 
                     if zone_status.value in ["exit", "deposit_red", "deposit_green"]:  # With LEDs on
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_normal_bottom)
-                        black_image[0:int(camera_y * .4), 0:camera_x] = cv2.inRange(cv2_img, black_min, black_max_normal_top)[0:int(camera_y * .4), 0:camera_x]
-
-                        black_image -= green_image
-                        black_image[black_image < 2] = 0
-
-                        black_image -= red_image
-                        black_image[black_image < 2] = 0
+                        segment_image(cv2_img, line_color_table, int(camera_y * .4), black_max_normal_top, black_max_normal_bottom, green_zone_bit, red_zone_bit, green_zone_bit | red_zone_bit, black_image, green_image, red_image)
                     else:
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_zone)
+                        segment_image(cv2_img, line_color_table, 0, black_max_zone, black_max_zone, green_zone_bit, red_zone_bit, 0, black_image, green_image, red_image)
 
                     black_average.value = np.mean(black_image[:])
 
                     # Noise reduction
-                    black_image = cv2.erode(black_image, kernal, iterations=5)
-                    black_image = cv2.dilate(black_image, kernal, iterations=8)
-
-                    green_image = cv2.erode(green_image, kernal, iterations=5)
-                    green_image = cv2.dilate(green_image, kernal, iterations=8)
-
-                    red_image = cv2.erode(red_image, kernal, iterations=5)
-                    red_image = cv2.dilate(red_image, kernal, iterations=8)
+                    black_image = apply_morphology(black_image, noise_reduction_gap)
+                    green_image = apply_morphology(green_image, noise_reduction_gap)
+                    red_image = apply_morphology(red_image, noise_reduction_gap)
 
                     # Find contours in the image
                     contours_grn, _ = cv2.findContours(green_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
@@ -907,9 +1028,12 @@ def line_cam_loop():
 
             elif calibrate_color_status.value == "check" and not (calibration_color.value == "z-g" or calibration_color.value == "z-r"):
                 if not calibration_saved:
+                    # Average colors of the calibration squares
+                    frame_sums = IntegralImage(cv2_img)
+                    hsv_sums = IntegralImage(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV))
 
                     if calibration_color.value == "l-gl":
-                        average_color = find_average_color(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)[center_calibration_square[1]:center_calibration_square[3], center_calibration_square[0]:center_calibration_square[2]])
+                        average_color = hsv_sums.mean(center_calibration_square)
 
                         c_green_min = np.clip(np.rint(np.array([average_color[0] - 20, 95, average_color[2] - 60])), 0, 255)
                         c_green_max = np.clip(np.rint([average_color[0] + 20, 255, 255]), 0, 255)
@@ -918,7 +1042,7 @@ def line_cam_loop():
                         config_manager.write_variable('color_values_line', 'green_max', [int(c_green_max[0]), int(c_green_max[1]), int(c_green_max[2])])
 
                     elif calibration_color.value == "l-rl":
-                        average_color = find_average_color(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)[center_calibration_square[1]:center_calibration_square[3], center_calibration_square[0]:center_calibration_square[2]])
+                        average_color = hsv_sums.mean(center_calibration_square)
 
                         c_red_min = np.clip(np.rint(np.array([100, 90])), 0, 255)
                         c_red_max = np.clip(np.rint([255, 255]), 0, 255)
@@ -929,14 +1053,14 @@ def line_cam_loop():
                         config_manager.write_variable('color_values_line', 'red_max_2', [180, int(c_red_max[0]), int(c_red_max[1])])
 
                     elif calibration_color.value == "l-bz":
-                        average_color = find_average_color(cv2_img[center_calibration_square[1]:center_calibration_square[3], center_calibration_square[0]:center_calibration_square[2]])
+                        average_color = frame_sums.mean(center_calibration_square)
 
                         c_black_max_zone = np.clip(np.rint(np.array([average_color[0] + 20, average_color[1] + 20, average_color[2] + 20])), 0, 255)
 
                         config_manager.write_variable('color_values_line', 'black_max_zone', [int(c_black_max_zone[0]), int(c_black_max_zone[1]), int(c_black_max_zone[2])])
 
                     elif calibration_color.value == "l-gz":
-                        average_color = find_average_color(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)[top_calibration_square[1]:top_calibration_square[3], top_calibration_square[0]:top_calibration_square[2]])
+                        average_color = hsv_sums.mean(top_calibration_square)
 
                         c_green_min_zone = np.clip(np.rint(np.array([average_color[0] - 20, 95, average_color[2] - 60])), 0, 255)
                         c_green_max_zone = np.clip(np.rint(np.array([average_color[0] + 20, 255, 255])), 0, 255)
@@ -945,7 +1069,7 @@ def line_cam_loop():
                         config_manager.write_variable('color_values_line', 'green_max_zone', [int(c_green_max_zone[0]), int(c_green_max_zone[1]), int(c_green_max_zone[2])])
 
                     elif calibration_color.value == "l-rz":
-                        average_color = find_average_color(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)[top_calibration_square[1]:top_calibration_square[3], top_calibration_square[0]:top_calibration_square[2]])
+                        average_color = hsv_sums.mean(top_calibration_square)
 
                         c_red_min_1_zone = np.clip(np.rint(np.array([100, 90])), 0, 255)
                         c_red_max_1_zone = np.clip(np.rint(np.array([255, 255])), 0, 255)
@@ -956,15 +1080,15 @@ def line_cam_loop():
                         config_manager.write_variable('color_values_line', 'red_max_2_zone', [180, int(c_red_max_1_zone[0]), int(c_red_max_1_zone[1])])
 
                     elif calibration_color.value == "l-bd":
-                        average_color = find_average_color(cv2_img[top_edge_calibration_square_small[1]:top_edge_calibration_square_small[3], top_edge_calibration_square_small[0]:top_edge_calibration_square_small[2]])
+                        average_color = frame_sums.mean(top_edge_calibration_square_small)
 
                         c_black_max_ramp_down_top = np.clip(np.rint(np.array([average_color[0] + 15, average_color[1] + 15, average_color[2] + 15])), 0, 255)
 
                         config_manager.write_variable('color_values_line', 'black_max_ramp_down_top', [int(c_black_max_ramp_down_top[0]), int(c_black_max_ramp_down_top[1]), int(c_black_max_ramp_down_top[2])])
 
                     elif calibration_color.value == "l-bn":
-                        average_color_1 = find_average_color(cv2_img[top_calibration_square[1]:top_calibration_square[3], top_calibration_square[0]:top_calibration_square[2]])
-                        average_color_2 = find_average_color(cv2_img[bottom_edge_calibration_square[1]:bottom_edge_calibration_square[3], bottom_edge_calibration_square[0]:bottom_edge_calibration_square[2]])
+                        average_color_1 = frame_sums.mean(top_calibration_square)
+                        average_color_2 = frame_sums.mean(bottom_edge_calibration_square)
 
                         c_black_max_normal_top = np.clip(np.rint(np.array([average_color_1[0] + 65, average_color_1[1] + 65, average_color_1[2] + 65])), 0, 255)
                         c_black_max_normal_bottom = np.clip(np.rint(np.array([average_color_2[0] + 75, average_color_2[1] + 75, average_color_2[2] + 75])), 0, 255)
@@ -973,8 +1097,8 @@ def line_cam_loop():
                         config_manager.write_variable('color_values_line', 'black_max_normal_bottom', [int(c_black_max_normal_bottom[0]), int(c_black_max_normal_bottom[1]), int(c_black_max_normal_bottom[2])])
 
                     elif calibration_color.value == "l-bv":
-                        average_color_1 = find_average_color(cv2_img[top_calibration_square[1]:top_calibration_square[3], top_calibration_square[0]:top_calibration_square[2]])
-                        average_color_2 = find_average_color(cv2_img[bottom_edge_calibration_square[1]:bottom_edge_calibration_square[3], bottom_edge_calibration_square[0]:bottom_edge_calibration_square[2]])
+                        average_color_1 = frame_sums.mean(top_calibration_square)
+                        average_color_2 = frame_sums.mean(bottom_edge_calibration_square)
 
                         c_black_max_silver_validate_top_off = np.clip(np.rint(np.array([average_color_1[0] + 30, average_color_1[1] + 30, average_color_1[2] + 30])), 0, 255)
                         c_black_max_silver_validate_bottom_off = np.clip(np.rint(np.array([average_color_2[0] + 30, average_color_2[1] + 30, average_color_2[2] + 30])), 0, 255)
@@ -983,7 +1107,7 @@ def line_cam_loop():
                         config_manager.write_variable('color_values_line', 'black_max_silver_validate_bottom_off', [int(c_black_max_silver_validate_bottom_off[0]), int(c_black_max_silver_validate_bottom_off[1]), int(c_black_max_silver_validate_bottom_off[2])])
 
                     elif calibration_color.value == "l-bvl":
-                        average_color = find_average_color(cv2_img[center_calibration_square[1]:center_calibration_square[3], center_calibration_square[0]:center_calibration_square[2]])
+                        average_color = frame_sums.mean(center_calibration_square)
 
                         c_black_max_silver_validate_top_on = np.clip(np.rint(np.array([average_color[0], average_color[1], average_color[2]])), 0, 255)
                         c_black_max_silver_validate_bottom_on = np.clip(np.rint(np.array([average_color[0] + 30, average_color[1] + 30, average_color[2] + 30])), 0, 255)
@@ -1101,6 +1225,11 @@ def line_cam_loop():
                 buf = np.ndarray(cv2_img.shape, dtype=cv2_img.dtype, buffer=shm_cam1.buf)
                 buf[:] = cv2_img[:]
 
+    silver_worker.stop()
+    capture.stop()
+    if recorder is not None:
+        recorder.stop()
+
     if not debug_mode:
         shm_cam1.close()
         shm_cam1.unlink()
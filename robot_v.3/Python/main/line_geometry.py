@@ -0,0 +1,127 @@
+import numpy as np
+from numba import njit
+
+# Columns of the component arrays
+component_label = 0
+component_area = 1
+component_left = 2
+component_top = 3
+component_right = 4
+component_bottom = 5
+component_x_mean = 6
+component_y_mean = 7
+
+
+@njit(cache=True)
+def find_root(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@njit(cache=True)
+def label_runs(mask, x0, y0):
+    # 8 connected components of the mask as horizontal runs [start, end) in image coordinates (mask starts at x0, y0).
+    # Runs of a row are merged with the runs of the row above they touch, the union find roots become the labels.
+    height, width = mask.shape
+    max_runs = height * (width // 2 + 1)
+    run_y = np.empty(max_runs, dtype=np.int32)
+    run_start = np.empty(max_runs, dtype=np.int32)
+    run_end = np.empty(max_runs, dtype=np.int32)
+    parent = np.empty(max_runs, dtype=np.int32)
+
+    runs = 0
+    previous_first = 0
+    previous_last = 0
+    for y in range(height):
+        first = runs
+        above = previous_first
+        x = 0
+        while x < width:
+            if mask[y, x] == 0:
+                x += 1
+                continue
+
+            start = x
+            while x < width and mask[y, x] != 0:
+                x += 1
+
+            run_y[runs] = y + y0
+            run_start[runs] = start + x0
+            run_end[runs] = x + x0
+            parent[runs] = runs
+
+            # Runs above that end at start - 1 or later and begin at x or earlier touch this one
+            while above < previous_last and run_end[above] < start + x0:
+                above += 1
+            touching = above
+            while touching < previous_last and run_start[touching] <= x + x0:
+                root_a = find_root(parent, touching)
+                root_b = find_root(parent, runs)
+                if root_a < root_b:
+                    parent[root_b] = root_a
+                elif root_b < root_a:
+                    parent[root_a] = root_b
+                touching += 1
+
+            runs += 1
+
+        previous_first = first
+        previous_last = runs
+
+    # Labels 1 - n in the order of the topmost run, stats per label
+    run_label = np.empty(runs, dtype=np.int32)
+    root_label = np.zeros(runs, dtype=np.int32)
+    stats = np.zeros((runs + 1, 8), dtype=np.int64)
+    labels = 0
+    for i in range(runs):
+        root = find_root(parent, i)
+        if root_label[root] == 0:
+            labels += 1
+            root_label[root] = labels
+            stats[labels, component_left] = run_start[i]
+            stats[labels, component_top] = run_y[i]
+            stats[labels, component_right] = run_end[i] - 1
+        label = root_label[root]
+        run_label[i] = label
+
+        length = run_end[i] - run_start[i]
+        stats[label, component_area] += length
+        stats[label, component_left] = min(stats[label, component_left], run_start[i])
+        stats[label, component_right] = max(stats[label, component_right], run_end[i] - 1)
+        stats[label, component_bottom] = run_y[i]
+        stats[label, component_x_mean] += (run_start[i] + run_end[i] - 1) * length  # Twice the sum of x
+        stats[label, component_y_mean] += run_y[i] * length
+
+    components = np.empty((labels, 8), dtype=np.int32)
+    for label in range(1, labels + 1):
+        area = stats[label, component_area]
+        components[label - 1, component_label] = label
+        components[label - 1, component_area:component_x_mean] = stats[label, component_area:component_x_mean]
+        components[label - 1, component_x_mean] = stats[label, component_x_mean] // (2 * area)
+        components[label - 1, component_y_mean] = stats[label, component_y_mean] // area
+
+    return components, run_y[:runs].copy(), run_start[:runs].copy(), run_end[:runs].copy(), run_label
+
+
+def line_components(mask, window, min_size):
+    # Area, bounding box and mean of all components inside the window in one pass, instead of findContours and a
+    # contourArea / minAreaRect per contour. Returns an int32 array [n, 8] of the components larger than min_size
+    # (label, area, left, top, right, bottom, mean x, mean y in image coordinates) and the runs (y, start, end, label).
+    x0, y0, x1, y1 = window
+    components, run_y, run_start, run_end, run_label = label_runs(mask[y0:y1, x0:x1], x0, y0)
+    return components[components[:, component_area] > min_size], (run_y, run_start, run_end, run_label)
+
+
+def component_runs(runs, component):
+    # Runs (y, start, end) of one component, ordered by y and x
+    run_y, run_start, run_end, run_label = runs
+    selected = run_label == component[component_label]
+    return run_y[selected], run_start[selected], run_end[selected]
+
+
+def run_edges(line_runs):
+    # First and last pixel of every run as [n, 2] x, y points, they have the same convex hull as the component
+    run_y, run_start, run_end = line_runs
+    return np.concatenate((np.column_stack((run_start, run_y)), np.column_stack((run_end - 1, run_y))))
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+
+
+class MotionEstimator:
+    # Image motion of the camera by phase correlation of small grey frames.
+    # Each frame is compared with a reference frame that is at least interval seconds old, so slow motion still shows
+    # up as a measurable shift, and the shift is returned in pixels of the full size frame per second.
+    def __init__(self, size=(112, 63), interval=.05):
+        self.size = size
+        self.interval = interval
+
+        self.__window = cv2.createHanningWindow(size, cv2.CV_32F)
+        self.__reference = None
+        self.__reference_time = 0.
+        self.__scale = 1.
+
+        self.motion = 0.  # Pixels per second
+        self.response = 0.  # Peak of the phase correlation, close to 1 for a pure shift, low if the image changed otherwise
+
+    def reset(self):
+        self.__reference = None
+        self.motion = 0.
+        self.response = 0.
+
+    def update(self, image, frame_time):
+        small = cv2.resize(image, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        small = small.astype(np.float32)
+
+        if self.__reference is None:
+            self.__reference = small
+            self.__reference_time = frame_time
+            self.__scale = image.shape[1] / self.size[0]
+            return self.motion, self.response
+
+        dt = frame_time - self.__reference_time
+        if dt >= self.interval:
+            (shift_x, shift_y), self.response = cv2.phaseCorrelate(self.__reference, small, self.__window)
+            self.motion = float(np.hypot(shift_x, shift_y)) * self.__scale / dt
+
+            self.__reference = small
+            self.__reference_time = frame_time
+
+        return self.motion, self.response
+
+
+class StuckDetector:
+    # Compares the image motion with the commanded speed: the robot is stuck if the motors are driven, but the image
+    # stands still. The evidence is a time that grows while that is true and shrinks twice as fast while the image moves,
+    # so a single blurred frame doesn't reset it and the detector needs no history.
+    def __init__(self, min_speed=.3, max_motion=20., min_response=.3, stuck_time=.35, max_dt=.1):
+        self.min_speed = min_speed  # Commanded motor speed (0 - 1) that has to move the robot
+        self.max_motion = max_motion  # Image motion in pixels per second below which the robot counts as standing
+        self.min_response = min_response  # Lower phase correlation peaks mean a changing image, so the robot moves
+        self.stuck_time = stuck_time  # Seconds of evidence until stuck is reported
+        self.max_dt = max_dt  # Longer gaps between updates are not counted
+
+        self.__evidence = 0.
+        self.__time = None
+
+    @property
+    def stuck(self):
+        return self.__evidence >= self.stuck_time
+
+    def reset(self):
+        self.__evidence = 0.
+        self.__time = None
+
+    def update(self, motion, response, commanded_speed, frame_time):
+        if self.__time is None:
+            self.__time = frame_time
+            return self.stuck
+        if frame_time <= self.__time:  # Same frame as the last update
+            return self.stuck
+
+        dt = min(frame_time - self.__time, self.max_dt)
+        self.__time = frame_time
+
+        if commanded_speed < self.min_speed:
+            self.__evidence = 0.
+        elif motion < self.max_motion and response >= self.min_response:
+            self.__evidence = min(self.__evidence + dt, self.stuck_time)
+        else:
+            self.__evidence = max(self.__evidence - 2 * dt, 0.)
+
+        return self.stuck
@@ -1,101 +1,112 @@
 import time
-from multiprocessing import Manager
 
 import numpy as np
 
-from Managers import ConfigManager
+from Managers import ConfigManager, SharedState, TimeSeries
 
 config_manager = ConfigManager('config.ini')
 
-manager = Manager()
-
-terminate = manager.Value("i", False)
-
-sensor_one = manager.Value("i", -2.0)  # Front Left
-sensor_two = manager.Value("i", -2.0)  # Front Right
-sensor_three = manager.Value("i", -2.0)  # Left
-sensor_four = manager.Value("i", -2.0)  # Right
-sensor_five = manager.Value("i", -2.0)  # Front Center
-sensor_six = manager.Value("i", -2.0)  # Back
-sensor_seven = manager.Value("i", -2.0)  # Gripper
-
-sensor_x_1 = manager.Value("i", 361.0)
-sensor_x_2 = manager.Value("i", 361.0)
-sensor_y_1 = manager.Value("i", 361.0)
-sensor_y_2 = manager.Value("i", 361.0)
-sensor_z_1 = manager.Value("i", 361.0)
-sensor_z_2 = manager.Value("i", 361.0)
-sensor_ax_1 = manager.Value("i", 361.0)
-sensor_ax_2 = manager.Value("i", 361.0)
-sensor_ay_1 = manager.Value("i", 361.0)
-sensor_ay_2 = manager.Value("i", 361.0)
-
-sensor_x = manager.Value("i", 361.0)
-sensor_y = manager.Value("i", 361.0)
-sensor_z = manager.Value("i", 361.0)
-
-x_offset_1 = manager.Value("i", 0.0)
-x_offset_2 = manager.Value("i", 0.0)
-y_offset_1 = manager.Value("i", 0.0)
-y_offset_2 = manager.Value("i", 0.0)
-z_offset_1 = manager.Value("i", 0.0)
-z_offset_2 = manager.Value("i", 0.0)
-x_acc_mean = manager.Value("i", 0.0)
-
-rotation_y = manager.Value("i", "none")  # "ramp_up""; "ramp_down"; "none"
-
-obstacle_direction = manager.Value("i", "n")
-min_line_size = manager.Value("i", 3000)
-
-line_angle = manager.Value("i", 0.)
-line_angle_y = manager.Value("i", -1)
-line_detected = manager.Value("i", False)
-line_crop = manager.Value("i", .6)
-line_similarity = manager.Value("i", 0.)
-gap_angle = manager.Value("i", 0.)
-gap_center_x = manager.Value("i", -180)
-gap_center_y = manager.Value("i", -1)
-silver_angle = manager.Value("i", -181)
-line_size = manager.Value("i", 0.)
-ramp_ahead = manager.Value("i", False)
-red_detected = manager.Value("i", False)
-turn_dir = manager.Value("i", "straight")  # "straight"; "left"; "right"; "turn_around"
-silver_value = manager.Value("i", -1.)
-black_average = manager.Value("i", 0.)
-
-ball_distance = manager.Value("i", 0)
-ball_type = manager.Value("i", "none")  # "none"; "black ball"; "silver ball"
-ball_width = manager.Value("i", -1)
-zone_similarity = manager.Value("i", 0.)
-zone_similarity_average = manager.Value("i", 0.)
-zone_found_black = manager.Value("i", False)
-zone_found_green = manager.Value("i", False)
-zone_found_red = manager.Value("i", False)
-exit_angle = manager.Value("i", -181.)
-corner_distance = manager.Value("i", -181)
-corner_size = manager.Value("i", 0)
-
-picked_up_alive_count = manager.Value("i", 0)
-picked_up_dead_count = manager.Value("i", 0)
-
-switch = manager.Value("i", False)
-program_start_time = manager.Value("i", -1)
-run_start_time = manager.Value("i", -1)
-zone_start_time = manager.Value("i", -1)
-
-capture_image = manager.Value("i", False)
-calibrate_color_status = manager.Value("i", "none")  # "none"; "calibrate"; "check"
-calibration_color = manager.Value("i", "z-g")  # "z-g"; "z-r"; "l-gz"; "l-rz"; "l-bz; "l-bn"; "l-bv"; "l-bvl"; "l-bd"; "l-gl"; "l-rl"
-iterations_control = manager.Value("i", -1)
-iterations_serial = manager.Value("i", -1)
-sensor1_disconnected = manager.Value("i", False)
-sensor2_disconnected = manager.Value("i", False)
-
-objective = manager.Value("i", "follow_line")  # "follow_line"; "zone"; "debug"
-line_status = manager.Value("i", "line_detected")  # "line_detected"; "gap_detected"; "gap_avoid"; "obstacle_detected"; "obstacle_avoid"; "obstacle_orientate"; "check_silver"; "position_entry"; "position_entry_1"; "position_entry_2"; "stop"
-zone_status = manager.Value("i", "begin")  # "begin"; "find_balls"; "pickup_ball"; "deposit_red"; "deposit_green"; "exit"
-
-status = manager.Value("i", "Stopped")
+state = SharedState()
+
+terminate = state.add("terminate", False)
+
+sensor_one = state.add("sensor_one", -2.0)  # Front Left
+sensor_two = state.add("sensor_two", -2.0)  # Front Right
+sensor_three = state.add("sensor_three", -2.0)  # Left
+sensor_four = state.add("sensor_four", -2.0)  # Right
+sensor_five = state.add("sensor_five", -2.0)  # Front Center
+sensor_six = state.add("sensor_six", -2.0)  # Back
+sensor_seven = state.add("sensor_seven", -2.0)  # Gripper
+
+sensor_x_1 = state.add("sensor_x_1", 361.0)
+sensor_x_2 = state.add("sensor_x_2", 361.0)
+sensor_y_1 = state.add("sensor_y_1", 361.0)
+sensor_y_2 = state.add("sensor_y_2", 361.0)
+sensor_z_1 = state.add("sensor_z_1", 361.0)
+sensor_z_2 = state.add("sensor_z_2", 361.0)
+sensor_ax_1 = state.add("sensor_ax_1", 361.0)
+sensor_ax_2 = state.add("sensor_ax_2", 361.0)
+sensor_ay_1 = state.add("sensor_ay_1", 361.0)
+sensor_ay_2 = state.add("sensor_ay_2", 361.0)
+
+sensor_x = state.add("sensor_x", 361.0)
+sensor_y = state.add("sensor_y", 361.0)
+sensor_z = state.add("sensor_z", 361.0)
+
+x_offset_1 = state.add("x_offset_1", 0.0)
+x_offset_2 = state.add("x_offset_2", 0.0)
+y_offset_1 = state.add("y_offset_1", 0.0)
+y_offset_2 = state.add("y_offset_2", 0.0)
+z_offset_1 = state.add("z_offset_1", 0.0)
+z_offset_2 = state.add("z_offset_2", 0.0)
+x_acc_mean = state.add("x_acc_mean", 0.0)
+
+rotation_y = state.add("rotation_y", "none", names=["none", "ramp_up", "ramp_down"])
+
+obstacle_direction = state.add("obstacle_direction", "n", names=["n", "l", "r"])
+min_line_size = state.add("min_line_size", 3000)
+
+line_angle = state.add("line_angle", 0.)
+line_angle_y = state.add("line_angle_y", -1.)
+line_detected = state.add("line_detected", False)
+line_crop = state.add("line_crop", .6)
+line_similarity = state.add("line_similarity", 0.)
+line_motion = state.add("line_motion", 0.)  # Image motion of the line camera in pixels per second
+line_motion_response = state.add("line_motion_response", 0.)  # Phase correlation peak of that motion estimate
+gap_angle = state.add("gap_angle", 0.)
+gap_center_x = state.add("gap_center_x", -180.)
+gap_center_y = state.add("gap_center_y", -1.)
+silver_angle = state.add("silver_angle", -181.)
+line_size = state.add("line_size", 0.)
+ramp_ahead = state.add("ramp_ahead", False)
+red_detected = state.add("red_detected", False)
+turn_dir = state.add("turn_dir", "straight", names=["straight", "left", "right", "turn_around"])
+silver_value = state.add("silver_value", -1.)
+silver_frame_id = state.add("silver_frame_id", -1)  # Line camera frame the last silver_value was inferred from
+silver_frame_time = state.add("silver_frame_time", -1.)  # Capture time of that frame (perf_counter)
+black_average = state.add("black_average", 0.)
+line_frame_id = state.add("line_frame_id", -1)  # Sequence number of the last published line camera frame
+line_frame_time = state.add("line_frame_time", -1.)  # Capture time of that frame (perf_counter)
+
+# Per frame result of the line camera, published and read as one consistent record
+line_frame_fields = ("line_frame_id", "line_frame_time", "line_angle", "line_angle_y", "line_detected", "line_crop", "line_size", "line_similarity", "line_motion", "line_motion_response", "gap_angle", "gap_center_x", "gap_center_y", "turn_dir", "ramp_ahead", "red_detected", "silver_value", "silver_frame_id", "silver_frame_time", "black_average")
+
+ball_distance = state.add("ball_distance", 0.)
+ball_type = state.add("ball_type", "none", names=["none", "black ball", "silver ball"], unknown="none")  # Other detector labels are stored as none
+ball_width = state.add("ball_width", -1)
+zone_similarity = state.add("zone_similarity", 0.)
+zone_similarity_average = state.add("zone_similarity_average", 0.)
+zone_found_black = state.add("zone_found_black", False)
+zone_found_green = state.add("zone_found_green", False)
+zone_found_red = state.add("zone_found_red", False)
+exit_angle = state.add("exit_angle", -181.)
+corner_distance = state.add("corner_distance", -181.)
+corner_size = state.add("corner_size", 0.)
+
+picked_up_alive_count = state.add("picked_up_alive_count", 0)
+picked_up_dead_count = state.add("picked_up_dead_count", 0)
+
+switch = state.add("switch", False)
+program_start_time = state.add("program_start_time", -1.)
+run_start_time = state.add("run_start_time", -1.)
+zone_start_time = state.add("zone_start_time", -1.)
+
+capture_image = state.add("capture_image", False)
+calibrate_color_status = state.add("calibrate_color_status", "none", names=["none", "calibrate", "check"])
+calibration_color = state.add("calibration_color", "z-g", names=["z-g", "z-r", "l-gz", "l-rz", "l-bz", "l-bn", "l-bv", "l-bvl", "l-bd", "l-gl", "l-rl"])
+iterations_control = state.add("iterations_control", -1)
+iterations_serial = state.add("iterations_serial", -1)
+sensor1_disconnected = state.add("sensor1_disconnected", False)
+sensor2_disconnected = state.add("sensor2_disconnected", False)
+
+objective = state.add("objective", "follow_line", names=["follow_line", "zone", "debug"])
+line_status = state.add("line_status", "line_detected", names=["line_detected", "gap_detected", "gap_avoid", "obstacle_detected", "obstacle_avoid", "obstacle_orientate", "check_silver", "position_entry", "position_entry_1", "position_entry_2", "stop"])
+zone_status = state.add("zone_status", "begin", names=["begin", "find_balls", "pickup_ball", "deposit_red", "deposit_green", "exit", "get_exit_angle", "check_silver"])
+
+status = state.add("status", "Stopped", kind=str)
+
+def get_line_frame():
+    return state.snapshot(*line_frame_fields)
 
 
 def average_rotation():
@@ -142,31 +153,26 @@ def average_rotation():
 
 
 def empty_time_arr(length: int = 240):
-    return np.zeros((length, 2))
+    return TimeSeries(length)
 
 
 def fill_array(value: int, length: int = 240, fill_time: int = 0):
-    arr = np.zeros((length, 2))
-    arr[fill_time:, 0] = time.perf_counter()
-    arr[:, 1] = value
-    return arr
+    time_series = TimeSeries(length)
+    time_series.fill(value, fill_time)
+    return time_series
 
 
-def add_time_value(time_value_array, value):
-    return np.delete(np.vstack((time_value_array, [time.perf_counter(), value])), 0, axis=0)
+def add_time_value(time_series, value):
+    time_series.append(value)
+    return time_series
 
 
-def get_time_average(time_value_array, time_range):
-    time_value_array = time_value_array[np.where(time_value_array[:, 0] > time.perf_counter() - time_range)]
-    if time_value_array.size > 0:
-        return np.mean(time_value_array[:, 1])
-    else:
-        return -1
+def get_time_average(time_series, time_range):
+    return time_series.average(time_range)
 
 
-def get_max_value(time_value_array, time_range):
-    time_value_array = time_value_array[np.where(time_value_array[:, 0] > time.perf_counter() - time_range)]
-    return np.max(time_value_array[:, 1])
+def get_max_value(time_series, time_range):
+    return time_series.max(time_range)
 
 
 def calculate_x_offset(current_angle, target_angle):
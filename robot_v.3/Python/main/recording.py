@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import queue
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+# Shared values recorded with every frame and restored on replay
+recorded_fields = ("objective", "line_status", "zone_status", "rotation_y", "obstacle_direction", "min_line_size",
+                   "sensor_x", "sensor_y", "sensor_z", "sensor_one", "sensor_two", "sensor_three", "sensor_four", "sensor_five", "sensor_six", "sensor_seven")
+
+
+class FrameRecorder:
+    # Writes frames with their id, capture time and the shared state into a zip file of chunks, one .npz per chunk_size frames.
+    # The chunks are written in a background thread, frames are dropped (and counted) if it falls behind.
+    def __init__(self, folder, name, chunk_size=100, every=1, queue_size=300):
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.zip")
+        self.chunk_size = chunk_size
+        self.every = every  # Only every nth frame is recorded
+
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__thread = None
+        self.__counter = 0
+        self.__failed = False
+
+        self.__stats = {"recorded": 0, "dropped": 0, "chunks": 0}
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__write_loop, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        # Writes the frames still waiting and the last, partial chunk, a writer that failed doesn't empty the queue anymore
+        if self.__thread is None:
+            return
+        while self.__thread.is_alive():
+            try:
+                self.__queue.put(None, timeout=.1)
+                break
+            except queue.Full:
+                continue
+        self.__thread.join()
+
+    @property
+    def stats(self):
+        return dict(self.__stats)
+
+    def record(self, frame, frame_id, capture_time, state_values):
+        # After a write error the frames are dropped, recording must never stop the perception loop
+        if self.__failed:
+            self.__stats["dropped"] += 1
+            return
+
+        self.__counter += 1
+        if (self.__counter - 1) % self.every:
+            return
+
+        try:
+            self.__queue.put_nowait((frame.copy(), frame_id, capture_time, state_values))
+        except queue.Full:
+            self.__stats["dropped"] += 1
+
+    def __write_chunk(self, recording, frames):
+        chunk = io.BytesIO()
+        np.savez(chunk,
+                 frames=np.stack([frame for frame, _, _, _ in frames]),
+                 frame_ids=np.array([frame_id for _, frame_id, _, _ in frames], dtype=np.int64),
+                 capture_times=np.array([capture_time for _, _, capture_time, _ in frames]),
+                 states=np.array([json.dumps(state_values) for _, _, _, state_values in frames]))
+
+        recording.writestr(f"chunk_{self.__stats['chunks']:06d}.npz", chunk.getvalue())
+        self.__stats["chunks"] += 1
+        self.__stats["recorded"] += len(frames)
+
+    def __write_loop(self):
+        try:
+            with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as recording:
+                frames = []
+                while True:
+                    frame = self.__queue.get()
+                    if frame is not None:
+                        frames.append(frame)
+                    if frames and (frame is None or len(frames) >= self.chunk_size):
+                        self.__write_chunk(recording, frames)
+                        frames = []
+                    if frame is None:
+                        return
+        except Exception as e:
+            self.__failed = True
+            print(f"Recording {self.path} stopped: {type(e).__name__}: {e}")
+
+
+class FrameReplay:
+    # Plays a recording back like FrameCapture: read() returns (raw, image, frame_id, capture_time), raw is always None.
+    # state holds the shared values recorded with the last frame. Without realtime the frames come as fast as they are read,
+    # with realtime read() waits until the recorded time of the frame has passed.
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+        self.state = {}
+
+        self.__frames = None
+        self.__start_time = None
+        self.__first_capture_time = None
+
+        self.__stats = {"replayed": 0}
+
+    def start(self):
+        self.__frames = self.frames()
+
+    def stop(self):
+        self.__frames = None
+
+    @property
+    def stats(self):
+        return dict(self.__stats)
+
+    def frames(self):
+        # Yields (image, frame_id, capture_time, state) of all frames in order
+        with zipfile.ZipFile(self.path) as recording:
+            for name in sorted(recording.namelist()):
+                with recording.open(name) as chunk_file:
+                    chunk = np.load(io.BytesIO(chunk_file.read()))
+                    frames = np.array(chunk["frames"])  # Writable copy, the loops draw into the frames
+                    for image, frame_id, capture_time, state_values in zip(frames, chunk["frame_ids"], chunk["capture_times"], chunk["states"]):
+                        yield image, int(frame_id), float(capture_time), json.loads(str(state_values))
+
+    def read(self, timeout=1.):
+        # Raises EOFError after the last frame
+        if self.__frames is None:
+            raise RuntimeError("Frame replay is not running")
+
+        try:
+            image, frame_id, capture_time, self.state = next(self.__frames)
+        except StopIteration:
+            raise EOFError(f"End of the recording {self.path}")
+
+        if self.realtime:
+            if self.__start_time is None:
+                self.__start_time = time.perf_counter()
+                self.__first_capture_time = capture_time
+            time.sleep(max(capture_time - self.__first_capture_time - (time.perf_counter() - self.__start_time), 0))
+
+        self.__stats["replayed"] += 1
+        return None, image, frame_id, capture_time
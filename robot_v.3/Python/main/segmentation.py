@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+from numba import njit
+
+# Bits of the color tables
+green_bit = 1
+red_bit = 2
+green_zone_bit = 4
+red_zone_bit = 8
+
+
+def color_table(*classes):
+    # Lookup table BGR -> class bits for all 256^3 colors, replaces cvtColor to HSV + inRange for every frame.
+    # Class i sets bit i and is a list of (hsv_min, hsv_max) ranges, e.g. [(red_min_1, red_max_1), (red_min_2, red_max_2)].
+    # Built with the same OpenCV conversion, so the masks match the cv2.inRange masks exactly.
+    table = np.empty((256, 256, 256), dtype=np.uint8)
+
+    colors = np.empty((256, 256, 3), dtype=np.uint8)
+    colors[:, :, 1] = np.arange(256)[:, None]
+    colors[:, :, 2] = np.arange(256)[None, :]
+
+    for b in range(256):
+        colors[:, :, 0] = b
+        hsv_colors = cv2.cvtColor(colors, cv2.COLOR_BGR2HSV)
+
+        table[b] = 0
+        for bit, ranges in enumerate(classes):
+            for lower, upper in ranges:
+                table[b] |= cv2.inRange(hsv_colors, np.asarray(lower), np.asarray(upper)) & (1 << bit)
+
+    return table.reshape(-1)
+
+
+class ColorTable:
+    # Keeps the lookup table of the last color values and only builds a new one if they changed
+    def __init__(self):
+        self.__classes = None
+        self.__table = None
+
+    def update(self, *classes):
+        classes_list = [[[np.asarray(lower).tolist(), np.asarray(upper).tolist()] for lower, upper in ranges] for ranges in classes]
+
+        if classes_list != self.__classes:
+            self.__table = color_table(*classes)
+            self.__classes = classes_list
+
+        return self.__table
+
+
+@njit(cache=True)
+def segment_image(image, table, band_y, black_max_top, black_max_bottom, green_bits, red_bits, remove_bits, black, green, red):
+    # One pass over the BGR image instead of cvtColor + inRange for every color and the mask subtraction.
+    # Rows above band_y use black_max_top, the rest black_max_bottom. Black pixels in the classes of remove_bits are removed.
+    for y in range(image.shape[0]):
+        black_max = black_max_top if y < band_y else black_max_bottom
+        max_b, max_g, max_r = black_max[0], black_max[1], black_max[2]
+
+        for x in range(image.shape[1]):
+            b = np.int64(image[y, x, 0])
+            g = np.int64(image[y, x, 1])
+            r = np.int64(image[y, x, 2])
+
+            value = table[(b << 16) | (g << 8) | r]
+
+            green[y, x] = 255 if value & green_bits else 0
+            red[y, x] = 255 if value & red_bits else 0
+            black[y, x] = 255 if b <= max_b and g <= max_g and r <= max_r and not value & remove_bits else 0
+
+
+@njit(cache=True)
+def color_mask(image, table, bits, mask):
+    # Mask of the pixels in any of the classes of bits
+    for y in range(image.shape[0]):
+        for x in range(image.shape[1]):
+            value = table[(np.int64(image[y, x, 0]) << 16) | (np.int64(image[y, x, 1]) << 8) | np.int64(image[y, x, 2])]
+            mask[y, x] = 255 if value & bits else 0
+
+
+def morphology(*steps):
+    # Compiles (operation, iterations) steps of a 3x3 rectangle into one (2n+1)x(2n+1) rectangle per step
+    operations = {"erode": cv2.erode, "dilate": cv2.dilate}
+    return [(operations[operation], cv2.getStructuringElement(cv2.MORPH_RECT, (2 * iterations + 1, 2 * iterations + 1))) for operation, iterations in steps]
+
+
+def apply_morphology(image, steps):
+    for operation, kernel in steps:
+        # Eroding or dilating an empty mask gives an empty mask again
+        if not cv2.countNonZero(image):
+            break
+        image = operation(image, kernel)
+    return image
+
+
+def morphology_reach(steps):
+    # How far the steps can spread pixels into an empty area
+    return sum(kernel.shape[0] // 2 for _, kernel in steps)
+
+
+def pad_window(window, padding, shape):
+    x0, y0, x1, y1 = window
+    return max(x0 - padding, 0), max(y0 - padding, 0), min(x1 + padding, shape[1]), min(y1 + padding, shape[0])
@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+
+
+def ssim(image_a, image_b, window=7):
+    # Same result as skimage.metrics.structural_similarity with its defaults for uint8 images
+    # (7x7 uniform window, sample covariance, data range 255), but with OpenCV box filters
+    a = image_a.astype(np.float32)
+    b = image_b.astype(np.float32)
+
+    c1 = (.01 * 255) ** 2
+    c2 = (.03 * 255) ** 2
+    covariance_norm = window * window / (window * window - 1)
+
+    def mean(image):
+        return cv2.boxFilter(image, -1, (window, window), borderType=cv2.BORDER_REFLECT)
+
+    mean_a = mean(a)
+    mean_b = mean(b)
+    variance_a = covariance_norm * (mean(a * a) - mean_a * mean_a)
+    variance_b = covariance_norm * (mean(b * b) - mean_b * mean_b)
+    covariance = covariance_norm * (mean(a * b) - mean_a * mean_b)
+
+    ssim_map = ((2 * mean_a * mean_b + c1) * (2 * covariance + c2)) / ((mean_a * mean_a + mean_b * mean_b + c1) * (variance_a + variance_b + c2))
+
+    pad = (window - 1) // 2
+    return float(np.mean(ssim_map[pad:-pad, pad:-pad], dtype=np.float64))
+
+
+def histogram_similarity(image_a, image_b):
+    # Correlation of the grey value histograms, only usable for grey images
+    histogram_a = cv2.calcHist([image_a], [0], None, [32], [0, 256])
+    histogram_b = cv2.calcHist([image_b], [0], None, [32], [0, 256])
+    return cv2.compareHist(histogram_a, histogram_b, cv2.HISTCMP_CORREL)
+
+
+# Metrics for the stuck detection, selected in the config. The thresholds in the config have to match the metric.
+metrics = {"ssim": ssim, "histogram": histogram_similarity}
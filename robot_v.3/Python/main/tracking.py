@@ -0,0 +1,141 @@
+import itertools
+from collections import deque
+
+import numpy as np
+
+
+def box_iou(boxes_a, boxes_b):
+    # IoU of every box in boxes_a [n, 4] with every box in boxes_b [m, 4], boxes as x1, y1, x2, y2
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-6)
+
+
+class BallTrack:
+    # Constant velocity Kalman filter on the box center and size, state [cx, cy, w, h, vx, vy, vw, vh]
+    def __init__(self, track_id, box, confidence, class_id, frame_time, history=10):
+        self.id = track_id
+        self.hits = 1
+        self.misses = 0
+        self.time = frame_time
+        self.update_time = frame_time
+
+        x1, y1, x2, y2 = box
+        self.__state = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1, 0, 0, 0, 0], dtype=np.float64)
+        self.__covariance = np.diag([10., 10., 10., 10., 1000., 1000., 1000., 1000.])
+
+        self.__confidences = deque(maxlen=history)
+        self.__classes = deque(maxlen=history)
+        self.__confidences.append(confidence)
+        self.__classes.append(class_id)
+
+    @property
+    def box(self):
+        cx, cy, w, h = self.__state[:4]
+        w, h = max(w, 1.), max(h, 1.)
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    @property
+    def velocity(self):
+        # Pixels per second of the box center
+        return self.__state[4:6].copy()
+
+    @property
+    def confidence(self):
+        return float(np.mean(self.__confidences))
+
+    @property
+    def class_id(self):
+        # Class with the highest summed confidence over the history, so a single wrong detection doesn't flip the type
+        classes = np.array(self.__classes)
+        scores = np.bincount(classes, weights=np.array(self.__confidences))
+        return int(np.argmax(scores))
+
+    def predict(self, frame_time, process_noise=50.):
+        dt = max(frame_time - self.time, 0.)
+        self.time = frame_time
+
+        transition = np.eye(8)
+        transition[:4, 4:] = np.eye(4) * dt
+
+        self.__state = transition @ self.__state
+        self.__covariance = transition @ self.__covariance @ transition.T + np.eye(8) * process_noise * dt
+
+    def update(self, box, confidence, class_id, measurement_noise=10.):
+        x1, y1, x2, y2 = box
+        measurement = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+
+        innovation_covariance = self.__covariance[:4, :4] + np.eye(4) * measurement_noise
+        gain = self.__covariance[:, :4] @ np.linalg.inv(innovation_covariance)
+
+        self.__state = self.__state + gain @ (measurement - self.__state[:4])
+        self.__covariance = self.__covariance - gain @ self.__covariance[:4, :]
+
+        self.hits += 1
+        self.misses = 0
+        self.update_time = self.time
+        self.__confidences.append(confidence)
+        self.__classes.append(class_id)
+
+
+class BallTracker:
+    # SORT style tracker: the tracks are predicted to the frame time, matched with the detections by IoU and updated.
+    # Between detector runs the tracks are only predicted, so the balls keep moving with their last velocity.
+    def __init__(self, min_iou=.2, max_misses=2, min_hits=1, max_age=.5):
+        self.min_iou = min_iou
+        self.max_misses = max_misses  # Detector runs a track can go unmatched before it is removed
+        self.max_age = max_age  # Seconds without a matched detection before a track is removed
+        self.min_hits = min_hits  # Matched detections before a track is reported
+        self.__tracks = []
+        self.__ids = itertools.count()
+
+    def predict(self, frame_time):
+        self.__tracks = [track for track in self.__tracks if frame_time - track.update_time <= self.max_age]
+        for track in self.__tracks:
+            track.predict(frame_time)
+
+    def update(self, boxes, confidences, class_ids, frame_time):
+        self.predict(frame_time)
+
+        unmatched_tracks = list(range(len(self.__tracks)))
+        unmatched_detections = list(range(len(boxes)))
+
+        # Greedy matching, highest IoU first
+        if len(self.__tracks) > 0 and len(boxes) > 0:
+            iou = box_iou(np.array([track.box for track in self.__tracks]), np.asarray(boxes, dtype=np.float64))
+            for index in np.argsort(iou, axis=None)[::-1]:
+                track_index, detection_index = np.unravel_index(index, iou.shape)
+                if iou[track_index, detection_index] < self.min_iou:
+                    break
+                if track_index in unmatched_tracks and detection_index in unmatched_detections:
+                    self.__tracks[track_index].update(boxes[detection_index], confidences[detection_index], class_ids[detection_index])
+                    unmatched_tracks.remove(track_index)
+                    unmatched_detections.remove(detection_index)
+
+        for track_index in unmatched_tracks:
+            self.__tracks[track_index].misses += 1
+
+        for detection_index in unmatched_detections:
+            self.__tracks.append(BallTrack(next(self.__ids), boxes[detection_index], confidences[detection_index], class_ids[detection_index], frame_time))
+
+        self.__tracks = [track for track in self.__tracks if track.misses <= self.max_misses]
+
+    def clear(self):
+        self.__tracks = []
+
+    def tracks(self, followed_id=None):
+        # Returns (ids [n], boxes [n, 4] as int x1, y1, x2, y2, confidences [n], class ids [n]) of the reported tracks.
+        # The followed track is reported while it is alive, also if the last detector runs missed it, so a single
+        # missed detection doesn't switch to another ball.
+        tracks = [track for track in self.__tracks if track.hits >= self.min_hits and (track.misses == 0 or track.id == followed_id)]
+        if len(tracks) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 4), dtype=np.int32), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+        return (np.array([track.id for track in tracks]),
+                np.array([track.box for track in tracks]).astype(np.int32),
+                np.array([track.confidence for track in tracks]),
+                np.array([track.class_id for track in tracks]))
@@ -2,13 +2,15 @@ import os
 from multiprocessing import shared_memory
 
 import cv2
-from picamera2 import Picamera2
-from skimage.metrics import structural_similarity
-from ultralytics import YOLO
-from ultralytics.utils.plotting import colors
 
-from Managers import Timer
+from Managers import StageTimer, Timer
+from camera import open_frame_source
+from inference import Detector
+from tracking import BallTracker
 from mp_manager import *
+from recording import FrameRecorder, FrameReplay, recorded_fields
+from segmentation import ColorTable, apply_morphology, color_mask, green_bit, morphology, red_bit
+from similarity import metrics
 
 camera_width = 640
 camera_height = 480
@@ -27,8 +29,14 @@ red_max_1 = np.array([10, 255, 255])
 red_min_2 = np.array([170, 100, 70])
 red_max_2 = np.array([180, 255, 255])
 
-# Kernal for noise reduction
-kernal = np.ones((3, 3), np.uint8)
+# BGR colors of the detected classes, same as the ultralytics palette
+box_colors = [(255, 42, 4), (235, 219, 11), (243, 243, 243), (183, 223, 0)]
+
+zone_color_tables = ColorTable()
+zone_color_table = None
+
+# Noise reduction, iterations of a 3x3 kernel
+noise_reduction = morphology(("erode", 5), ("dilate", 8))
 
 timer = Timer()
 
@@ -41,7 +49,7 @@ def save_image(image):
 
 
 def update_color_values():
-    global green_min, green_max, red_min_1, red_max_1, red_min_2, red_max_2
+    global green_min, green_max, red_min_1, red_max_1, red_min_2, red_max_2, zone_color_table
 
     green_min = np.array(config_manager.read_variable('color_values_zone', 'green_min'))
     green_max = np.array(config_manager.read_variable('color_values_zone', 'green_max'))
@@ -51,6 +59,8 @@ def update_color_values():
     red_min_2 = np.array(config_manager.read_variable('color_values_zone', 'red_min_2'))
     red_max_2 = np.array(config_manager.read_variable('color_values_zone', 'red_max_2'))
 
+    zone_color_table = zone_color_tables.update([(green_min, green_max)], [(red_min_1, red_max_1), (red_min_2, red_max_2)])
+
 
 def check_contours(contours, image, color, size=5000):
     if len(contours) > 0:
@@ -67,28 +77,108 @@ def check_contours(contours, image, color, size=5000):
     return -181, 0
 
 
-def get_green_contours(image):
-    hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    green_image = cv2.inRange(hsv_image, green_min, green_max)
+def select_ball(ids, boxes, followed_id):
+    # Index of the ball to follow, the same ball as before while it is tracked or else the largest, and the
+    # horizontal offsets and widths of all boxes
+    widths = boxes[:, 2] - boxes[:, 0]
+    areas = widths * (boxes[:, 3] - boxes[:, 1])
+    distances = boxes[:, 0] + widths // 2 - horizontal_center
 
-    green_image = cv2.erode(green_image, kernal, iterations=5)
-    green_image = cv2.dilate(green_image, kernal, iterations=8)
+    followed = np.flatnonzero(ids == followed_id)
+    if len(followed) > 0:
+        return followed[0], distances, widths
+    return np.argmax(areas), distances, widths
 
-    contours_green, _ = cv2.findContours(green_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
 
-    return contours_green
+def draw_detections(image, ids, boxes, confidences, class_ids, label):
+    for track_id, (x1, y1, x2, y2), confidence, class_id in zip(ids, boxes, confidences, class_ids):
+        color = box_colors[class_id % len(box_colors)]
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(image, f"{track_id} {label(class_id)}: {confidence:.2f}", (x1, y1 - 5), cv2.FONT_HERSHEY_DUPLEX, 0.5, color, 1, cv2.LINE_AA)
 
 
-def get_red_contours(image):
-    hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    red_image = cv2.inRange(hsv_image, red_min_1, red_max_1) + cv2.inRange(hsv_image, red_min_2, red_max_2)
-
-    red_image = cv2.erode(red_image, kernal, iterations=5)
-    red_image = cv2.dilate(red_image, kernal, iterations=8)
+########################################################################################################################
+# Zone Processing
+########################################################################################################################
 
-    contours_red, _ = cv2.findContours(red_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
 
-    return contours_red
+class ZoneProcessor:
+    # Zone part of the zone camera loop, one frame per process() call with the state carried between frames.
+    # The stages run inside stage_timer, so the benchmark times the same code the loop runs.
+    def __init__(self, model, stage_timer=None):
+        self.__model = model
+        self.stage_timer = stage_timer or StageTimer()
+        self.show_detections = config_manager.read_variable('camera_zone', 'draw_detections') is not False
+
+        # The detector only runs every detect_every frames, the tracker moves the balls in between
+        self.__tracker = BallTracker()
+        self.detect_every = config_manager.read_variable('camera_zone', 'detect_every') or 1
+        self.__detect_counter = 0
+        self.__followed_id = None
+
+        self.__image_similarity = metrics[config_manager.read_variable('similarity', 'zone_metric') or "ssim"]
+        self.similarity_every = 10  # Frames from one similarity check to the next
+        self.__similarity_counter = 0
+        self.__last_image = np.zeros((264, camera_width), dtype=np.uint8)
+
+    def __corner_contours(self, image, bits):
+        with self.stage_timer("segmentation"):
+            corner_image = np.empty(image.shape[:2], dtype=np.uint8)
+            color_mask(image, zone_color_table, bits, corner_image)
+
+        with self.stage_timer("morphology"):
+            corner_image = apply_morphology(corner_image, noise_reduction)
+
+        with self.stage_timer("find_contours"):
+            contours, _ = cv2.findContours(corner_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+        return contours
+
+    def process(self, image, frame_time):
+        # Publishes the zone results of the frame and draws the detections into the image
+        if self.__similarity_counter >= self.similarity_every:
+            with self.stage_timer("similarity"):
+                grey_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                zone_similarity.value = self.__image_similarity(grey_image, self.__last_image)
+            self.__last_image = grey_image.copy()
+            self.__similarity_counter = 0
+        self.__similarity_counter += 1
+
+        if zone_status.value == "begin" or zone_status.value == "find_balls" or zone_status.value == "pickup_ball":
+            if self.__detect_counter % self.detect_every == 0:
+                with self.stage_timer("inference"):
+                    result_boxes, result_confidences, result_classes = self.__model(image)
+                with self.stage_timer("tracking"):
+                    self.__tracker.update(result_boxes, result_confidences, result_classes, frame_time)
+            else:
+                with self.stage_timer("tracking"):
+                    self.__tracker.predict(frame_time)
+            self.__detect_counter += 1
+
+            track_ids, track_boxes, track_confidences, track_classes = self.__tracker.tracks(self.__followed_id)
+
+            if len(track_ids) > 0:
+                best, distances, widths = select_ball(track_ids, track_boxes, self.__followed_id)
+
+                self.__followed_id = track_ids[best]
+                state.publish(ball_distance=int(distances[best]), ball_type=self.__model.label(track_classes[best]).lower(), ball_width=int(widths[best]))
+            else:
+                self.__followed_id = None
+                state.publish(ball_distance=0, ball_type="none", ball_width=-1)
+
+            # Only drawn after the result is published
+            if self.show_detections:
+                draw_detections(image, track_ids, track_boxes, track_confidences, track_classes, self.__model.label)
+
+        elif zone_status.value == "deposit_green":
+            contours_green = self.__corner_contours(image, green_bit)
+            with self.stage_timer("corner_check"):
+                corner_distance.value, corner_size.value = check_contours(contours_green, image, (0, 0, 255))
+
+        elif zone_status.value == "deposit_red":
+            contours_red = self.__corner_contours(image, red_bit)
+            with self.stage_timer("corner_check"):
+                corner_distance.value, corner_size.value = check_contours(contours_red, image, (0, 255, 0))
 
 
 ########################################################################################################################
@@ -97,13 +187,21 @@ def get_red_contours(image):
 
 
 def zone_cam_loop():
-    model = YOLO('../../Ai/models/ball_zone_s/ball_detect_s_edgetpu.tflite', task='detect')
+    model = Detector('../../Ai/models/ball_zone_s/ball_detect_s_edgetpu.tflite', conf=0.3, iou=0.2)
+    zone_processor = ZoneProcessor(model)
 
     crop_percentage = 0.45
     crop_height = int(camera_height * crop_percentage)
 
-    camera = Picamera2(1)
-    camera.start()
+    # Frames from the camera, a recording or a synthetic source as set in [camera_zone], only the part below crop_height is used
+    capture = open_frame_source(config_manager, "zone", (camera_width, camera_height), crop_top=crop_height, configuration="preview")
+    replaying = isinstance(capture, FrameReplay)
+
+    recorder = None
+    record_path = config_manager.read_variable('recording', 'zone_path')
+    if record_path and not replaying:
+        recorder = FrameRecorder(record_path, "zone", chunk_size=config_manager.read_variable('recording', 'chunk_size') or 100, every=config_manager.read_variable('recording', 'every') or 1)
+        recorder.start()
 
     shm_cam2 = shared_memory.SharedMemory(name="shm_cam_2", create=True, size=506880)
 
@@ -119,16 +217,20 @@ def zone_cam_loop():
     max_frames_line = 1
     fps_limit_time = time.perf_counter()
 
-    last_best_box = None
-    last_image = np.zeros((264, camera_width), dtype=np.uint8)
-    check_similarity_counter = 0
-    check_similarity_limit = 10
-
     update_color_values()
     while not terminate.value:
-        raw_capture = camera.capture_array()
-        raw_capture = raw_capture[crop_height:, :]
-        cv2_img = cv2.cvtColor(raw_capture, cv2.COLOR_RGBA2BGR)
+        try:
+            _, cv2_img, frame_id, capture_time = capture.read()
+        except EOFError:  # End of the replay
+            break
+        except TimeoutError:  # Camera stalled, e.g. while libcamera restarts, wait for the next frame
+            continue
+
+        # Record the frame before anything is drawn into it, or restore the recorded state of a replayed frame
+        if recorder is not None:
+            recorder.record(cv2_img, frame_id, capture_time, state.snapshot(*recorded_fields))
+        if replaying:
+            state.publish(**capture.state)
 
         if capture_image.value:
             save_image(cv2_img)
@@ -136,62 +238,13 @@ def zone_cam_loop():
 
         frame_limit = max_frames_zone if objective.value == "zone" or not calibrate_color_status.value == "none" else max_frames_line
 
-        if time.perf_counter() - fps_limit_time > 1 / frame_limit:
+        # A replay processes every frame, so the results don't depend on how fast the host runs
+        if replaying or time.perf_counter() - fps_limit_time > 1 / frame_limit:
             fps_limit_time = time.perf_counter()
 
             if calibrate_color_status.value == "none":
                 if objective.value == "zone":
-                    if check_similarity_counter >= check_similarity_limit:
-                        grey_image = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2GRAY)
-                        zone_similarity.value = structural_similarity(grey_image, last_image)
-                        last_image = grey_image.copy()
-                        check_similarity_counter = 0
-                    check_similarity_counter += 1
-
-                    if zone_status.value == "begin" or zone_status.value == "find_balls" or zone_status.value == "pickup_ball":
-                        results = model.predict(cv2_img, imgsz=(512, 224), conf=0.3, iou=0.2, agnostic_nms=True, workers=4, verbose=False)  # verbose=True to enable debug info
-
-                        result = results[0].numpy()
-
-                        boxes = []
-                        for box in result.boxes:
-                            x1, y1, x2, y2 = box.xyxy[0].astype(int)
-                            class_id = box.cls[0].astype(int)
-                            name = result.names[class_id]
-                            confidence = box.conf[0].astype(float)
-
-                            width = x2 - x1
-                            height = y2 - y1
-                            area = width * height
-                            distance = (x1 + width // 2) - horizontal_center
-                            boxes.append([area, distance, name, width])
-
-                            color = colors(class_id, True)
-                            cv2.rectangle(cv2_img, (x1, y1), (x2, y2), color, 2)
-                            cv2.putText(cv2_img, f"{name}: {confidence:.2f}", (x1, y1 - 5), cv2.FONT_HERSHEY_DUPLEX, 0.5, color, 1, cv2.LINE_AA)
-
-                        if len(boxes) > 0:
-                            best_box = max(boxes, key=lambda x: x[0])
-                            if last_best_box is not None:
-                                best_box = min(boxes, key=lambda x: abs(x[1] - last_best_box[1]))
-
-                            last_best_box = best_box
-                            ball_distance.value = best_box[1]
-                            ball_type.value = str.lower(str(best_box[2]))
-                            ball_width.value = best_box[3]
-                        else:
-                            last_best_box = None
-                            ball_distance.value = 0
-                            ball_type.value = "none"
-                            ball_width.value = -1
-
-                    elif zone_status.value == "deposit_green":
-                        contours_green = get_green_contours(cv2_img)
-                        corner_distance.value, corner_size.value = check_contours(contours_green, cv2_img, (0, 0, 255))
-
-                    elif zone_status.value == "deposit_red":
-                        contours_red = get_red_contours(cv2_img)
-                        corner_distance.value, corner_size.value = check_contours(contours_red, cv2_img, (0, 255, 0))
+                    zone_processor.process(cv2_img, capture_time)
 
 
             elif calibrate_color_status.value == "calibrate" and (calibration_color.value == "z-r" or calibration_color.value == "z-g"):
@@ -250,5 +303,9 @@ def zone_cam_loop():
             buf = np.ndarray(cv2_img.shape, dtype=cv2_img.dtype, buffer=shm_cam2.buf)
             buf[:] = cv2_img[:]
 
+    capture.stop()
+    if recorder is not None:
+        recorder.stop()
+
     shm_cam2.close()
     shm_cam2.unlink()
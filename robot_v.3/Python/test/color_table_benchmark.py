@@ -0,0 +1,87 @@
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, '../main')
+from segmentation import ColorTable, green_bit, red_bit, segment_image
+
+
+def benchmark(function, runs):
+    function()
+    start_time = time.perf_counter()
+    for _ in range(runs):
+        function()
+    return (time.perf_counter() - start_time) / runs * 1000
+
+
+def main():
+    camera_x = 448
+    camera_y = 252
+    runs = 500
+
+    black_min = np.array([0, 0, 0])
+    black_max_normal_top = np.array([90, 90, 90])
+    black_max_normal_bottom = np.array([135, 135, 135])
+
+    green_min = np.array([40, 50, 45])
+    green_max = np.array([85, 255, 255])
+
+    red_min_1 = np.array([0, 100, 90])
+    red_max_1 = np.array([10, 255, 255])
+    red_min_2 = np.array([170, 100, 100])
+    red_max_2 = np.array([180, 255, 255])
+
+    # Image to test with as argument, otherwise a line with a green marker and a red stop line
+    if len(sys.argv) > 1:
+        img = cv2.resize(cv2.imread(sys.argv[1]), (camera_x, camera_y))
+    else:
+        img = np.full((camera_y, camera_x, 3), 200, dtype=np.uint8)
+        img[:, 200:250] = 30
+        img[100:150, 260:310] = (40, 140, 30)
+        img[230:, :] = (30, 30, 180)
+        img = np.clip(img.astype(np.int16) + np.random.randint(-15, 15, img.shape), 0, 255).astype(np.uint8)
+
+    def in_range_chain():
+        hsv_image = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        green_image = cv2.inRange(hsv_image, green_min, green_max)
+        red_image = cv2.inRange(hsv_image, red_min_1, red_max_1) + cv2.inRange(hsv_image, red_min_2, red_max_2)
+
+        black_image = cv2.inRange(img, black_min, black_max_normal_bottom)
+        black_image[0:int(camera_y * .4), 0:camera_x] = cv2.inRange(img, black_min, black_max_normal_top)[0:int(camera_y * .4), 0:camera_x]
+
+        black_image -= green_image
+        black_image[black_image < 2] = 0
+
+        return black_image, green_image, red_image
+
+    color_tables = ColorTable()
+
+    start_time = time.perf_counter()
+    table = color_tables.update([(green_min, green_max)], [(red_min_1, red_max_1), (red_min_2, red_max_2)])
+    print(f"Table build: {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+    start_time = time.perf_counter()
+    color_tables.update([(green_min, green_max)], [(red_min_1, red_max_1), (red_min_2, red_max_2)])
+    print(f"Table update without changes: {(time.perf_counter() - start_time) * 1000:.3f} ms")
+
+    black_image = np.empty((camera_y, camera_x), dtype=np.uint8)
+    green_image = np.empty((camera_y, camera_x), dtype=np.uint8)
+    red_image = np.empty((camera_y, camera_x), dtype=np.uint8)
+
+    def table_lookup():
+        segment_image(img, table, int(camera_y * .4), black_max_normal_top, black_max_normal_bottom, green_bit, red_bit, green_bit, black_image, green_image, red_image)
+
+    chain_time = benchmark(in_range_chain, runs)
+    table_time = benchmark(table_lookup, runs)
+
+    print(f"cvtColor + inRange: {chain_time:.3f} ms")
+    print(f"Color table:        {table_time:.3f} ms ({chain_time / table_time:.1f}x)")
+
+    for name, expected, result in zip(["black", "green", "red"], in_range_chain(), [black_image, green_image, red_image]):
+        print(f"{name} mismatches: {np.count_nonzero((expected > 0) != (result > 0))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import sys
+
+import numpy as np
+
+sys.path.insert(0, '../main')
+import inference
+
+
+class FakeModel:
+    # Returns fixed detections (x center, y center, width, height in the 640 x 640 input, one score per class)
+    def __init__(self, detections, names=None):
+        self.names = {0: "alive", 1: "dead"} if names is None else names
+        self.input_shape = (1, 3, 640, 640)
+        self.channels_last = False
+        self.__output = np.array(detections, dtype=np.float32).T[np.newaxis]
+
+    def run(self, tensor):
+        return self.__output
+
+
+def load_detector(detections, names=None):
+    inference.load_model = lambda path: FakeModel(detections, names)
+    return inference.Detector("fake.onnx", conf=.3, iou=.2)
+
+
+def detect(detections, image_shape):
+    return load_detector(detections)(np.zeros(image_shape, dtype=np.uint8))
+
+
+def main():
+    failures = 0
+
+    # A 640 x 264 zone frame is letterboxed into the middle of the input, 188 rows of padding above it
+    cases = [
+        ("inside", [[320, 320, 40, 40, .9, .1]], [[300, 112, 340, 152]]),
+        ("left and top edge", [[10, 200, 60, 40, .9, .1]], [[0, 0, 40, 32]]),
+        ("right and bottom edge", [[630, 450, 40, 40, .1, .9]], [[610, 242, 640, 264]]),
+    ]
+    for name, detections, expected in cases:
+        boxes, confidences, class_ids = detect(detections, (264, 640, 3))
+        if not np.array_equal(boxes, np.array(expected, dtype=np.int32)):
+            print(f"{name}: expected {expected}, got {boxes.tolist()}")
+            failures += 1
+
+    # Models without names in their metadata are labeled with the class id
+    label_cases = [({0: "alive", 1: "dead"}, "dead"), ({0: "alive"}, "1"), ({}, "1"), (["alive"], "1"), (["alive", "dead"], "dead")]
+    for names, expected in label_cases:
+        detector = load_detector([[320, 320, 40, 40, .1, .9]], names)
+        _, _, class_ids = detector(np.zeros((264, 640, 3), dtype=np.uint8))
+        label = detector.label(class_ids[0])
+        if label != expected:
+            print(f"names {names}: expected {expected}, got {label}")
+            failures += 1
+
+    print(f"{len(cases) + len(label_cases)} cases, {failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from numba import njit
+
+sys.path.insert(0, '../main')
+from line_cam import calculate_angle_numba, camera_x, camera_y
+from line_geometry import component_area, component_runs, line_components
+
+
+@njit(cache=True)
+def calculate_angle_baseline(blackline, blackline_crop, last_bottom_point, average_line_point):
+    # calculate_angle_numba before the run-length components, on the CHAIN_APPROX_NONE contour of the line
+    max_gap = 1
+    max_line_width = camera_x * .19
+
+    poi_no_crop = np.zeros((4, 2), dtype=np.int32)  # [t, l, r, b]
+
+    # Top without crop
+    blackline_y_min = np.amin(blackline[:, :, 1])
+    blackline_top = blackline[np.where(blackline[:, 0, 1] == blackline_y_min)][:, :, 0]
+
+    blackline_top = blackline_top[blackline_top[:, 0].argsort()]
+    blackline_top_gap_fill = (blackline_top + max_gap + 1)[:-1]
+
+    blackline_gap_mask = blackline_top_gap_fill < blackline_top[1:]
+
+    top_mean = (int(np.mean(blackline_top)), blackline_y_min)
+
+    if np.sum(blackline_gap_mask) == 1:
+        gap_index = np.where(blackline_gap_mask)[0][0]
+
+        if blackline_top[:gap_index].size > 0 and blackline_top[gap_index:].size > 0:
+            top_mean_l = int(np.mean(blackline_top[:gap_index]))
+            top_mean_r = int(np.mean(blackline_top[gap_index:]))
+
+            top_mean = (top_mean_l, blackline_y_min) if np.abs(top_mean_l - average_line_point) < np.abs(top_mean_r - average_line_point) else (top_mean_r, blackline_y_min)
+
+    poi_no_crop[0] = [top_mean[0], top_mean[1]]
+
+    # Bottom without crop
+    blackline_y_max = np.amax(blackline[:, :, 1])
+    blackline_bottom = blackline[np.where(blackline[:, 0, 1] == blackline_y_max)][:, :, 0]
+    blackline_bottom = blackline_bottom[blackline_bottom[:, 0].argsort()]
+    blackline_bottom_gap_fill = (blackline_bottom + max_gap + 1)[:-1]
+
+    blackline_gap_mask = blackline_bottom_gap_fill < blackline_bottom[1:]
+
+    bottom_point_mean = (int(np.mean(blackline_bottom)), blackline_y_max)
+
+    if np.sum(blackline_gap_mask) == 1:
+        gap_index = np.where(blackline_gap_mask)[0][0]
+
+        if blackline_bottom[:gap_index].size > 0 and blackline_bottom[gap_index:].size > 0:
+            bottom_mean_l = int(np.mean(blackline_bottom[:gap_index]))
+            bottom_mean_r = int(np.mean(blackline_bottom[gap_index:]))
+
+            if np.abs(bottom_mean_l - bottom_mean_r) > 80:
+                if np.abs(bottom_mean_l - last_bottom_point) < np.abs(bottom_mean_r - last_bottom_point):
+                    bottom_point_mean = (bottom_mean_l, blackline_y_max)
+                    bottom_mean = (bottom_mean_r, blackline_y_max)
+                else:
+                    bottom_point_mean = (bottom_mean_r, blackline_y_max)
+                    bottom_mean = (bottom_mean_l, blackline_y_max)
+
+                poi_no_crop[3] = [bottom_mean[0], bottom_mean[1]]
+
+    bottom_point = [bottom_point_mean[0], bottom_point_mean[1]]
+
+    # Left without crop
+    blackline_x_min = np.amin(blackline[:, :, 0])
+    blackline_left = blackline[np.where(blackline[:, 0, 0] == blackline_x_min)]
+    left_mean = (blackline_x_min, int(np.mean(blackline_left[:, :, 1])))
+    poi_no_crop[1] = [left_mean[0], left_mean[1]]
+
+    # Right without crop
+    blackline_x_max = np.amax(blackline[:, :, 0])
+    blackline_right = blackline[np.where(blackline[:, 0, 0] == blackline_x_max)]
+    right_mean = (blackline_x_max, int(np.mean(blackline_right[:, :, 1])))
+    poi_no_crop[2] = [right_mean[0], right_mean[1]]
+
+    poi = np.zeros((3, 2), dtype=np.int32)  # [t, l, r]
+    is_crop = blackline_crop.size > 0
+
+    max_black_top = False
+
+    if is_crop:
+        # Top
+        blackline_y_min = np.amin(blackline_crop[:, :, 1])
+        blackline_top = blackline_crop[np.where(blackline_crop[:, 0, 1] == blackline_y_min)][:, :, 0]
+        top_mean = (int(np.mean(blackline_top)), blackline_y_min)
+        poi[0] = [top_mean[0], top_mean[1]]
+
+        blackline_top = blackline_top[blackline_top[:, 0].argsort()]
+        max_black_top = bool(np.abs(blackline_top[0] - blackline_top[-1]) > max_line_width)
+
+        # Left
+        blackline_x_min = np.amin(blackline_crop[:, :, 0])
+        blackline_left = blackline_crop[np.where(blackline_crop[:, 0, 0] == blackline_x_min)]
+        left_mean = (blackline_x_min, int(np.mean(blackline_left[:, :, 1])))
+        poi[1] = [left_mean[0], left_mean[1]]
+
+        # Right
+        blackline_x_max = np.amax(blackline_crop[:, :, 0])
+        blackline_right = blackline_crop[np.where(blackline_crop[:, 0, 0] == blackline_x_max)]
+        right_mean = (blackline_x_max, int(np.mean(blackline_right[:, :, 1])))
+        poi[2] = [right_mean[0], right_mean[1]]
+
+    return poi, poi_no_crop, is_crop, max_black_top, bottom_point
+
+
+def line_contour(line_runs):
+    # Contour of the line like the baseline traced it from the black mask
+    mask = np.zeros((camera_y, camera_x), dtype=np.uint8)
+    for y, start, end in zip(*line_runs):
+        mask[y, start:end] = 255
+    contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+    return max(contours, key=cv2.contourArea)
+
+
+def baseline_points(line_runs, crop_y, last_bottom_point, average_line_point):
+    blackline = line_contour(line_runs)
+    blackline_crop = blackline[np.where(blackline[:, 0, 1] > crop_y)]
+    return calculate_angle_baseline(blackline, blackline_crop, last_bottom_point, average_line_point)
+
+
+def synthetic_masks(count=500):
+    # One or two thick lines, like crossings and T junctions of the course
+    rng = np.random.default_rng(0)
+    masks = []
+    for i in range(count):
+        mask = np.zeros((camera_y, camera_x), dtype=np.uint8)
+        cv2.line(mask, (int(rng.integers(50, camera_x - 50)), camera_y - 1), (int(rng.integers(0, camera_x)), int(rng.integers(0, camera_y // 2))), 255, int(rng.integers(10, 45)))
+        if i % 2:
+            cv2.line(mask, (int(rng.integers(0, camera_x)), int(rng.integers(0, camera_y))), (int(rng.integers(0, camera_x)), int(rng.integers(0, camera_y))), 255, int(rng.integers(10, 45)))
+        masks.append(mask)
+    return masks
+
+
+def recorded_masks(folder):
+    # Black masks saved from line_cam
+    return [cv2.imread(os.path.join(folder, file), cv2.IMREAD_GRAYSCALE) for file in sorted(os.listdir(folder)) if file.endswith(".png")]
+
+
+def single_gap(line_runs, y):
+    # The baseline dropped the pixel before the gap from the left side when it split a row with one gap
+    run_y, run_start, run_end = line_runs
+    row = run_y == y
+    return np.sum(run_start[row][1:] - run_end[row][:-1] > 1) == 1
+
+
+def main():
+    masks = recorded_masks(sys.argv[1]) if len(sys.argv) > 1 else synthetic_masks()
+    crop_y = camera_y * .6
+    fields = ("poi", "poi_no_crop", "is_crop", "max_black_top", "bottom_point")
+
+    # Compile both before timing
+    components, runs = line_components(masks[0], (0, 0, camera_x, camera_y), 0)
+    line_runs = component_runs(runs, components[0])
+    baseline_points(line_runs, crop_y, 0., 0.)
+    calculate_angle_numba(*line_runs, crop_y, 0., 0.)
+
+    mismatches = dict.fromkeys(fields, 0)
+    max_deviation = 0
+    split_cases = 0
+    other_cases = []
+    tested = 0
+    times = np.zeros(2)
+    for i, mask in enumerate(masks):
+        components, runs = line_components(mask, (0, 0, camera_x, camera_y), 3000)
+        if len(components) == 0:
+            continue
+        line_runs = component_runs(runs, components[np.argmax(components[:, component_area])])
+
+        for last_bottom_point, average_line_point in ((camera_x / 2, camera_x / 2), (0., float(camera_x)), (float(camera_x), 0.)):
+            # The baseline is timed with tracing the contour, which the runs replaced
+            start_time = time.perf_counter()
+            reference = baseline_points(line_runs, crop_y, last_bottom_point, average_line_point)
+            times[0] += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            result = calculate_angle_numba(*line_runs, crop_y, last_bottom_point, average_line_point)
+            times[1] += time.perf_counter() - start_time
+
+            mismatch = False
+            for field, value, reference_value in zip(fields, result, reference):
+                value, reference_value = np.array(value, dtype=np.int64), np.array(reference_value, dtype=np.int64)
+                if not np.array_equal(value, reference_value):
+                    mismatches[field] += 1
+                    max_deviation = max(max_deviation, int(np.max(np.abs(value - reference_value))))
+                    mismatch = True
+            if mismatch and (single_gap(line_runs, np.amin(line_runs[0])) or single_gap(line_runs, np.amax(line_runs[0]))):
+                split_cases += 1
+            elif mismatch:
+                other_cases.append(i)
+            tested += 1
+
+    print(f"{tested} cases against the contour baseline, max deviation {max_deviation} px")
+    for field in fields:
+        print(f"{field:14s} {mismatches[field]} mismatches")
+    print(f"{split_cases} cases differ where the top or bottom row has one gap, the runs keep both sides complete")
+    print(f"{len(other_cases)} other cases, masks {sorted(set(other_cases))}")
+    print(f"baseline with contour: {times[0] / tested * 1e6:.1f} us, runs: {times[1] / tested * 1e6:.1f} us")
+
+if __name__ == "__main__":
+    main()
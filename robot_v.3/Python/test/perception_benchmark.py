@@ -0,0 +1,165 @@
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# Runs the line_cam and zone_cam frame processing over a fixed corpus and writes the p50 / p95 / p99 latency of every
+# stage as JSON. Arguments: [line corpus] [zone corpus] [output file], a corpus is a recording (.zip) or "synthetic".
+#   python3 perception_benchmark.py synthetic synthetic results.json
+
+main_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../main')
+arguments = [os.path.abspath(argument) if argument.endswith(".zip") or argument.endswith(".json") else argument for argument in sys.argv[1:]]
+os.chdir(main_folder)  # config.ini and the model paths are relative to main
+sys.path.insert(0, main_folder)
+
+import line_cam
+import zone_cam
+from Managers import StageTimer
+from camera import PicameraSource, synthetic_frame
+from inference import Classifier, Detector
+from mp_manager import state
+from recording import FrameReplay
+
+synthetic_frames = 300
+warmup_frames = 5
+
+line_model_path = '../../Ai/models/silver_zone_entry/silver_classify_s.onnx'
+zone_model_path = '../../Ai/models/ball_zone_s/ball_detect_s_edgetpu.tflite'
+sensor_size = (1536, 864)  # Full size frames the non native stream delivers before the CPU resize
+
+
+def load_corpus(corpus, size, crop_top=0):
+    # (image, recorded state) of every frame, synthetic frames keep the default state
+    if corpus.endswith(".zip"):
+        return [(image.copy(), state_values) for image, _, _, state_values in FrameReplay(corpus).frames()]
+    return [(synthetic_frame(size, frame_number)[crop_top:], {}) for frame_number in range(synthetic_frames)]
+
+
+def load_model(model_class, path, **kwargs):
+    # Inference is skipped with the reason in the results if the model or its runtime is not available
+    try:
+        return model_class(path, **kwargs), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def summary(times):
+    results = {}
+    for stage, stage_times in times.items():
+        stage_times = np.array(stage_times) * 1000
+        p50, p95, p99 = np.percentile(stage_times, (50, 95, 99))
+        results[stage] = {"runs": len(stage_times), "mean_ms": round(float(np.mean(stage_times)), 4), "p50_ms": round(float(p50), 4), "p95_ms": round(float(p95), 4),
+                          "p99_ms": round(float(p99), 4), "max_ms": round(float(np.max(stage_times)), 4)}
+    return results
+
+
+def run_frames(frames, process_frame, stage_timer):
+    # Runs all frames after a few untimed ones, which compile the numba functions
+    for i, (frame, state_values) in enumerate(frames[:warmup_frames] + frames):
+        if i == warmup_frames:
+            stage_timer.clear()
+
+        state.publish(**state_values)
+        image = frame.copy()
+
+        with stage_timer("total"):
+            process_frame(image, i)
+
+    return summary(stage_timer.times)
+
+
+########################################################################################################################
+# Line Cam
+########################################################################################################################
+
+
+def benchmark_line(corpus):
+    camera_x, camera_y = line_cam.camera_x, line_cam.camera_y
+    line_cam.update_color_values()
+
+    frames = load_corpus(corpus, (camera_x, camera_y))
+    model, model_error = load_model(Classifier, line_model_path)
+
+    state.publish(objective="follow_line")
+    stage_timer = StageTimer(enabled=True)
+    line_processor = line_cam.LineProcessor(stage_timer=stage_timer)
+    line_processor.similarity_every = 1  # The loop checks every 30th frame, every frame gives the similarity stage enough runs
+
+    # Conversion of the full size RGBA frame like the non native stream of the line camera
+    source = PicameraSource((camera_x, camera_y), native_stream=False, keep_raw=True)
+    raw = np.zeros((camera_y, camera_x, 4), dtype=np.uint8)
+    converted = np.zeros((camera_y, camera_x, 3), dtype=np.uint8)
+
+    def process_frame(image, frame_number):
+        raw_frame = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGBA), sensor_size)
+        with stage_timer("capture_conversion"):
+            source.convert(raw_frame, raw, converted)
+
+        line_processor.process(image, raw, frame_number, frame_number / 50)
+
+        # Runs in the silver worker thread in the loop
+        if model is not None:
+            with stage_timer("inference"):
+                line_cam.predict_silver(model, raw)
+
+    return {"corpus": corpus, "frames": len(frames), "shape": list(frames[0][0].shape), "inference_skipped": model_error,
+            "stages": run_frames(frames, process_frame, stage_timer)}
+
+
+########################################################################################################################
+# Zone Cam
+########################################################################################################################
+
+
+def benchmark_zone(corpus, zone_status):
+    camera_width, camera_height = zone_cam.camera_width, zone_cam.camera_height
+    crop_height = int(camera_height * .45)
+    zone_cam.update_color_values()
+
+    frames = load_corpus(corpus, (camera_width, camera_height), crop_height)
+    model, model_error = load_model(Detector, zone_model_path, conf=0.3, iou=0.2)
+    if model is None and zone_status == "find_balls":
+        return {"corpus": corpus, "zone_status": zone_status, "skipped": model_error}
+
+    # The recorded states are replaced by the zone status of this pass
+    frames = [(frame, dict(state_values, objective="zone", zone_status=zone_status)) for frame, state_values in frames]
+    stage_timer = StageTimer(enabled=True)
+    zone_processor = zone_cam.ZoneProcessor(model, stage_timer=stage_timer)
+    zone_processor.similarity_every = 1  # The loop checks every 10th frame, every frame gives the similarity stage enough runs
+
+    # Crop and conversion of the RGBA preview frame like the non native stream of the zone camera
+    source = PicameraSource((camera_width, camera_height), native_stream=False, crop_top=crop_height)
+    converted = np.zeros(source.image_shape, dtype=np.uint8)
+    raw_frame = np.zeros((camera_height, camera_width, 4), dtype=np.uint8)
+
+    def process_frame(image, frame_number):
+        raw_frame[crop_height:] = cv2.cvtColor(image, cv2.COLOR_BGR2RGBA)
+        with stage_timer("capture_conversion"):
+            source.convert(raw_frame, None, converted)
+
+        zone_processor.process(image, frame_number / 30)
+
+    return {"corpus": corpus, "zone_status": zone_status, "frames": len(frames), "shape": list(frames[0][0].shape),
+            "stages": run_frames(frames, process_frame, stage_timer)}
+
+
+def main():
+    line_corpus = arguments[0] if len(arguments) > 0 else "synthetic"
+    zone_corpus = arguments[1] if len(arguments) > 1 else "synthetic"
+
+    results = {"time": time.strftime('%Y-%m-%d %H:%M:%S'), "machine": platform.machine(), "python": platform.python_version(), "opencv": cv2.__version__,
+               "line": benchmark_line(line_corpus), "zone_balls": benchmark_zone(zone_corpus, "find_balls"), "zone_deposit": benchmark_zone(zone_corpus, "deposit_red")}
+
+    output = json.dumps(results, indent=2)
+    if len(arguments) > 2:
+        with open(arguments[2], "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, '../main')
+from similarity import metrics
+
+# Stuck thresholds of the SSIM metric, the thresholds of the other metrics are calibrated against them
+ssim_thresholds = {"line_threshold": .88, "zone_threshold": .95}
+
+
+def synthetic_pairs(count=200, shape=(264, 640)):
+    # Blurred noise scene, compared with shifted copies: 0 px shift is a stuck robot, large shifts a moving one
+    rng = np.random.default_rng(0)
+    scene = cv2.GaussianBlur(rng.integers(0, 256, (shape[0], shape[1] + 100), dtype=np.uint8), (0, 0), 4)
+
+    pairs = []
+    for _ in range(count):
+        shift = rng.integers(0, 60)
+        image_a = scene[:, :shape[1]]
+        image_b = np.clip(scene[:, shift:shift + shape[1]] + rng.normal(0, rng.uniform(0, 8), shape), 0, 255).astype(np.uint8)
+        pairs.append((image_a, image_b))
+    return pairs
+
+
+def image_pairs(folder, step):
+    # Recorded frames of a run, every frame is compared with the one step frames later like in the camera loops
+    files = sorted(file for file in os.listdir(folder) if file.endswith((".png", ".jpg")))
+    images = [cv2.imread(os.path.join(folder, file), cv2.IMREAD_GRAYSCALE) for file in files]
+    return [(images[i], images[i + step]) for i in range(len(images) - step)]
+
+
+def main():
+    if len(sys.argv) > 1:
+        pairs = image_pairs(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    else:
+        pairs = synthetic_pairs()
+
+    values = {name: np.array([metric(image_a, image_b) for image_a, image_b in pairs]) for name, metric in metrics.items()}
+
+    order = np.argsort(values["ssim"])
+    ssim_values = values["ssim"][order]
+
+    for name, metric in metrics.items():
+        image_a, image_b = pairs[0]
+        start_time = time.perf_counter()
+        for _ in range(50):
+            metric(image_a, image_b)
+        metric_time = (time.perf_counter() - start_time) / 50 * 1000
+
+        correlation = np.corrcoef(values["ssim"], values[name])[0, 1]
+        thresholds = ", ".join(f"{key} = {np.interp(threshold, ssim_values, values[name][order]):.3f}" for key, threshold in ssim_thresholds.items())
+        print(f"{name:16s} {metric_time:6.2f} ms  correlation {correlation:.3f}  {thresholds}")
+
+
+if __name__ == "__main__":
+    main()
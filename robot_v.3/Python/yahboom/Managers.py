@@ -1,9 +1,9 @@
 import configparser
+import heapq
+import itertools
 import json
 import time
 
-import numpy as np
-
 
 class ConfigManager:
     def __init__(self, config_file):
@@ -32,26 +32,37 @@ class ConfigManager:
 
 
 class Timer:
+    # Timers are stored as end times on the monotonic perf_counter clock, so getting one is a single dict lookup.
+    # Timers set with a callback are also pushed onto a heap and the callback runs once they expired.
     def __init__(self):
-        self.__timer_arr = np.array([["none", 1, 0, 0]])
+        self.__end_times = {}
+        self.__callbacks = []  # Heap of (end_time, order, name, callback)
+        self.__order = itertools.count()
 
     def remove_timer(self, name):
-        self.__timer_arr = self.__timer_arr[np.where(self.__timer_arr[:, 0] != name)]
+        self.__end_times.pop(name, None)
+
+    def set_timer(self, name, set_time, callback=None):
+        end_time = time.perf_counter() + set_time
+        self.__end_times[name] = end_time
 
-    def set_timer(self, name, set_time):
-        self.remove_timer(name)
-        self.__timer_arr = np.append(self.__timer_arr, [[name, time.perf_counter(), set_time, False]], axis=0)
+        if callback is not None:
+            heapq.heappush(self.__callbacks, (end_time, next(self.__order), name, callback))
 
-    def __update_timer(self):
-        for i, timer in enumerate(self.__timer_arr):
-            if not timer[0] == "none":
-                self.__timer_arr[i, 3] = (time.perf_counter() - float(timer[1])) > float(timer[2])
+    def run_callbacks(self):
+        now = time.perf_counter()
+        while self.__callbacks and self.__callbacks[0][0] < now:
+            end_time, _, name, callback = heapq.heappop(self.__callbacks)
+
+            # Skip callbacks of timers that were removed or set again in the meantime
+            if self.__end_times.get(name) == end_time:
+                callback()
 
     def get_timer(self, name):
-        self.__update_timer()
-        time_val = self.__timer_arr[np.where(self.__timer_arr[:, 0] == name), 3]
+        if self.__callbacks:
+            self.run_callbacks()
 
-        if time_val.size > 0:
-            return time_val[0][0] == "True"
-        else:
+        end_time = self.__end_times.get(name)
+        if end_time is None:
             return False
+        return time.perf_counter() > end_time